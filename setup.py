@@ -12,12 +12,16 @@ setup(
     entry_points={
         'console_scripts': [
             'train=herbariumtools.train:run',
+            'train-ddp=herbariumtools.train_ddp:run',
             'validate=herbariumtools.validate:run',
             'predict=herbariumtools.predict:run',
             'explain=herbariumtools.explain:run',
             'swaify=herbariumtools.swaify:run',
+            'export-model=herbariumtools.export_model:run',
+            'extract-features=herbariumtools.extract_features:run',
             'grid-search=herbariumtools.grid_search:run',
             'prepare-data=herbariumtools.prepare_data:run',
+            'build-cache=herbariumtools.build_cache:run',
             'find-lr=herbariumtools.find_lr:run',
             'dsviewer=herbariumtools.dsviewer:run',
             'dsinfo=herbariumtools.dsinfo:run',
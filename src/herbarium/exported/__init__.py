@@ -0,0 +1,4 @@
+from .metadata import METADATA_NAME, make_metadata
+
+from .scripted import torchscript, save_torchscript
+from .runtime import onnxruntime, save_onnx
@@ -0,0 +1,25 @@
+import json
+
+
+# the exported files carry enough about the model to fill in the attributes the nodes use;
+#  in the torchscript archive as an extra file, in the onnx model as metadata properties
+METADATA_NAME = "herbarium.json"
+
+
+def make_metadata(model, height, width):
+    return {
+        'fullname': model.fullname,
+        'num_outputs': model.num_outputs,
+        'height': height,
+        'width': width,
+    }
+
+
+def dump_metadata(metadata):
+    return json.dumps(metadata)
+
+
+def parse_metadata(data):
+    if data is None or len(data) == 0:
+        return {}
+    return json.loads(data)
@@ -0,0 +1,72 @@
+import inspect
+import warnings
+
+import numpy as np
+import torch
+
+from .metadata import METADATA_NAME, dump_metadata, parse_metadata
+
+
+def save_onnx(model, model_file, example, metadata):
+    # the dynamo exporter, the default from torch 2.9, needs onnxscript; the torchscript
+    #  based exporter handles these models and is the only one in older versions
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with torch.no_grad():
+            torch.onnx.export(model.eval(), (example,), model_file,
+                                input_names=["image"], output_names=["output"],
+                                dynamic_axes={"image": {0: "batch"}, "output": {0: "batch"}},
+                                **kwargs)
+    
+    # an optional dependency; only needed to add the metadata
+    import onnx
+    
+    onnx_model = onnx.load(model_file)
+    onnx.helper.set_model_props(onnx_model, {METADATA_NAME: dump_metadata(metadata)})
+    onnx.save(onnx_model, model_file)
+
+
+# Runs a model written by 'export-model -f onnx' with ONNX Runtime on the CPU. It takes and
+#  returns torch tensors so it can be used in place of a model in the pipeline nodes.
+class OnnxModel:
+    def __init__(self, session):
+        self._session = session
+        self._input = session.get_inputs()[0].name
+        self._output = session.get_outputs()[0].name
+
+    def eval(self):
+        return self
+
+    def __call__(self, inputs):
+        inputs = np.ascontiguousarray(inputs.cpu().numpy())
+        outputs = self._session.run([self._output], {self._input: inputs})[0]
+        return torch.from_numpy(outputs)
+
+
+def onnxruntime(model_file, *, num_threads=0):
+    # an optional dependency; only needed for this backend
+    import onnxruntime as ort
+    
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    
+    session = ort.InferenceSession(model_file, sess_options=options, providers=["CPUExecutionProvider"])
+    
+    metadata = session.get_modelmeta().custom_metadata_map
+    metadata = parse_metadata(metadata.get(METADATA_NAME, None))
+    
+    model = OnnxModel(session)
+    
+    # set extra attributes on the model
+    model.device = torch.device('cpu')
+    model.num_outputs = metadata.get('num_outputs', session.get_outputs()[0].shape[-1])
+    model.memory_format = None
+    model.exported = True
+    
+    model.fullname = metadata.get('fullname', "herbarium.model") + ".onnx"
+    
+    return model
@@ -0,0 +1,43 @@
+import warnings
+
+import torch
+
+from .metadata import METADATA_NAME, dump_metadata, parse_metadata
+
+
+def save_torchscript(model, model_file, example, metadata):
+    # traced rather than scripted; the torchvision models are traceable and the ensemble
+    #  isn't scriptable
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        with torch.no_grad():
+            traced = torch.jit.trace(model.eval(), example)
+        
+        torch.jit.save(traced, model_file, _extra_files={METADATA_NAME: dump_metadata(metadata)})
+    
+    return traced
+
+
+# Loads a model written by 'export-model -f torchscript'. The graph and weights are loaded
+#  directly, so there is no architecture to build and initialise, and torchvision isn't
+#  needed.
+def torchscript(model_file, *, use_gpu=False):
+    device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
+    
+    extra_files = {METADATA_NAME: ""}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model = torch.jit.load(model_file, map_location=device, _extra_files=extra_files)
+    model.eval()
+    
+    metadata = parse_metadata(extra_files[METADATA_NAME])
+    
+    # set extra attributes on the model
+    model.device = device
+    model.num_outputs = metadata.get('num_outputs', None)
+    model.memory_format = None
+    model.exported = True
+    
+    model.fullname = metadata.get('fullname', "herbarium.model") + ".torchscript"
+    
+    return model
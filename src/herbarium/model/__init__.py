@@ -1,6 +1,10 @@
-from .utils import save_state, load_state, load_state_file
+from .utils import save_state, make_state, load_state, load_state_file, read_state_file, restore_state, average_state_files
+from .checkpoint import CheckpointManager
 
 from .ensemble import ensemble
+from .tta import tta
+from .head import head
+from .distributed import distributed, unwrap
 
 from .mobilenet_v3 import mobilenet_v3_small, mobilenet_v3_large
 from .efficientnet_v2 import efficientnet_v2_s, efficientnet_v2_m, efficientnet_v2_l
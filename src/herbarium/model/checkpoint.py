@@ -0,0 +1,176 @@
+import sys, os
+import time
+import threading
+
+import torch
+
+
+def to_cpu(state):
+    # a copy of the state, with the tensors on the cpu, so the training can carry on changing
+    #  the originals while the copy is written
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {k: to_cpu(v) for k, v in state.items()}
+    if isinstance(state, list):
+        return [to_cpu(v) for v in state]
+    if isinstance(state, tuple):
+        return tuple(to_cpu(v) for v in state)
+    return state
+
+
+def strip_state(state):
+    # just the weights; without the optimizer the training can't be resumed from it either
+    return {k: v for k, v in state.items() if k not in ('optimizer', 'training')}
+
+
+def atomic_save(state, state_file):
+    # written to a temporary file that's renamed over the state file once it's on the disk,
+    #  so the state file is always either the old one or the complete new one
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "wb") as fd:
+        torch.save(state, fd)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_file, state_file)
+
+    # and the rename itself
+    state_dir = os.path.dirname(os.path.abspath(state_file))
+    dir_fd = os.open(state_dir, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+    return os.path.getsize(state_file)
+
+
+# Writes the checkpoints of a run. The state is copied to the cpu in the training loop, which
+#  is all the loop waits for, and written from a background thread with atomic_save. One
+#  checkpoint is written at a time, so at most one copy of the state is held; a save waits for
+#  the one before it.
+#
+# With keep_last, the last keep_last checkpoints are kept, and with keep_best, the keep_best
+#  with the lowest metric; the others are removed once the newer one is written. Checkpoints
+#  saved only to resume from are kept apart: just the latest of them is kept, and they always
+#  hold the optimizer. With neither set, every checkpoint is kept.
+class CheckpointManager:
+    def __init__(self, state_dir, *, keep_last=0, keep_best=0, strip_optimizer=False, background=True):
+        self._state_dir = state_dir
+        self._keep_last = keep_last
+        self._keep_best = keep_best
+        self._strip_optimizer = strip_optimizer
+        self._background = background
+
+        # name, metric and kind of the checkpoints kept, oldest first
+        self._checkpoints = []
+
+        self._thread = None
+        self._error = None
+
+        self._count = 0
+        self._copy_time = 0.0
+        self._write_time = 0.0
+        self._size = 0
+
+    def state_dict(self):
+        return {'checkpoints': [dict(c) for c in self._checkpoints]}
+
+    def load_state_dict(self, state):
+        self._checkpoints = [dict(c) for c in state['checkpoints']]
+
+    def save(self, state, name, *, metric=None, resume_only=False, strip_optimizer=None, verbose=True):
+        self.wait()
+
+        os.makedirs(self._state_dir, exist_ok=True)
+        state_file = os.path.join(self._state_dir, name + ".pt")
+        if verbose:
+            print(f"Saving state to {state_file}")
+
+        if strip_optimizer is None:
+            strip_optimizer = self._strip_optimizer and resume_only == False
+        if strip_optimizer:
+            state = strip_state(state)
+
+        start = time.perf_counter()
+        state = to_cpu(state)
+        self._copy_time += time.perf_counter() - start
+
+        removed = self._retain(name, metric, resume_only)
+
+        # the checkpoints kept, this one included, go in with the training state so a resumed
+        #  run carries on pruning them
+        if 'training' in state:
+            state['training']['checkpoints'] = self.state_dict()
+
+        if self._background:
+            self._thread = threading.Thread(target=self._write, args=(state, state_file, removed), name="checkpoint-writer")
+            self._thread.start()
+        else:
+            self._write(state, state_file, removed)
+            self.wait()
+
+        return state_file
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        self.wait()
+
+    def stats(self):
+        if self._count == 0:
+            return None
+
+        return {
+            'count': self._count,
+            'copy_time': self._copy_time / self._count,
+            'write_time': self._write_time / self._count,
+            'size': self._size / self._count,
+        }
+
+    def _retain(self, name, metric, resume_only):
+        self._checkpoints = [c for c in self._checkpoints if c['name'] != name]
+        self._checkpoints.append({'name': name, 'metric': metric, 'resume_only': resume_only})
+
+        if self._keep_last <= 0 and self._keep_best <= 0:
+            return []
+
+        resumes = [c for c in self._checkpoints if c['resume_only']]
+        snapshots = [c for c in self._checkpoints if c['resume_only'] == False]
+
+        keep = set(c['name'] for c in resumes[-1:])
+        if self._keep_last > 0:
+            keep.update(c['name'] for c in snapshots[-self._keep_last:])
+        if self._keep_best > 0:
+            scored = [c for c in snapshots if c['metric'] is not None]
+            scored.sort(key=lambda c: c['metric'])
+            keep.update(c['name'] for c in scored[:self._keep_best])
+
+        removed = [c['name'] for c in self._checkpoints if c['name'] not in keep]
+        self._checkpoints = [c for c in self._checkpoints if c['name'] in keep]
+
+        return removed
+
+    def _write(self, state, state_file, removed):
+        try:
+            start = time.perf_counter()
+            size = atomic_save(state, state_file)
+            self._write_time += time.perf_counter() - start
+            self._size += size
+            self._count += 1
+
+            for name in removed:
+                old_file = os.path.join(self._state_dir, name + ".pt")
+                if os.path.exists(old_file):
+                    os.remove(old_file)
+
+        except Exception as e:
+            print(f"Error: failed to write {state_file}: {e}", file=sys.stderr)
+            self._error = e
@@ -0,0 +1,31 @@
+import torch
+from torch.nn.parallel import DistributedDataParallel
+
+from herbarium.utils.distributed import is_distributed
+
+
+# Wraps a model in DistributedDataParallel for training, keeping the attributes the nodes use.
+#  The model's parameters are broadcast from rank 0 when it's wrapped, and the gradients are
+#  averaged across the ranks in the backward pass. Without a process group, the model is
+#  returned as it is.
+def distributed(model, *, find_unused_parameters=False):
+    if is_distributed() == False:
+        return model
+
+    device_ids = None
+    if model.device.type == "cuda":
+        device_ids = [torch.cuda.current_device()]
+
+    wrapped = DistributedDataParallel(model, device_ids=device_ids, find_unused_parameters=find_unused_parameters)
+
+    # set extra attributes on the model
+    wrapped.fullname = model.fullname + ".ddp"
+    wrapped.device = model.device
+    wrapped.num_outputs = model.num_outputs
+    wrapped.memory_format = getattr(model, "memory_format", None)
+
+    return wrapped
+
+
+def unwrap(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
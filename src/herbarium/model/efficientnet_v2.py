@@ -3,10 +3,10 @@ import torch.nn as nn
 import torch.optim.swa_utils as swa_utils
 import torchvision.models
 
-from .utils import load_state_file
+from .utils import load_state_file, set_execution_mode
 
 
-def _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu):
+def _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap):
 
     # update the final classifier
     out_features = model.classifier[-1].out_features
@@ -17,7 +17,7 @@ def _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu):
     
     # load any weights file
     if weights_file is not None:
-        _, model, _ = load_state_file(model, None, weights_file)
+        _, model, _ = load_state_file(model, None, weights_file, mmap=mmap)
     
     # move the model to the device
     device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
@@ -27,10 +27,13 @@ def _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu):
     model.device = device
     model.num_outputs = num_categories
     
+    model = set_execution_mode(model, memory_format=memory_format, compile=compile)
+    
     return model
 
 
-def efficientnet_v2_s(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def efficientnet_v2_s(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
     
     weights = None
@@ -38,7 +41,7 @@ def efficientnet_v2_s(num_categories, *, pretrained=True, weights_file=None, use
         weights = torchvision.models.EfficientNet_V2_S_Weights.IMAGENET1K_V1
 
     model = torchvision.models.efficientnet_v2_s(weights=weights)
-    model = _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu)
+    model = _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.efficientnet_v2_s"
     if isinstance(model, swa_utils.AveragedModel):
@@ -47,7 +50,8 @@ def efficientnet_v2_s(num_categories, *, pretrained=True, weights_file=None, use
     return model
 
 
-def efficientnet_v2_m(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def efficientnet_v2_m(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
     
     weights = None
@@ -55,7 +59,7 @@ def efficientnet_v2_m(num_categories, *, pretrained=True, weights_file=None, use
         weights = torchvision.models.EfficientNet_V2_M_Weights.IMAGENET1K_V1
 
     model = torchvision.models.efficientnet_v2_m(weights=weights)
-    model = _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu)
+    model = _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.efficientnet_v2_m"
     if isinstance(model, swa_utils.AveragedModel):
@@ -64,7 +68,8 @@ def efficientnet_v2_m(num_categories, *, pretrained=True, weights_file=None, use
     return model
 
 
-def efficientnet_v2_l(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def efficientnet_v2_l(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
     
     weights = None
@@ -72,7 +77,7 @@ def efficientnet_v2_l(num_categories, *, pretrained=True, weights_file=None, use
         weights = torchvision.models.EfficientNet_V2_L_Weights.IMAGENET1K_V1
 
     model = torchvision.models.efficientnet_v2_l(weights=weights)
-    model = _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu)
+    model = _tweak_efficientnet_v2(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.efficientnet_v2_l"
     if isinstance(model, swa_utils.AveragedModel):
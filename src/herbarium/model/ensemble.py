@@ -1,6 +1,11 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import torch
 import torch.nn as nn
 
+from .trunks import split_head, trunk_hash, FeatureCache
+
 
 reducers = {
     "mean": torch.mean,
@@ -10,43 +15,240 @@ reducers = {
 }
 
 
+# Runs each member model on the same inputs and reduces their outputs.
+#
+# With 'parallel', the members run at the same time: on the GPU each in its own stream, and on
+#  the CPU each in its own thread with the intra-op threads shared out between them. With
+#  'incremental', the outputs are reduced as each member finishes instead of being stacked
+#  first. The time each member takes is kept so slow ones can be spotted.
+#
+# With 'share_trunks', each member is split into its trunk and its head (the final linear
+#  layer), and members whose trunks have identical weights share a single run of the trunk;
+#  only the heads run separately. The trunks' features can also be cached on disk, in
+#  'feature_cache', for repeated runs over the same images.
 class Ensemble(nn.Module):
-    def __init__(self, num_categories, models, reducer):
+    def __init__(self, num_categories, models, reducer, *, parallel=False, incremental=False,
+                        share_trunks=False, feature_cache=None):
         super().__init__()
 
+        if incremental and reducers[reducer] is None:
+            raise ValueError(f"incremental reduction needs a reducer, not {reducer}")
+
         self._models = models
         self._reducer = reducers[reducer]
-        
+        self._reducer_name = reducer
+        self._parallel = parallel
+        self._incremental = incremental
+        self._device = torch.device('cpu')
+
         # freeze the model layers
         for model in self._models:
             model.eval()
             model.requires_grad_(False)
-        
+
+        # the modules run on the inputs and, for each member, the unit it uses and the head to
+        #  apply to the unit's outputs, if any
+        self._units = list(models)
+        self._digests = [None] * len(models)
+        self._members = [(idx, None) for idx in range(len(models))]
+
+        self._cache = None
+        if feature_cache is not None:
+            self._cache = FeatureCache(feature_cache)
+        if share_trunks or feature_cache is not None:
+            self._share_trunks()
+
+        # made when first needed
+        self._executor = None
+        self._streams = None
+
+        # per member timings; cuda timings are events resolved a batch later
+        self._latency = [0.0] * len(self._units)
+        self._batches = 0
+        self._events = []
+
         # a dummy classifier for the module
         self.classifier = nn.Linear(in_features=10, out_features=2)
 
     def to(self, device):
         for idx, model in enumerate(self._models):
             self._models[idx] = model.to(device)
+        for idx, unit in enumerate(self._units):
+            self._units[idx] = unit.to(device)
+        for idx, (unit, head) in enumerate(self._members):
+            if head is not None:
+                self._members[idx] = (unit, head.to(device))
+        self._device = torch.device(device)
         return super().to(device)
-    
+
+    def __getstate__(self):
+        # the thread pool, streams and events can't be copied; they're made again when needed
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_streams'] = None
+        state['_events'] = []
+        return state
+
+    def member_latencies(self):
+        self._resolve_events()
+
+        latencies = []
+        for idx, (unit, latency) in enumerate(zip(self._units, self._latency)):
+            name = getattr(unit, "fullname", type(unit).__name__)
+
+            heads = sum(1 for u, _ in self._members if u == idx)
+            if heads > 1:
+                name += f" (trunk of {heads})"
+
+            latencies.append((name, 1000 * latency / max(self._batches, 1)))
+
+        return latencies
+
+    def cache_stats(self):
+        if self._cache is None:
+            return None
+        return self._cache.hits, self._cache.misses
+
     def forward(self, inputs):
-        # collect outputs from all the models
-        outputs = []
-        for model in self._models:
-            outputs.append(model(inputs))
+        self._resolve_events()
+        self._batches += 1
 
-        # stack for dimensions: BATCH_SIZE, NMODELS, NCATS
+        # the tracer only sees the ops run on its own thread
+        if self._parallel == False or torch.jit.is_tracing():
+            outputs = (self._run(idx, inputs) for idx in range(len(self._units)))
+        elif self._device.type == "cuda":
+            outputs = self._run_streams(inputs)
+        else:
+            outputs = self._run_threads(inputs)
+
+        outputs = self._apply_heads(outputs)
+
+        if self._incremental:
+            return self._reduce_incremental(outputs)
+
+        # stack in member order for dimensions: BATCH_SIZE, NMODELS, NCATS
+        outputs = [output for _, output in sorted(outputs, key=lambda o: o[0])]
         outputs = torch.stack(outputs, dim=1)
         if self._reducer:
             outputs = self._reducer(outputs, dim=1)
-        
+
         return outputs
 
+    def _reduce_incremental(self, outputs):
+        reduced = None
+        for _, output in outputs:
+            if reduced is None:
+                reduced = output
+            elif self._reducer_name == "max":
+                reduced = torch.maximum(reduced, output)
+            else:
+                reduced = reduced + output
+
+        if self._reducer_name == "mean":
+            reduced = reduced / len(self._models)
+
+        return reduced
+
+    def _apply_heads(self, outputs):
+        for unit_idx, output in outputs:
+            for idx, (unit, head) in enumerate(self._members):
+                if unit == unit_idx:
+                    yield idx, output if head is None else head(output)
+
+    def _run(self, idx, inputs):
+        if self._device.type == "cuda":
+            start = torch.cuda.Event(enable_timing=True)
+            end = torch.cuda.Event(enable_timing=True)
+            start.record()
+            output = self._run_unit(idx, inputs)
+            end.record()
+            self._events.append((idx, start, end))
+        else:
+            start = time.perf_counter()
+            output = self._run_unit(idx, inputs)
+            self._latency[idx] += time.perf_counter() - start
+
+        return idx, output
+
+    def _run_unit(self, idx, inputs):
+        if self._cache is None or torch.jit.is_tracing():
+            return self._units[idx](inputs)
+        return self._cache.features(self._units[idx], self._digests[idx], inputs)
+
+    def _share_trunks(self):
+        units = []
+        digests = []
+        members = []
+        for model in self._models:
+            head = split_head(model)
+            digest = trunk_hash(model)
+            if digest not in digests:
+                units.append(model)
+                digests.append(digest)
+            members.append((digests.index(digest), head))
+
+        self._units = units
+        self._digests = digests
+        self._members = members
+
+        print(f"ensemble: {len(units)} trunks for {len(members)} models")
+
+    def _run_threads(self, inputs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(len(self._units))
+
+        # torch's thread count is process wide, not per thread, so it's lowered only while the
+        #  members run, for each to get its share of the threads, and put back before the heads
+        #  and the reduction run on this thread
+        saved_threads = torch.get_num_threads()
+        num_threads = max(1, saved_threads // len(self._units))
+
+        # grad mode is per thread
+        grad_enabled = torch.is_grad_enabled()
+
+        def run(idx):
+            with torch.set_grad_enabled(grad_enabled):
+                return self._run(idx, inputs)
+
+        torch.set_num_threads(num_threads)
+        try:
+            futures = [self._executor.submit(run, idx) for idx in range(len(self._units))]
+            results = [future.result() for future in as_completed(futures)]
+        finally:
+            torch.set_num_threads(saved_threads)
+
+        yield from results
+
+    def _run_streams(self, inputs):
+        if self._streams is None:
+            self._streams = [torch.cuda.Stream(self._device) for _ in self._units]
+
+        current = torch.cuda.current_stream(self._device)
+
+        results = []
+        for idx, stream in enumerate(self._streams):
+            stream.wait_stream(current)
+            with torch.cuda.stream(stream):
+                inputs.record_stream(stream)
+                results.append(self._run(idx, inputs))
+
+        for stream, (idx, output) in zip(self._streams, results):
+            current.wait_stream(stream)
+            output.record_stream(current)
+            yield idx, output
+
+    def _resolve_events(self):
+        for idx, start, end in self._events:
+            end.synchronize()
+            self._latency[idx] += start.elapsed_time(end) / 1000
+        self._events = []
+
+
+def ensemble(num_categories, models, *, reducer="mean", parallel=False, incremental=False,
+                    share_trunks=False, feature_cache=None, use_gpu=False):
+    model = Ensemble(num_categories, models, reducer=reducer, parallel=parallel, incremental=incremental,
+                        share_trunks=share_trunks, feature_cache=feature_cache)
 
-def ensemble(num_categories, models, *, reducer="mean", use_gpu=False):
-    model = Ensemble(num_categories, models, reducer=reducer)
-    
     device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
     model = model.to(device)
 
@@ -56,4 +258,3 @@ def ensemble(num_categories, models, *, reducer="mean", use_gpu=False):
     model.num_outputs = num_categories
 
     return model
-
@@ -0,0 +1,39 @@
+import torch
+import torch.nn as nn
+import torch.optim.swa_utils as swa_utils
+
+from .utils import load_state_file
+
+
+# The final classifier on its own, for training on the features written by 'extract-features'.
+#  The features are stored as float16 and converted on the device.
+class Head(nn.Module):
+    def __init__(self, num_features, num_categories):
+        super().__init__()
+        self.fc = nn.Linear(num_features, num_categories)
+    
+    def forward(self, features):
+        return self.fc(features.to(self.fc.weight.dtype))
+
+
+def head(num_categories, *, num_features, weights_file=None, use_gpu=False):
+    model = Head(num_features, num_categories)
+    
+    # load any weights file; 'extract-features' writes the trained model's head as head.pt
+    if weights_file is not None:
+        _, model, _ = load_state_file(model, None, weights_file)
+    
+    # move the model to the device
+    device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
+    model = model.to(device)
+    
+    # set extra attributes on the model
+    model.device = device
+    model.num_outputs = num_categories
+    model.memory_format = None
+    
+    model.fullname = "herbarium.model.head"
+    if isinstance(model, swa_utils.AveragedModel):
+        model.fullname += ".swa"
+    
+    return model
@@ -6,10 +6,10 @@ import torch.nn as nn
 import torch.optim.swa_utils as swa_utils
 import torchvision.models
 
-from .utils import load_state_file
+from .utils import load_state_file, set_execution_mode
 
 
-def _tweak_mobilenet(model, num_categories, weights_file, use_gpu):
+def _tweak_mobilenet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap):
 
     # update the final classifier
     out_features = model.classifier[-1].out_features
@@ -20,7 +20,7 @@ def _tweak_mobilenet(model, num_categories, weights_file, use_gpu):
     
     # load any weights file
     if weights_file is not None:
-        _, model, _ = load_state_file(model, None, weights_file)
+        _, model, _ = load_state_file(model, None, weights_file, mmap=mmap)
     
     # move the model to the device
     device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
@@ -30,6 +30,8 @@ def _tweak_mobilenet(model, num_categories, weights_file, use_gpu):
     model.device = device
     model.num_outputs = num_categories
     
+    model = set_execution_mode(model, memory_format=memory_format, compile=compile)
+    
     model.named_param_groups = MethodType(_named_param_groups, model)
     model.param_groups = MethodType(_param_groups, model)
     
@@ -64,7 +66,8 @@ def _param_groups(self):
     return [p for _, p in self.named_param_groups()]
 
 
-def mobilenet_v3_small(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def mobilenet_v3_small(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
     
     weights = None
@@ -72,7 +75,7 @@ def mobilenet_v3_small(num_categories, *, pretrained=True, weights_file=None, us
         weights = torchvision.models.MobileNet_V3_Small_Weights.IMAGENET1K_V1
 
     model = torchvision.models.mobilenet_v3_small(weights=weights)
-    model = _tweak_mobilenet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_mobilenet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.mobilenet_v3_small"
     if isinstance(model, swa_utils.AveragedModel):
@@ -81,7 +84,8 @@ def mobilenet_v3_small(num_categories, *, pretrained=True, weights_file=None, us
     return model
 
 
-def mobilenet_v3_large(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def mobilenet_v3_large(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
 
     weights = None
@@ -89,7 +93,7 @@ def mobilenet_v3_large(num_categories, *, pretrained=True, weights_file=None, us
         weights = torchvision.models.MobileNet_V3_Large_Weights.IMAGENET1K_V2
 
     model = torchvision.models.mobilenet_v3_large(weights=weights)
-    model = _tweak_mobilenet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_mobilenet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.mobilenet_v3_large"
     if isinstance(model, swa_utils.AveragedModel):
@@ -0,0 +1,84 @@
+import copy
+import warnings
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+precisions = ["fp32", "bf16", "dynamic-int8", "static-int8"]
+
+
+# Inference copies of a model at reduced precision, for running on the CPU. The model passed
+#  in is left as it is; it's usually shared with other pipelines.
+#
+# - bf16 needs no copy; the nodes run the model under CPU autocast
+# - dynamic-int8 quantizes the weights of the linear layers, so mostly the classifier, and
+#    the activations on the fly
+# - static-int8 quantizes the whole network with FX graph mode, with the activation ranges
+#    calibrated by running some real batches through it
+
+def check_precision(precision, device):
+    if precision not in precisions:
+        raise ValueError(f"precision must be one of {precisions}, not {precision}")
+    if precision.endswith("int8") and device.type != "cpu":
+        raise ValueError(f"{precision} is only supported on the cpu, not {device.type}")
+
+
+def quantize_dynamic_int8(model):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        qmodel = quantize_dynamic(copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8)
+    
+    return qmodel
+
+
+def quantize_static_int8(model, batches, *, backend="x86"):
+    example_inputs = (batches[0],)
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        
+        qmodel = prepare_fx(copy.deepcopy(model).eval(), get_default_qconfig_mapping(backend), example_inputs)
+        with torch.no_grad():
+            for inputs in batches:
+                qmodel(inputs)
+        
+        qmodel = convert_fx(qmodel)
+    
+    return qmodel
+
+
+class InferenceRunner:
+    def __init__(self, model, precision="fp32", *, calibration_batches=8):
+        check_precision(precision, model.device)
+        if precision != "fp32" and getattr(model, "exported", False):
+            raise ValueError(f"exported models only run at fp32, not {precision}")
+
+        self.model = model
+        self.precision = precision
+        self.calibration_batches = calibration_batches
+        
+        self._qmodel = None
+    
+    def needs_calibration(self):
+        return self.precision == "static-int8"
+    
+    def prepare(self, calibration=None):
+        # called at the start of each pass as the weights may have changed since the last
+        self._qmodel = None
+        if self.precision == "dynamic-int8":
+            self._qmodel = quantize_dynamic_int8(self.model)
+        elif self.precision == "static-int8":
+            self._qmodel = quantize_static_int8(self.model, calibration)
+    
+    def __call__(self, inputs):
+        if self.precision == "bf16":
+            with torch.autocast(self.model.device.type, dtype=torch.bfloat16):
+                return self.model(inputs).float()
+        
+        if self._qmodel is not None:
+            return self._qmodel(inputs)
+        
+        return self.model(inputs)
@@ -3,10 +3,10 @@ import torch.nn as nn
 import torch.optim.swa_utils as swa_utils
 import torchvision.models
 
-from .utils import load_state_file
+from .utils import load_state_file, set_execution_mode
 
 
-def _tweak_resnet(model, num_categories, weights_file, use_gpu):
+def _tweak_resnet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap):
 
     # update the final classifier
     out_features = model.fc.out_features
@@ -17,7 +17,7 @@ def _tweak_resnet(model, num_categories, weights_file, use_gpu):
     
     # load any weights file
     if weights_file is not None:
-        _, model, _ = load_state_file(model, None, weights_file)
+        _, model, _ = load_state_file(model, None, weights_file, mmap=mmap)
     
     # move the model to the device
     device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
@@ -27,10 +27,13 @@ def _tweak_resnet(model, num_categories, weights_file, use_gpu):
     model.device = device
     model.num_outputs = num_categories
     
+    model = set_execution_mode(model, memory_format=memory_format, compile=compile)
+    
     return model
 
 
-def resnet18(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def resnet18(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
     
     weights = None
@@ -38,7 +41,7 @@ def resnet18(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fals
         weights = torchvision.models.ResNet18_Weights.IMAGENET1K_V1
 
     model = torchvision.models.resnet18(weights=weights)
-    model = _tweak_resnet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_resnet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.resnet18"
     if isinstance(model, swa_utils.AveragedModel):
@@ -47,7 +50,8 @@ def resnet18(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fals
     return model
 
 
-def resnet34(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def resnet34(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
 
     weights = None
@@ -55,7 +59,7 @@ def resnet34(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fals
         weights = torchvision.models.ResNet34_Weights.IMAGENET1K_V1
 
     model = torchvision.models.resnet34(weights=weights)
-    model = _tweak_resnet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_resnet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.resnet34"
     if isinstance(model, swa_utils.AveragedModel):
@@ -64,7 +68,8 @@ def resnet34(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fals
     return model
 
 
-def resnet50(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def resnet50(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
 
     weights = None
@@ -72,7 +77,7 @@ def resnet50(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fals
         weights = torchvision.models.ResNet50_Weights.IMAGENET1K_V2
 
     model = torchvision.models.resnet50(weights=weights)
-    model = _tweak_resnet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_resnet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.resnet50"
     if isinstance(model, swa_utils.AveragedModel):
@@ -81,7 +86,8 @@ def resnet50(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fals
     return model
 
 
-def resnet101(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def resnet101(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
 
     weights = None
@@ -89,7 +95,7 @@ def resnet101(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fal
         weights = torchvision.models.ResNet101_Weights.IMAGENET1K_V2
 
     model = torchvision.models.resnet101(weights=weights)
-    model = _tweak_resnet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_resnet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.resnet101"
     if isinstance(model, swa_utils.AveragedModel):
@@ -98,7 +104,8 @@ def resnet101(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fal
     return model
 
 
-def resnet152(num_categories, *, pretrained=True, weights_file=None, use_gpu=False):
+def resnet152(num_categories, *, pretrained=True, weights_file=None, use_gpu=False,
+                        memory_format=None, compile=False, mmap=False):
     pretrained = pretrained if weights_file is None else False
 
     weights = None
@@ -106,7 +113,7 @@ def resnet152(num_categories, *, pretrained=True, weights_file=None, use_gpu=Fal
         weights = torchvision.models.ResNet152_Weights.IMAGENET1K_V2
 
     model = torchvision.models.resnet152(weights=weights)
-    model = _tweak_resnet(model, num_categories, weights_file, use_gpu)
+    model = _tweak_resnet(model, num_categories, weights_file, use_gpu, memory_format, compile, mmap)
 
     model.fullname = "herbarium.model.resnet152"
     if isinstance(model, swa_utils.AveragedModel):
@@ -0,0 +1,119 @@
+import os
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+# Splitting models into a trunk, which computes the features, and a head, the final classifier,
+#  so models that differ only in their heads can share the trunk's work.
+
+def split_head(model):
+    # the head is the last linear layer; it's replaced in the model by an identity, so the
+    #  model then returns the features. Any layers before it stay in the trunk, so for models
+    #  with a deeper classifier, such as mobilenet_v3's linear, hardswish, dropout and linear,
+    #  the trunk includes the first three and only members with the same weights there share it
+    name, head = None, None
+    for n, m in model.named_modules():
+        if isinstance(m, nn.Linear):
+            name, head = n, m
+
+    if head is None:
+        raise ValueError(f"{getattr(model, 'fullname', type(model).__name__)} has no linear layer to split off")
+
+    parent_name, _, attr = name.rpartition('.')
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, attr, nn.Identity())
+
+    return head
+
+
+def trunk_hash(model):
+    # the architecture and all the weights; models with the same hash compute the same features
+    digest = hashlib.sha1(repr(model).encode())
+    for name, tensor in model.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+# A cache of the features computed by trunks, in an sqlite database, so repeated scoring runs
+#  over the same images skip the trunks. The features are keyed by the trunk's hash and a hash
+#  of the input image, so only deterministic pipelines (no random augmentation) get hits. They
+#  are stored as float16.
+class FeatureCache:
+    def __init__(self, path):
+        self._path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(self._path)
+        if len(cache_dir) > 0:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS features (key TEXT PRIMARY KEY, features BLOB)")
+        self._db.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return {'path': self._path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def features(self, trunk, digest, inputs):
+        keys = [digest + hashlib.sha1(sample.view(-1).view(torch.uint8).numpy().tobytes()).hexdigest()
+                    for sample in inputs.detach().cpu().contiguous()]
+
+        found = self._load(keys)
+        missing = [idx for idx, key in enumerate(keys) if key not in found]
+
+        # the parallel members look up their features at the same time
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        computed = None
+        if len(missing) > 0:
+            computed = trunk(inputs[torch.tensor(missing, device=inputs.device)])
+            self._save([keys[idx] for idx in missing], computed)
+
+            # rounded as they're stored so the results don't depend on what was cached
+            computed = computed.to(torch.float16).to(computed.dtype)
+            if len(missing) == len(keys):
+                return computed
+
+        cached = [idx for idx, key in enumerate(keys) if key in found]
+        cached_features = torch.from_numpy(np.stack([found[keys[idx]] for idx in cached]))
+
+        dtype = torch.float32 if computed is None else computed.dtype
+        features = torch.empty((len(keys), cached_features.shape[1]), dtype=dtype, device=inputs.device)
+        features[torch.tensor(cached, device=inputs.device)] = cached_features.to(inputs.device, dtype)
+        if computed is not None:
+            features[torch.tensor(missing, device=inputs.device)] = computed.flatten(1)
+
+        return features
+
+    def _load(self, keys):
+        found = {}
+        with self._lock:
+            # sqlite limits the number of parameters in a statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start+500]
+                rows = self._db.execute(f"SELECT key, features FROM features WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, data in rows:
+                    found[key] = np.frombuffer(data, dtype=np.float16).astype(np.float32)
+        return found
+
+    def _save(self, keys, features):
+        features = features.detach().flatten(1).to('cpu', torch.float16).numpy()
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO features (key, features) VALUES (?, ?)",
+                                    [(key, f.tobytes()) for key, f in zip(keys, features)])
+            self._db.commit()
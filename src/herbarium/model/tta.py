@@ -0,0 +1,39 @@
+import torch
+import torch.nn as nn
+
+from .ensemble import reducers
+
+
+# Reduces the outputs for the crops of each image from herbarium.nodes.data.MultiCrop, so a
+#  batch of B*num_crops crops gives B outputs and the reduction stays on the device.
+class TTA(nn.Module):
+    def __init__(self, model, num_crops, reducer):
+        super().__init__()
+        
+        self.model = model
+        self._num_crops = num_crops
+        self._reducer = reducers[reducer]
+    
+    def forward(self, inputs):
+        outputs = self.model(inputs)
+        if outputs.shape[0] % self._num_crops != 0:
+            raise ValueError(f"{outputs.shape[0]} outputs aren't whole images of {self._num_crops} crops")
+        
+        # dimensions: BATCH_SIZE, NCROPS, NCATS
+        outputs = outputs.unflatten(0, (-1, self._num_crops))
+        if self._reducer:
+            outputs = self._reducer(outputs, dim=1)
+        
+        return outputs
+
+
+def tta(model, *, num_crops, reducer="mean"):
+    wrapped = TTA(model, num_crops, reducer)
+    
+    # set extra attributes on the model
+    wrapped.fullname = model.fullname + ".tta"
+    wrapped.device = model.device
+    wrapped.num_outputs = model.num_outputs
+    wrapped.memory_format = getattr(model, "memory_format", None)
+    
+    return wrapped
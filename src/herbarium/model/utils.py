@@ -1,11 +1,21 @@
-import os
+import sys, os
 import random
+import inspect
 import numpy as np
 import torch
 import torch.optim.swa_utils as swa_utils
 
+from .checkpoint import atomic_save, strip_state
 
-def save_state(epoch, model, optimizer, name, *, state_dir=None, overwrite=False, verbose=True):
+
+# mmap and weights_only for torch.load, and assign for load_state_dict, came with later versions
+#  of torch than the one pinned
+_load_params = inspect.signature(torch.load).parameters
+_assign_params = inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+
+def save_state(epoch, model, optimizer, name, *, state_dir=None, overwrite=False, verbose=True,
+                    extra=None, strip_optimizer=False):
 
     # make sure the directory exists
     if state_dir is not None and not os.path.exists(state_dir):
@@ -24,11 +34,21 @@ def save_state(epoch, model, optimizer, name, *, state_dir=None, overwrite=False
             print("- file exists... skipping")
         return
     
+    state = make_state(epoch, model, optimizer, extra=extra)
+    if strip_optimizer:
+        state = strip_state(state)
+    
+    atomic_save(state, state_file)
+
+
+def make_state(epoch, model, optimizer, *, extra=None):
     state = { 'epoch': epoch }
     if model is not None:
         state['model'] = model.state_dict()
     if optimizer is not None:
         state['optimizer'] = optimizer.state_dict()
+    if extra is not None:
+        state.update(extra)
         
     state['python-random'] = random.getstate()
     state['numpy-random'] = np.random.get_state()
@@ -36,7 +56,7 @@ def save_state(epoch, model, optimizer, name, *, state_dir=None, overwrite=False
     if torch.cuda.is_available():
         state['torch-cuda-random'] = torch.cuda.get_rng_state()
     
-    torch.save(state, state_file)
+    return state
 
 
 def load_state(model, optimizer, name, *, state_dir=None, rng_state=True, device=None, verbose=True):
@@ -47,7 +67,7 @@ def load_state(model, optimizer, name, *, state_dir=None, rng_state=True, device
     return load_state_file(model, optimizer, state_file, rng_state=rng_state, device=device, verbose=verbose)
 
 
-def load_state_file(model, optimizer, state_file, *, rng_state=True, device=None, verbose=True):
+def load_state_file(model, optimizer, state_file, *, rng_state=True, device=None, verbose=True, mmap=False):
     if verbose:
         print(f"Loading state from {state_file}")
     
@@ -63,11 +83,39 @@ def load_state_file(model, optimizer, state_file, *, rng_state=True, device=None
         model = swa_utils.AveragedModel(model)
     
     # load the model, mapping parameters to the device we're on
-    state = torch.load(state_file, map_location=device)
+    state = read_state_file(state_file, device, mmap=mmap)
+    
+    # mapped for models only run for inference, such as ensemble members, whose parameters can
+    #  then be swapped for the mapped tensors rather than copied into
+    return restore_state(state, model, optimizer, rng_state=rng_state, assign=mmap and optimizer is None)
+
+
+def read_state_file(state_file, device, *, mmap=False):
+    kwargs = {}
+    
+    # the states hold numpy's random state, which the weights only unpickler rejects; they're
+    #  files we wrote, so they're trusted
+    if 'weights_only' in _load_params:
+        kwargs['weights_only'] = False
+    
+    # memory mapped, the tensors are paged in from the file when they're first used instead of
+    #  all being read up front. The pages are private, so changes to the tensors aren't written
+    #  back, and atomic_save renames a new file into place, so a mapped file is never rewritten
+    #  under its readers
+    if mmap and 'mmap' in _load_params:
+        kwargs['mmap'] = True
+    
+    return torch.load(state_file, map_location=device, **kwargs)
+
+
+def restore_state(state, model, optimizer, *, rng_state=True, assign=False):
     epoch = state['epoch']
     
     if model is not None and 'model' in state:
-        model.load_state_dict(state['model'])
+        if assign and 'assign' in _assign_params:
+            model.load_state_dict(state['model'], assign=True)
+        else:
+            model.load_state_dict(state['model'])
     
     if optimizer is not None and 'optimizer' in state:
         optimizer.load_state_dict(state['optimizer'])
@@ -85,3 +133,72 @@ def load_state_file(model, optimizer, state_file, *, rng_state=True, device=None
 
     return (epoch, model, optimizer)
 
+
+def average_state_files(model, state_files, *, device=None, verbose=True):
+    # averages the parameters of the models in the state files into the model's, one parameter
+    #  at a time across all the files, the way swa_utils.AveragedModel does file by file. The
+    #  files are memory mapped, so only the tensors being averaged are read in; with torch too
+    #  old to map them, they're averaged one file at a time instead
+    if device is None:
+        device = next(model.parameters()).device
+    
+    params = dict(model.named_parameters())
+    
+    with torch.no_grad():
+        if 'mmap' not in _load_params:
+            for count, state_file in enumerate(state_files):
+                if verbose:
+                    print(f"averaging {state_file}")
+                state = read_state_file(state_file, device)['model']
+                for name, param in params.items():
+                    _average(param, state[name], count)
+                del state
+            return model
+        
+        states = []
+        for state_file in state_files:
+            if verbose:
+                print(f"mapping {state_file}")
+            states.append(read_state_file(state_file, 'cpu', mmap=True)['model'])
+        
+        for name, param in params.items():
+            for count, state in enumerate(states):
+                _average(param, state[name].to(device), count)
+    
+    return model
+
+
+def _average(param, value, count):
+    if count == 0:
+        param.copy_(value)
+    else:
+        param.add_((value.to(param.dtype) - param) / (count + 1))
+
+
+
+memory_formats = {
+    "contiguous": torch.contiguous_format,
+    "channels_last": torch.channels_last,
+}
+
+
+def set_execution_mode(model, *, memory_format=None, compile=False):
+    # the nodes convert their inputs to the model's memory format
+    model.memory_format = None
+    if memory_format is not None:
+        if memory_format not in memory_formats:
+            raise ValueError(f"memory_format must be one of {list(memory_formats.keys())}, not {memory_format}")
+        model.memory_format = memory_formats[memory_format]
+        model = model.to(memory_format=model.memory_format)
+    
+    # compiled in place so the attributes and state dict keys are unchanged; 'compile' is
+    #  true for the default mode or the name of a mode
+    if compile:
+        if hasattr(model, "compile") == False:
+            print(f"warning: torch {torch.__version__} can't compile modules in place; running eager", file=sys.stderr)
+        elif isinstance(compile, str):
+            model.compile(mode=compile)
+        else:
+            model.compile()
+    
+    return model
@@ -1,2 +1,2 @@
-from .node import get_root, iter_fwd, iter_rev
+from .node import get_root, iter_fwd, iter_rev, pipeline_state, load_pipeline_state
 
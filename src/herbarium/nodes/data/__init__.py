@@ -1,10 +1,15 @@
 from .herbarium_dataset import HerbariumDataset
 from .glob_dataset import GlobDataset
+from .shard_dataset import ShardDataset
+from .cached_dataset import CachedDataset
+from .feature_dataset import FeatureDataset
 
 from .data_loader import DataLoader
 from .batch_loader import BatchLoader
 
 from .transformer import TorchvisionTransformer, AlbumentationsTransformer
 from .five_crop import FiveCrop
+from .multi_crop import MultiCrop
+from .batch_transformer import BatchTransformer
 
 from .batch_limiter import BatchLimiter
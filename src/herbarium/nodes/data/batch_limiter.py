@@ -3,6 +3,8 @@ import math
 import torch
 from torch.utils.data import IterableDataset, get_worker_info
 
+from herbarium.utils.distributed import get_world_size
+
 from ..node import Node
 
 
@@ -16,10 +18,15 @@ class BatchLimiter(IterableDataset, Node):
             self._batch_limit = 0
         self._batch_size = batch_size
         
-        if batch_limit is None or batch_limit == 0:
+        # the limit is for all the ranks together when training is distributed, so they share
+        #  the batches like the workers do
+        if self._batch_limit > 0:
+            self._batch_limit = math.ceil(self._batch_limit / get_world_size())
+        
+        if self._batch_limit == 0:
             self._length = len(inode)
         else:
-            self._length = min(batch_limit*batch_size, len(inode))
+            self._length = min(self._batch_limit*batch_size, len(inode))
     
     def __len__(self):
         return self._length
@@ -29,12 +36,17 @@ class BatchLimiter(IterableDataset, Node):
         if worker_info := get_worker_info():
             num_workers = worker_info.num_workers
         
+        # an epoch resumed part way through starts at the sampler's position
+        position = 0
+        if sampler := getattr(self.inode, "sampler", None):
+            position = sampler().position
+        
         count = len(self.inode)
         if self._batch_limit > 0:
-            count = min(self._batch_limit * self._batch_size, count)
+            count = min(max(self._batch_limit - position, 0) * self._batch_size, count)
         
         if self._batch_limit > 0 and num_workers > 1:
-            batches_per_worker = [len([i for i in range(x, self._batch_limit, num_workers)]) for x in range(num_workers)]
+            batches_per_worker = [len([i for i in range(position + x, self._batch_limit, num_workers)]) for x in range(num_workers)]
             count = batches_per_worker[worker_info.id] * self._batch_size
             
             if count == 0:
@@ -0,0 +1,41 @@
+import torch
+
+import herbarium.transforms as T
+
+from ..node import Node
+
+
+# Applies herbarium.transforms to whole batches after the DataLoader, on the training device.
+#  The workers only need to decode the images and convert them to uint8 tensors (ToTensorV2),
+#  and the images in a batch must be the same size to collate.
+class BatchTransformer(Node):
+    def __init__(self, inode, transforms, *, use_gpu=True):
+        super().__init__(inode)
+        
+        if isinstance(transforms, (list, tuple)):
+            transforms = T.Compose(transforms)
+        
+        self._transforms = transforms
+        self._device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
+        
+    def __len__(self):
+        return len(self.inode)
+
+    def __iter__(self):
+        for items in self.inode:
+            images = items['image'].to(self._device, non_blocking=True)
+            
+            with torch.no_grad():
+                items['image'] = images = self._transforms(images)
+            
+            # update the image width/height/channels info in case they've changed
+            items['orig_width'] = items['image_width']
+            items['orig_height'] = items['image_height']
+            items['orig_channels'] = items['image_channels']
+            
+            B, C, H, W = images.shape
+            items['image_channels'] = torch.full((B,), C)
+            items['image_height'] = torch.full((B,), H)
+            items['image_width'] = torch.full((B,), W)
+            
+            yield items
@@ -0,0 +1,64 @@
+import sys, os.path
+
+from PIL import Image
+import numpy as np
+
+from herbarium.utils import ArrayStore
+
+from .herbarium_dataset import HerbariumDataset
+from .decode import open_image
+
+
+# Serves the images from a cache of decoded and resized images built with 'build-cache'. The
+#  images are zero-copy views into a memory mapped array, so there is no JPEG decode and the
+#  workers share the page cache. Images not in the cache, or all images if the cache doesn't
+#  exist, are loaded from 'image_dir' as usual.
+class CachedDataset(HerbariumDataset):
+
+    def __init__(self, dsroot, split, batch_size, *, cache_dir="train_cache_500", image_dir="train_images",
+                            shuffle=True, shuffle_seed=331,
+                            nfolds=5, vfold=4,
+                            load_images=True, excludes=True,
+                            as_numpy=True, decode_size=None):
+
+        HerbariumDataset.__init__(self, dsroot, split, batch_size, image_dir=image_dir,
+                                    shuffle=shuffle, shuffle_seed=shuffle_seed,
+                                    nfolds=nfolds, vfold=vfold,
+                                    load_images=load_images, excludes=excludes,
+                                    as_numpy=as_numpy, decode_size=decode_size)
+
+        cache_dir = os.path.join(self._dsroot, cache_dir)
+
+        # the row in the cache of each row in the metadata index; -1 if not cached
+        self._cache = None
+        self._cache_rows = np.full(len(self._index), -1, dtype=np.int64)
+
+        if ArrayStore.exists(cache_dir):
+            self._cache = ArrayStore(cache_dir)
+
+            cache_ids = self._cache.ids()
+            if len(cache_ids) == 0:
+                raise ValueError(f"cache {cache_dir} is empty")
+            
+            rows = np.minimum(np.searchsorted(cache_ids, self._index.image_id), len(cache_ids)-1)
+            cached = (cache_ids[rows] == self._index.image_id) & self._cache.written()[rows]
+            self._cache_rows[cached] = rows[cached]
+        else:
+            print(f"cache: {cache_dir} doesn't exist; loading from {image_dir}", file=sys.stderr)
+
+    def __iter__(self):
+        for row in self._worker_rows().tolist():
+            item = self._make_item(row)
+
+            if self._load_images:
+                cache_row = self._cache_rows[row]
+                if cache_row < 0:
+                    self._set_image(item, open_image(item['image_path'], self._decode_size))
+                else:
+                    item['image'] = image = self._cache.data()[cache_row]
+                    if not self._as_numpy:
+                        item['image'] = Image.fromarray(image)
+
+                    item['image_height'], item['image_width'], item['image_channels'] = image.shape
+
+            yield item
@@ -0,0 +1,19 @@
+from PIL import Image
+
+
+def open_image(fp, decode_size=None):
+    image = Image.open(fp)
+    
+    # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale in the DCT; draft picks the smallest scale
+    #  that is still at least decode_size in both dimensions. No-op for other formats.
+    if decode_size is not None:
+        image.draft("RGB", as_size(decode_size))
+    
+    return image
+
+
+def as_size(size):
+    if isinstance(size, int):
+        return (size, size)
+    width, height = size
+    return (width, height)
@@ -0,0 +1,76 @@
+import sys, os.path
+
+import numpy as np
+import torch
+
+from herbarium.utils import ArrayStore
+
+from .herbarium_dataset import HerbariumDataset
+
+
+# Serves the features written by 'extract-features' for training and validating a head on
+#  its own. The features are rows of a memory mapped float16 array, so unlike the other
+#  datasets this yields whole batches, already collated, and doesn't need a DataLoader.
+#  Images without features, including rows a limited extraction didn't write, are left out.
+class FeatureDataset(HerbariumDataset):
+
+    def __init__(self, dsroot, split, batch_size, *, feature_dir="train_features",
+                            shuffle=True, shuffle_seed=331,
+                            nfolds=5, vfold=4,
+                            excludes=True,
+                            drop_last=False, batch_limit=0):
+
+        HerbariumDataset.__init__(self, dsroot, split, batch_size, 
+                                    shuffle=shuffle, shuffle_seed=shuffle_seed,
+                                    nfolds=nfolds, vfold=vfold,
+                                    load_images=False, excludes=excludes)
+        
+        self._drop_last = drop_last
+        self._batch_limit = batch_limit
+        
+        feature_dir = os.path.join(self._dsroot, feature_dir)
+        self._store = ArrayStore(feature_dir)
+        
+        # the row in the store of each row in the metadata index
+        store_ids = self._store.ids()
+        if len(store_ids) == 0:
+            raise ValueError(f"feature store {feature_dir} is empty")
+        
+        rows = np.minimum(np.searchsorted(store_ids, self._index.image_id), len(store_ids)-1)
+        present = (store_ids[rows] == self._index.image_id) & self._store.written()[rows]
+        self._feature_rows = np.where(present, rows, -1)
+        
+        present = self._feature_rows[self._images] >= 0
+        if present.all() == False:
+            print(f"features: {len(self._images) - present.sum()} images missing from {feature_dir}", file=sys.stderr)
+            self._images = self._images[present]
+            self._length = len(self._images)
+            self._sampler.set_length(self._length)
+    
+    def num_features(self):
+        return self._store.shape[1]
+    
+    def __len__(self):
+        num_batches = self._sampler.num_samples() // self._batch_size if self._drop_last else self._sampler.num_batches()
+        if self._batch_limit > 0:
+            num_batches = min(num_batches, self._batch_limit)
+        return num_batches
+
+    def __iter__(self):
+        index = self._index
+        data = self._store.data()
+        
+        rows = self._worker_rows()
+        for batch in range(len(self)):
+            brows = rows[batch*self._batch_size:(batch+1)*self._batch_size]
+            if len(brows) == 0 or (self._drop_last and len(brows) < self._batch_size):
+                break
+            
+            yield {
+                'image_id': index.image_id[brows].tolist(),
+                'category_id': torch.from_numpy(index.category_id[brows].astype(np.int64)),
+                'genus_id': torch.from_numpy(index.genus_id[brows].astype(np.int64)),
+                'institution_id': torch.from_numpy(index.institution_id[brows].astype(np.int64)),
+                'target': torch.from_numpy(index.category_id[brows].astype(np.int64)),
+                'features': torch.from_numpy(data[self._feature_rows[brows]]),
+            }
@@ -1,19 +1,20 @@
 import sys, os.path
 import re
 import glob
-import math
 
-from PIL import Image
 import numpy as np
 
-from torch.utils.data import IterableDataset, get_worker_info
+from torch.utils.data import IterableDataset
 
 from ..node import Node
+from .sampler import ShardedSampler
+from .decode import open_image
+from .manifest import glob_manifest
 
 
 class GlobDataset(IterableDataset, Node):
 
-    def __init__(self, dsroot, pattern, batch_size, *, load_images=True):
+    def __init__(self, dsroot, pattern, batch_size, *, load_images=True, decode_size=None):
         IterableDataset.__init__(self)
         Node.__init__(self, None)
 
@@ -21,40 +22,31 @@ class GlobDataset(IterableDataset, Node):
         self._pattern = pattern
         self._batch_size = batch_size
         self._load_images = load_images
+        self._decode_size = decode_size
         
         self._image_id_re = re.compile(r'test-(\d+)\.jpg$')
 
-        # load the images
-        images = set()
-        prefix_len = len(self._dsroot) + 1
-        full_pattern = os.path.join(self._dsroot, self._pattern)
-        for path in glob.iglob(full_pattern):
-            images.add(path[prefix_len:])
+        # load the images, from prepare-data's manifest if there is one
+        self._sizes = glob_manifest(self._dsroot, self._pattern)
+        if self._sizes is not None:
+            images = self._sizes.keys()
+        else:
+            images = set()
+            prefix_len = len(self._dsroot) + 1
+            full_pattern = os.path.join(self._dsroot, self._pattern)
+            for path in glob.iglob(full_pattern):
+                images.add(path[prefix_len:])
         
         self._images = list(images)
         self._images.sort()
         self._length = len(self._images)
+        self._sampler = ShardedSampler(self._length, self._batch_size, shuffle=False)
         
     def __len__(self):
         return self._length
 
     def __iter__(self):
-        worker_id = 0
-        num_workers = 1
-        if worker_info := get_worker_info():
-            worker_id = worker_info.id
-            num_workers = worker_info.num_workers
-        
-        num_batches = math.ceil(self._length/self._batch_size)
-        batches_per_worker = [len([i for i in range(x, num_batches, num_workers)]) for x in range(num_workers)]
-        
-        start_batch = sum([batches_per_worker[i] for i in range(worker_id)])
-        end_batch = start_batch + batches_per_worker[worker_id]
-        
-        start_idx = start_batch * self._batch_size
-        end_idx = min(end_batch * self._batch_size, self._length)
-        
-        for idx in range(start_idx, end_idx):
+        for idx in self._sampler.indices().tolist():
             image_name = self._images[idx]
             mo = self._image_id_re.search(image_name)
             if mo is None:
@@ -69,9 +61,12 @@ class GlobDataset(IterableDataset, Node):
                 'image_path' : os.path.join(self._dsroot, image_name),
             }
             
+            if self._sizes is not None:
+                item['image_width'], item['image_height'] = self._sizes[image_name][:2]
+            
             if self._load_images:
                 image_path = item['image_path']
-                item['image'] = image = np.asarray(Image.open(image_path).convert("RGB"))
+                item['image'] = image = np.asarray(open_image(image_path, self._decode_size).convert("RGB"))
                 item['image_height'], item['image_width'], item['image_channels'] = image.shape
 
             yield item
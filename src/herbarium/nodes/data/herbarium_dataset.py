@@ -1,15 +1,15 @@
 import sys, os.path
-import random, math
-import json
-from collections import defaultdict
-from itertools import islice
+import random
 
-from PIL import Image
 import numpy as np
 
-from torch.utils.data import IterableDataset, get_worker_info
+from torch.utils.data import IterableDataset
 
 from ..node import Node
+from .metadata_index import load_index
+from .decode import open_image
+from .manifest import read_manifest
+from .sampler import ShardedSampler
 
 
 class HerbariumDataset(IterableDataset, Node):
@@ -17,12 +17,12 @@ class HerbariumDataset(IterableDataset, Node):
     def __init__(self, dsroot, split, batch_size, *, image_dir="train_images", shuffle=True, shuffle_seed=331, 
                             nfolds=5, vfold=4,
                             load_images=True, excludes=True,
-                            as_numpy=True):
+                            as_numpy=True, decode_size=None):
 
         IterableDataset.__init__(self)
         Node.__init__(self, None)
         
-        valid_splits = ["train", "val"]
+        valid_splits = ["train", "val", "all"]
         if split not in valid_splits:
             raise ValueError(f"split must be one of {valid_splits}, not {split}")
         
@@ -32,73 +32,60 @@ class HerbariumDataset(IterableDataset, Node):
         self._batch_size = batch_size
         self._load_images = load_images
         self._as_numpy = as_numpy
+        self._decode_size = decode_size
         
-        excluded = set()
-        if excludes:
-            exclude_file = os.path.join(self._dsroot, "excludes.txt")
-            if os.path.exists(exclude_file):
-                with open(exclude_file) as fd:
-                    for line in fd:
-                        line = line.strip()
-                        if len(line) == 0 or line.startswith("#"):
-                            continue
-                        excluded.add(line)
-        
-        train_file = os.path.join(self._dsroot, "train_metadata.json")
-        with open(train_file) as fd:
-            train_data = json.load(fd)
-        
-        # load the categories
-        categories = {}
-        for cat in train_data['categories']:
-            cat['label'] = f"{cat['genus']} {cat['species']}".lower()
-            categories[cat['category_id']] = cat
-
-        # index annotations by category ... and fold them
-        annos_by_cat = defaultdict(list)
-        for anno in train_data['annotations']:
-            annos_by_cat[anno['category_id']].append(anno)
-        
-        for idx, (cat, annos) in enumerate(annos_by_cat.items()):
-            self._random.shuffle(annos)
-            folded = [[annos[i] for i in range(x, len(annos), nfolds)] for x in range(nfolds)]
-            
-            if split == "train":
-                del folded[vfold]
-                annos_by_cat[cat] = [f for fold in folded for f in fold]
-            else:
-                annos_by_cat[cat] = folded[vfold]
-        
-        annotations = {}
-        for cat, annos in annos_by_cat.items():
-            for anno in annos:
-                annotations[anno['image_id']] = anno
-
-        # load the images
-        images = []
-        for image in train_data['images']:
-            image_name = image['file_name']
-            if image_name in excluded:
-                continue
-            
-            image_id = image['image_id']
-            if anno := annotations.get(image_id, None):
-                images.append(image_id)
-                anno['image_name'] = image_name
-                anno['image_path'] = os.path.join(self._dsroot, image_dir, image_name)
+        excluded = load_excludes(self._dsroot) if excludes else set()
+        
+        index = load_index(self._dsroot, verbose=True)
+        
+        # select the split from the folds
+        folds, rng_state = index.folds(shuffle_seed, nfolds)
+        self._random.setstate(rng_state)
+        
+        if split == "train":
+            selected = (folds >= 0) & (folds != vfold)
+        elif split == "val":
+            selected = folds == vfold
+        else:
+            selected = folds >= 0
+        
+        if len(excluded) > 0:
+            selected &= ~np.isin(np.array(index.names()), list(excluded))
+        
+        # the images are kept as an array of rows in the index rather than python objects, so
+        #  the pages shared with forked workers aren't dirtied by reference counting
+        images = np.flatnonzero(selected)
         
         # randomly shuffle the images at least once
-        self._random.shuffle(images)
+        images = self._shuffled(images)
+        
+        # if the images were written by prepare-data, its manifest says which are there and
+        #  their sizes without touching the files
+        image_dir = os.path.join(self._dsroot, image_dir)
+        
+        self._sizes = None
+        if (manifest := read_manifest(image_dir)) is not None:
+            self._sizes = np.full((len(index), 2), -1, dtype=np.int32)
+            for row in images.tolist():
+                if (entry := manifest.get(index.name(row), None)) is not None:
+                    self._sizes[row] = entry[:2]
+            
+            present = self._sizes[images, 0] >= 0
+            if present.all() == False:
+                print(f"manifest: {len(images) - present.sum()} images missing from {image_dir}", file=sys.stderr)
+                images = images[present]
         
         # save the split data
+        self._index = index
+        self._image_dir = image_dir
         self._images = images
         self._length = len(self._images)
-        self._annotations = annotations
-        self._categories = categories
+        self._sampler = ShardedSampler(self._length, batch_size, shuffle=shuffle, seed=shuffle_seed)
+        self._categories = index.categories()
         self._num_categories = max(self._categories.keys()) + 1
         
     def image_ids(self):
-        return self._images
+        return self._index.image_id[self._images].tolist()
     
     def num_categories(self):
         return self._num_categories
@@ -110,41 +97,83 @@ class HerbariumDataset(IterableDataset, Node):
         return self._categories[category_id].copy()
     
     def shuffle(self):
+        # each epoch starts at the beginning, even after one resumed part way through
         if self._shuffle == False:
+            self._sampler.set_epoch(self._sampler.epoch)
             return
-        self._random.shuffle(self._images)
+        self._sampler.set_epoch(self._sampler.epoch + 1)
+    
+    def sampler(self):
+        return self._sampler
+    
+    def state_dict(self):
+        return {'sampler': self._sampler.state_dict()}
+    
+    def load_state_dict(self, state):
+        self._sampler.load_state_dict(state['sampler'])
+    
+    def _shuffled(self, images):
+        # shuffling a list of positions makes exactly the same random calls as shuffling
+        #  the list of image ids did
+        order = list(range(len(images)))
+        self._random.shuffle(order)
+        return images[order]
 
     def __len__(self):
-        return self._length
+        # this rank's share when training is distributed
+        return self._sampler.num_samples()
 
     def __iter__(self):
-        worker_id = 0
-        num_workers = 1
-        if worker_info := get_worker_info():
-            worker_id = worker_info.id
-            num_workers = worker_info.num_workers
+        for row in self._worker_rows().tolist():
+            item = self._make_item(row)
+
+            if self._load_images:
+                self._set_image(item, open_image(item['image_path'], self._decode_size))
+
+            yield item
+    
+    def _make_item(self, row):
+        index = self._index
         
-        num_batches = math.ceil(self._length/self._batch_size)
-        batches_per_worker = [len([i for i in range(x, num_batches, num_workers)]) for x in range(num_workers)]
+        image_name = index.name(row)
         
-        start_batch = sum([batches_per_worker[i] for i in range(worker_id)])
-        end_batch = start_batch + batches_per_worker[worker_id]
+        item = {
+            'image_id': index.image_id[row].item(),
+            'category_id': int(index.category_id[row]),
+            'genus_id': int(index.genus_id[row]),
+            'institution_id': int(index.institution_id[row]),
+            'image_name': image_name,
+            'image_path': os.path.join(self._image_dir, image_name),
+            'target': int(index.category_id[row]),
+        }
         
-        start_idx = start_batch * self._batch_size
-        end_idx = min(end_batch * self._batch_size, self._length)
+        if self._sizes is not None:
+            item['image_width'], item['image_height'] = self._sizes[row].tolist()
         
-        for idx in range(start_idx, end_idx):
-            image_id = self._images[idx]
-            item = self._annotations[image_id].copy()
-            
-            item['target'] = item['category_id']
+        return item
+    
+    def _worker_rows(self):
+        return self._images[self._sampler.indices()]
+    
+    def _set_image(self, item, image):
+        item['image'] = image = image.convert("RGB")
+        if self._as_numpy:
+            item['image'] = np.asarray(image)
+        
+        item['image_width'], item['image_height'], item['image_channels'] = image.width, image.height, 3
 
-            if self._load_images:
-                image_path = item['image_path']
-                item['image'] = image = Image.open(image_path).convert("RGB")
-                if self._as_numpy:
-                    item['image'] = np.asarray(image)
-                
-                item['image_width'], item['image_height'], item['image_channels'] = image.width, image.height, 3
 
-            yield item
+def load_excludes(dsroot):
+    # the names of images to leave out, one per line in 'excludes.txt'
+    excluded = set()
+    
+    exclude_file = os.path.join(dsroot, "excludes.txt")
+    if os.path.exists(exclude_file):
+        with open(exclude_file) as fd:
+            for line in fd:
+                line = line.strip()
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+                excluded.add(line)
+    
+    return excluded
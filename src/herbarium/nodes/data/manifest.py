@@ -0,0 +1,49 @@
+import os.path
+import csv
+import glob
+import fnmatch
+
+
+MANIFEST_NAME = "manifest.csv"
+
+
+# Reads the manifest 'prepare-data' writes to the root of its output: the name, relative to
+#  the root, and the width, height and bytes of every image. Returns None if there isn't one.
+def read_manifest(image_dir):
+    path = os.path.join(image_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    
+    manifest = {}
+    with open(path, newline="") as fd:
+        reader = csv.reader(fd)
+        next(reader)
+        for name, width, height, size in reader:
+            manifest[name] = (int(width), int(height), int(size))
+    
+    return manifest
+
+
+# Finds the images matching a glob pattern, relative to dsroot, from the manifest in the
+#  pattern's base directory. Returns None if there isn't a manifest.
+def glob_manifest(dsroot, pattern):
+    parts = pattern.split("/")
+    
+    base = []
+    while len(parts) > 1 and glob.has_magic(parts[0]) == False:
+        base.append(parts.pop(0))
+    base = "/".join(base)
+    
+    manifest = read_manifest(os.path.join(dsroot, base))
+    if manifest is None:
+        return None
+    
+    matches = {}
+    for name, entry in manifest.items():
+        nparts = name.split("/")
+        if len(nparts) != len(parts):
+            continue
+        if all(fnmatch.fnmatchcase(n, p) for n, p in zip(nparts, parts)):
+            matches[os.path.join(base, name)] = entry
+    
+    return matches
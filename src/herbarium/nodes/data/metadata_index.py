@@ -0,0 +1,190 @@
+import sys, os.path
+import json
+import hashlib
+import random
+from collections import defaultdict
+
+import numpy as np
+
+
+INDEX_VERSION = 1
+
+
+# A compiled, columnar version of train_metadata.json, saved next to it as an npz file and
+#  rebuilt when the json changes (checked by size and mtime, then by hash). The images are
+#  rows in the order of the json's images, with names kept in one string table.
+class MetadataIndex:
+
+    def __init__(self, arrays):
+        self.image_id = arrays['image_id']
+        self.category_id = arrays['category_id']
+        self.genus_id = arrays['genus_id']
+        self.institution_id = arrays['institution_id']
+        self.name_offsets = arrays['name_offsets']
+        self.name_data = arrays['name_data']
+        self.anno_rows = arrays['anno_rows']
+        self.json_sha1 = str(arrays['json_sha1'])
+
+        self._categories_json = str(arrays['categories'])
+        self._index_file = None
+
+    def __len__(self):
+        return len(self.image_id)
+
+    def categories(self):
+        categories = {}
+        for cat in json.loads(self._categories_json):
+            cat['label'] = f"{cat['genus']} {cat['species']}".lower()
+            categories[cat['category_id']] = cat
+        return categories
+
+    def name(self, row):
+        return self.name_data[self.name_offsets[row]:self.name_offsets[row+1]-1].tobytes().decode()
+
+    def names(self):
+        return self.name_data.tobytes().decode().split("\n")[:-1]
+
+    def folds(self, seed, nfolds):
+        # the folds depend on the seed, so are cached in their own file
+        fold_file = None
+        if self._index_file is not None:
+            fold_file = f"{os.path.splitext(self._index_file)[0]}.folds-{seed}-{nfolds}.npz"
+
+            if os.path.exists(fold_file):
+                with np.load(fold_file) as f:
+                    if int(f['version']) == INDEX_VERSION and str(f['json_sha1']) == self.json_sha1:
+                        return f['folds'], _unpack_rng_state(f['rng_state'])
+
+        folds, rng_state = self._build_folds(seed, nfolds)
+
+        if fold_file is not None:
+            _save_npz(fold_file, version=INDEX_VERSION, json_sha1=self.json_sha1,
+                        folds=folds, rng_state=_pack_rng_state(rng_state))
+
+        return folds, rng_state
+
+    def _build_folds(self, seed, nfolds):
+        # shuffle each category's annotations and deal them into folds, in exactly the same
+        #  order and with the same random calls as the original json based code
+        rng = random.Random(seed)
+
+        rows_by_cat = defaultdict(list)
+        for row in self.anno_rows.tolist():
+            rows_by_cat[int(self.category_id[row])].append(row)
+
+        folds = np.full(len(self), -1, dtype=np.int8)
+        for rows in rows_by_cat.values():
+            rng.shuffle(rows)
+            folds[rows] = np.arange(len(rows)) % nfolds
+
+        return folds, rng.getstate()
+
+
+def load_index(dsroot, *, verbose=False):
+    json_file = os.path.join(dsroot, "train_metadata.json")
+    index_file = os.path.join(dsroot, "train_metadata.index.npz")
+
+    stat = os.stat(json_file)
+    json_sha1 = None
+
+    if os.path.exists(index_file):
+        with np.load(index_file) as f:
+            arrays = {k: f[k] for k in f.files}
+
+        if int(arrays['version']) == INDEX_VERSION:
+            if int(arrays['json_mtime_ns']) == stat.st_mtime_ns and int(arrays['json_size']) == stat.st_size:
+                index = MetadataIndex(arrays)
+                index._index_file = index_file
+                return index
+
+            # touched but maybe not changed
+            json_sha1 = _sha1(json_file)
+            if str(arrays['json_sha1']) == json_sha1:
+                arrays['json_mtime_ns'] = np.int64(stat.st_mtime_ns)
+                arrays['json_size'] = np.int64(stat.st_size)
+                index = MetadataIndex(arrays)
+                index._index_file = index_file if _save_npz(index_file, **arrays) else None
+                return index
+
+    if verbose:
+        print(f"building metadata index for {json_file}")
+
+    if json_sha1 is None:
+        json_sha1 = _sha1(json_file)
+
+    arrays = _build_index(json_file)
+    arrays['version'] = np.int64(INDEX_VERSION)
+    arrays['json_mtime_ns'] = np.int64(stat.st_mtime_ns)
+    arrays['json_size'] = np.int64(stat.st_size)
+    arrays['json_sha1'] = np.array(json_sha1)
+
+    index = MetadataIndex(arrays)
+    index._index_file = index_file if _save_npz(index_file, **arrays) else None
+    return index
+
+
+def _build_index(json_file):
+    with open(json_file) as fd:
+        train_data = json.load(fd)
+
+    images = train_data['images']
+    rows = {image['image_id']: row for row, image in enumerate(images)}
+
+    category_id = np.full(len(images), -1, dtype=np.int32)
+    genus_id = np.full(len(images), -1, dtype=np.int32)
+    institution_id = np.full(len(images), -1, dtype=np.int32)
+
+    anno_rows = []
+    for anno in train_data['annotations']:
+        if (row := rows.get(anno['image_id'], None)) is None:
+            continue
+        anno_rows.append(row)
+        category_id[row] = anno['category_id']
+        genus_id[row] = anno.get('genus_id', -1)
+        institution_id[row] = anno.get('institution_id', -1)
+
+    names = [(image['file_name'] + "\n").encode() for image in images]
+    name_offsets = np.zeros(len(names)+1, dtype=np.int64)
+    np.cumsum([len(n) for n in names], out=name_offsets[1:])
+
+    return {
+        'image_id': np.array([image['image_id'] for image in images]),
+        'category_id': category_id,
+        'genus_id': genus_id,
+        'institution_id': institution_id,
+        'name_offsets': name_offsets,
+        'name_data': np.frombuffer(b"".join(names), dtype=np.uint8),
+        'anno_rows': np.array(anno_rows, dtype=np.int64),
+        'categories': np.array(json.dumps(train_data['categories'])),
+    }
+
+
+def _sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fd:
+        while chunk := fd.read(16*1024*1024):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _save_npz(path, **arrays):
+    # write then rename so concurrent readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as fd:
+            np.savez(fd, **arrays)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"unable to save {path}: {e}", file=sys.stderr)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+def _pack_rng_state(state):
+    return np.array(state[1], dtype=np.uint32)
+
+
+def _unpack_rng_state(packed):
+    return (3, tuple(int(x) for x in packed), None)
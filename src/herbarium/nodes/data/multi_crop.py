@@ -0,0 +1,89 @@
+import torch
+
+from ..node import Node
+
+
+flips = [None, "horizontal", "vertical"]
+
+
+# Test time augmentation on whole batches after the DataLoader. Each (C, H, W) image in the
+#  batch is replaced by its crops - the centre, or the four corners and the centre as FiveCrop -
+#  and optionally their flips, so the batch of B images becomes B*num_crops crops with the
+#  crops of each image together. TenCrop is 'five' crops with a 'horizontal' flip.
+#
+# The other fields stay per image; use herbarium.model.tta to reduce the outputs of each
+#  image's crops in the model, or with reducer 'none', in the Assembler.
+class MultiCrop(Node):
+    def __init__(self, inode, height, width, *, crops="five", flip=None, use_gpu=True):
+        super().__init__(inode)
+        
+        if crops not in ("center", "five"):
+            raise ValueError(f"crops must be 'center' or 'five', not {crops}")
+        if flip not in flips:
+            raise ValueError(f"flip must be one of {flips}, not {flip}")
+        
+        self._height = height
+        self._width = width
+        self._crops = crops
+        self._flip = flip
+        self._device = torch.device('cuda') if (use_gpu and torch.cuda.is_available()) else torch.device('cpu')
+        
+    @property
+    def num_crops(self):
+        num_crops = 1 if self._crops == "center" else 5
+        if self._flip is not None:
+            num_crops *= 2
+        return num_crops
+    
+    def __len__(self):
+        return len(self.inode)
+
+    def __iter__(self):
+        for items in self.inode:
+            images = items['image'].to(self._device, non_blocking=True)
+            
+            with torch.no_grad():
+                items['image'] = crops = self._crops_of(images)
+            
+            items['orig_width'] = items['image_width']
+            items['orig_height'] = items['image_height']
+            items['orig_channels'] = items['image_channels']
+            
+            B, C = images.shape[:2]
+            items['image_channels'] = torch.full((B,), C)
+            items['image_height'] = torch.full((B,), self._height)
+            items['image_width'] = torch.full((B,), self._width)
+            
+            yield items
+    
+    def _crops_of(self, images):
+        H, W = images.shape[-2:]
+        h, w = self._height, self._width
+        if h > H or w > W:
+            raise ValueError(f"crop size {w}x{h} is larger than the image size {W}x{H}")
+        
+        # the crops are views into the batch, written straight into the one (B, NCROPS, C, h, w)
+        #  tensor the model runs on. The model needs them dense, so this copy can't be avoided,
+        #  but it's the only one other than the flips, which torch always copies
+        top = (H - h) // 2
+        left = (W - w) // 2
+        views = [images[:, :, top:top+h, left:left+w]]
+        if self._crops == "five":
+            views = [
+                images[:, :, :h, :w],
+                images[:, :, :h, W-w:],
+                images[:, :, H-h:, :w],
+                images[:, :, H-h:, W-w:],
+            ] + views
+        
+        if self._flip == "horizontal":
+            views += [view.flip(-1) for view in views]
+        elif self._flip == "vertical":
+            views += [view.flip(-2) for view in views]
+        
+        B, C = images.shape[:2]
+        crops = torch.empty((B, len(views), C, h, w), dtype=images.dtype, device=images.device)
+        for idx, view in enumerate(views):
+            crops[:, idx] = view
+        
+        return crops.flatten(0, 1)
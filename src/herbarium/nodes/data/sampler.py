@@ -0,0 +1,146 @@
+import math
+
+import numpy as np
+from torch.utils.data import get_worker_info
+
+from herbarium.utils.distributed import get_rank, get_world_size
+
+
+# Decides which items each DataLoader worker yields, and in what order, for an epoch.
+#
+# The order for an epoch is a permutation seeded by (seed, epoch), so it doesn't depend on any
+#  state in the main process other than the epoch number, which the workers get with their
+#  copy of the dataset when the DataLoader starts each epoch (this is why persistent_workers
+#  can't be used). Batches are dealt out round robin, batch b to worker b % num_workers, which
+#  is the order the DataLoader collects them in, so the loader yields batches in the epoch
+#  order for any number of workers. An epoch can be started part way through by setting the
+#  position to the number of batches already consumed.
+#
+# With distributed training, the batches are first dealt out round robin to the ranks, batch
+#  b to rank b % world_size, and then to each rank's workers. Every rank must take the same 
+#  number of steps, so the order is padded, by repeating its start, to whole batches for every
+#  rank.
+#
+# The items can also be put in groups, such as the shards they're stored in, and visited a
+#  group at a time, each group's items in the order of their keys, so they're read in sequence.
+#  The order of the groups is the permutation for the epoch, and the items are then mixed
+#  within consecutive windows of the given size, so the batches aren't the same every epoch 
+#  while the reads only go back within a window.
+class ShardedSampler:
+
+    def __init__(self, length, batch_size, *, shuffle=True, seed=331):
+        self._length = length
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._seed = seed
+
+        self._rank = get_rank()
+        self._world_size = get_world_size()
+
+        self._epoch = 0
+        self._position = 0
+
+        self._groups = None
+        self._window = 0
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    @property
+    def position(self):
+        return self._position
+
+    def set_length(self, length):
+        self._length = length
+
+    def set_groups(self, groups, keys, *, window=0):
+        # the items of each group, in the order of their keys
+        items = np.lexsort((keys, groups))
+        bounds = np.flatnonzero(np.diff(groups[items])) + 1
+        
+        self._groups = np.split(items, bounds) if len(items) > 0 else []
+        self._window = window
+
+    def set_epoch(self, epoch, position=0):
+        self._epoch = epoch
+        self._position = position
+
+    def state_dict(self):
+        return {
+            'seed': self._seed,
+            'epoch': self._epoch,
+            'position': self._position,
+        }
+
+    def load_state_dict(self, state):
+        self._seed = state['seed']
+        self.set_epoch(state['epoch'], state['position'])
+
+    def num_batches(self):
+        # the batches for this rank
+        if self._world_size == 1:
+            return math.ceil(self._length/self._batch_size)
+        return math.ceil(self._length/(self._batch_size*self._world_size))
+
+    def num_samples(self):
+        if self._world_size == 1:
+            return self._length
+        return self.num_batches() * self._batch_size
+
+    def order(self):
+        if self._groups is not None:
+            order = self._grouped_order()
+        elif self._shuffle == False:
+            order = np.arange(self._length)
+        else:
+            rng = np.random.default_rng([self._seed, self._epoch])
+            order = rng.permutation(self._length)
+        
+        if self._world_size > 1 and self._length > 0:
+            padded = self.num_batches() * self._batch_size * self._world_size
+            order = np.resize(order, padded)
+        
+        return order
+
+    def _grouped_order(self):
+        if len(self._groups) == 0:
+            return np.arange(0)
+        
+        if self._shuffle == False:
+            return np.concatenate(self._groups)
+        
+        rng = np.random.default_rng([self._seed, self._epoch])
+        order = np.concatenate([self._groups[g] for g in rng.permutation(len(self._groups))])
+        
+        # random keys offset by the window number keep each window's items together
+        if self._window > 1:
+            mix = np.arange(len(order)) // self._window + rng.random(len(order))
+            order = order[np.argsort(mix, kind='stable')]
+        
+        return order
+
+    def batches(self, worker_id=None, num_workers=None):
+        if worker_id is None:
+            worker_id = 0
+            num_workers = 1
+            if worker_info := get_worker_info():
+                worker_id = worker_info.id
+                num_workers = worker_info.num_workers
+
+        # the DataLoader asks worker 0 for the first batch, so that's where the
+        #  position starts
+        batches = range(self._position + worker_id, self.num_batches(), num_workers)
+        if self._world_size == 1:
+            return batches
+        
+        return [b*self._world_size + self._rank for b in batches]
+
+    def indices(self, worker_id=None, num_workers=None):
+        order = self.order()
+
+        batches = self.batches(worker_id, num_workers)
+        if len(batches) == 0:
+            return order[0:0]
+
+        return np.concatenate([order[b*self._batch_size:(b+1)*self._batch_size] for b in batches])
@@ -0,0 +1,96 @@
+import sys, os.path
+import glob
+import io
+
+import numpy as np
+
+from .herbarium_dataset import HerbariumDataset
+from .decode import open_image
+
+
+# Reads the images from the packed shards written by 'prepare-data --shards'. Each shard is a
+#  data file of concatenated images plus an index file with one 'name offset length' line per
+#  image. The sampler visits the shards one at a time, in a different order each epoch, and
+#  each shard's images in offset order, mixed within windows of shuffle_window images; within
+#  each batch, the images are read grouped by shard and in offset order.
+class ShardDataset(HerbariumDataset):
+
+    def __init__(self, dsroot, split, batch_size, *, shard_dir="train_shards", shuffle=True, shuffle_seed=331,
+                            nfolds=5, vfold=4,
+                            load_images=True, excludes=True,
+                            as_numpy=True, decode_size=None, shuffle_window=256):
+
+        HerbariumDataset.__init__(self, dsroot, split, batch_size, image_dir=shard_dir,
+                                    shuffle=shuffle, shuffle_seed=shuffle_seed,
+                                    nfolds=nfolds, vfold=vfold,
+                                    load_images=load_images, excludes=excludes,
+                                    as_numpy=as_numpy, decode_size=decode_size)
+
+        self._shard_dir = os.path.join(self._dsroot, shard_dir)
+
+        self._shards, index = read_shard_index(self._shard_dir)
+
+        # locate each image in the shards as (shard, offset, length) rows aligned with the
+        #  metadata index, dropping any images that aren't there
+        self._locations = np.full((len(self._index), 3), -1, dtype=np.int64)
+        for row in self._images.tolist():
+            if (entry := index.get(self._index.name(row), None)) is not None:
+                self._locations[row] = entry
+
+        images = self._images[self._locations[self._images, 0] >= 0]
+        if len(images) != len(self._images):
+            print(f"shards: {len(self._images) - len(images)} images missing from {self._shard_dir}", file=sys.stderr)
+
+        self._images = images
+        self._length = len(self._images)
+        self._sampler.set_length(self._length)
+        
+        locations = self._locations[self._images]
+        self._sampler.set_groups(locations[:, 0], locations[:, 1], window=shuffle_window)
+
+    def __iter__(self):
+        # the rows are yielded in the sampler's order, so the batches are the ones the sampler
+        #  made and an epoch can start part way through; the reads within each batch are put
+        #  back in offset order
+        rows = self._worker_rows()
+        files = {}
+        try:
+            for start in range(0, len(rows), self._batch_size):
+                batch = rows[start:start+self._batch_size].tolist()
+
+                images = {}
+                if self._load_images:
+                    for row in sorted(batch, key=lambda r: self._locations[r].tolist()):
+                        shard, offset, length = self._locations[row].tolist()
+                        if (fd := files.get(shard, None)) is None:
+                            fd = files[shard] = open(self._shards[shard], "rb")
+                        fd.seek(offset)
+                        images[row] = fd.read(length)
+
+                for row in batch:
+                    item = self._make_item(row)
+                    if self._load_images:
+                        self._set_image(item, open_image(io.BytesIO(images[row]), self._decode_size))
+                    yield item
+
+        finally:
+            for fd in files.values():
+                fd.close()
+
+
+def read_shard_index(shard_dir):
+    shards = []
+    index = {}
+
+    # a shard's index is written after its data is complete, so only shards with an
+    #  index file are used
+    for idx_file in sorted(glob.glob(os.path.join(shard_dir, "shard-*.idx"))):
+        shard = len(shards)
+        shards.append(os.path.splitext(idx_file)[0] + ".bin")
+
+        with open(idx_file) as fd:
+            for line in fd:
+                name, offset, length = line.rstrip("\n").rsplit(" ", 2)
+                index[name] = (shard, int(offset), int(length))
+
+    return shards, index
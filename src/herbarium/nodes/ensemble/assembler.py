@@ -1,5 +1,4 @@
 import sys, os.path
-from collections import defaultdict
 
 import torch.nn as nn
 import torch
@@ -13,51 +12,151 @@ reducers = {
     "none": None
 }
 
+
+# Collects the outputs for the samples of each image (the crops from FiveCrop, the members of
+#  an unreduced ensemble, or both) and reduces them to a single output per image.
+#
+# The outputs of images still waiting for samples are held in a preallocated buffer of
+#  (max_pending, samples_per_id, num_outputs), or only the top_k of each sample's outputs,
+#  and the images completed by each batch are reduced together and yielded as a batch.
+#  Outputs outside a sample's top k are taken to be its smallest kept output.
 class Assembler(Node):
-    
-    def __init__(self, inode, *, samples_per_id, reducer="sum"):
+
+    def __init__(self, inode, *, samples_per_id, reducer="sum", max_pending=256, top_k=None):
         super().__init__(inode)
         self._samples_per_id = samples_per_id
         self._reducer = reducers[reducer]
-        
+        self._max_pending = max_pending
+        self._top_k = top_k
+
+        self._num_outputs = None
+        self._values = None
+        self._indices = None
+
     def __len__(self):
-        return int(len(self.inode) / self._samples_per_id)
-    
+        return len(self.inode)
+
     def __iter__(self):
-        cache = defaultdict(list)
+        # shortcut for the simple case
+        if self._samples_per_id == 1:
+            yield from self.inode
+            return
+
+        slots = {}
+        free = list(reversed(range(self._max_pending)))
+        counts = [0] * self._max_pending
+
         for item in self.inode:
-            
-            # shortcut for the simple case
-            if self._samples_per_id == 1:
-                yield item
-                continue
-            
-            # get the image_ids and outputs ... as lists
-            image_ids = item['image_id']
+            # dimensions: BATCH_SIZE, SAMPLES, NCATS
             outputs = item['output']
+            if outputs.ndim == 2:
+                outputs = outputs.unsqueeze(1)
 
-            for idx, (image_id, output) in enumerate(zip(image_ids, outputs)):
+            if self._values is None:
+                self._allocate(outputs)
+
+            image_ids = item['image_id']
+            if isinstance(image_ids, torch.Tensor):
+                image_ids = image_ids.tolist()
+
+            # find the buffer slot of each row's image and where its samples go in it
+            samples = outputs.shape[1]
+            rows = []
+            positions = []
+            done = []
+            for idx, image_id in enumerate(image_ids):
                 image_id = int(image_id)
-                if output.ndim == 1:
-                    output = output.unsqueeze(0)
-                
-                for o in output:
-                    cache[image_id].append(o)
-                
-                if len(cache[image_id]) == self._samples_per_id:
-                    # predict based on reduction (or for each in the stack)
-                    outputs = torch.vstack(cache[image_id])
-                    if self._reducer:
-                        outputs = self._reducer(outputs, dim=0)
-                    pred = torch.argmax(outputs, dim=-1)
-                    del cache[image_id]
-                    
-                    # generate an 'item' to yield
-                    nitem = {}
-                    for k, v in item.items():
-                        nitem[k] = [v[idx]]
-                    nitem['output'] = [outputs]
-                    nitem['prediction'] = [pred]
-                    
-                    yield nitem
 
+                slot = slots.get(image_id, None)
+                if slot is None:
+                    if len(free) == 0:
+                        raise RuntimeError(f"more than {self._max_pending} images pending; increase max_pending")
+                    slot = slots[image_id] = free.pop()
+
+                rows.append(slot)
+                positions.append(counts[slot])
+
+                counts[slot] += samples
+                if counts[slot] > self._samples_per_id:
+                    raise ValueError(f"image {image_id} has more than {self._samples_per_id} samples")
+                if counts[slot] == self._samples_per_id:
+                    done.append(idx)
+                    del slots[image_id]
+
+            self._store(outputs, rows, positions)
+
+            if len(done) == 0:
+                continue
+
+            # reduce the images completed by this batch
+            done_slots = [rows[idx] for idx in done]
+            outputs = self._load(done_slots)
+            if self._reducer:
+                outputs = self._reducer(outputs, dim=1)
+
+            for slot in done_slots:
+                counts[slot] = 0
+                free.append(slot)
+
+            nitem = self._select(item, done)
+            nitem['output'] = outputs
+            nitem['prediction'] = torch.argmax(outputs, dim=-1)
+
+            yield nitem
+
+        if len(slots) > 0:
+            print(f"assembler: {len(slots)} images incomplete", file=sys.stderr)
+
+    def _allocate(self, outputs):
+        self._num_outputs = outputs.shape[-1]
+
+        width = self._num_outputs if self._top_k is None else self._top_k
+        shape = (self._max_pending, self._samples_per_id, width)
+
+        self._values = torch.empty(shape, dtype=outputs.dtype, device=outputs.device)
+        if self._top_k is not None:
+            self._indices = torch.empty(shape, dtype=torch.int64, device=outputs.device)
+
+    def _store(self, outputs, rows, positions):
+        device = outputs.device
+        samples = outputs.shape[1]
+
+        # flat indices into the buffer viewed as (max_pending * samples_per_id, width)
+        rows = torch.tensor(rows, device=device).unsqueeze(1)
+        positions = torch.tensor(positions, device=device).unsqueeze(1) + torch.arange(samples, device=device)
+        flat = (rows * self._samples_per_id + positions).flatten()
+
+        if self._top_k is None:
+            self._values.flatten(0, 1).index_copy_(0, flat, outputs.flatten(0, 1))
+        else:
+            values, indices = torch.topk(outputs, self._top_k, dim=-1, sorted=False)
+            self._values.flatten(0, 1).index_copy_(0, flat, values.flatten(0, 1))
+            self._indices.flatten(0, 1).index_copy_(0, flat, indices.flatten(0, 1))
+
+    def _load(self, slots):
+        slots = torch.tensor(slots, device=self._values.device)
+        values = self._values.index_select(0, slots)
+        if self._top_k is None:
+            return values
+
+        # fill in the outputs that weren't kept with the smallest that was
+        floor = values.amin(dim=-1, keepdim=True)
+        outputs = floor.expand(*values.shape[:-1], self._num_outputs).contiguous()
+        outputs.scatter_(-1, self._indices.index_select(0, slots), values)
+
+        return outputs
+
+    def _select(self, item, rows):
+        # the per image fields from the rows that completed each image
+        batch_size = len(item['image_id'])
+
+        nitem = {}
+        for k, v in item.items():
+            if k in ('output', 'prediction', 'metrics'):
+                continue
+            if isinstance(v, torch.Tensor) and v.ndim > 0 and len(v) == batch_size:
+                nitem[k] = v[torch.tensor(rows, device=v.device)]
+            elif isinstance(v, (list, tuple)) and len(v) == batch_size:
+                nitem[k] = [v[idx] for idx in rows]
+
+        return nitem
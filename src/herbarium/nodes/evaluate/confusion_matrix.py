@@ -1,24 +1,28 @@
-from collections import defaultdict
-
 import torch
-from ignite.metrics.confusion_matrix import ConfusionMatrix as IConfusionMatrix
 
 from ..node import Node
 
 
+# The confusion matrix as sparse counts: at 15505 categories a dense matrix is too big, and
+#  almost all of it is zero. Each (target, prediction) pair is a key, target * num_categories
+#  + prediction; the keys are collected on the device and merged into counts of the unique 
+#  keys every merge_every batches.
+#
+# At the end of the pass, 'confusion_matrix' is a sparse COO tensor of the counts and 
+#  'top_confusions' the top_k most frequent mistakes, as rows of target, prediction, count.
 class ConfusionMatrix(Node):
     
-    def __init__(self, inode, num_categories, *, device=None):
+    def __init__(self, inode, num_categories, *, top_k=100, merge_every=64):
         super().__init__(inode)
-
-        if device is None:
-            device = torch.device("cpu")
-            
-        self._cm = IConfusionMatrix(num_categories, average="samples", device=device)
+        self._num_categories = num_categories
+        self._top_k = top_k
+        self._merge_every = merge_every
         self.reset()
     
     def reset(self):
-        self._cm.reset()
+        self._keys = None
+        self._counts = None
+        self._pending = []
         
     def __len__(self):
         return len(self.inode)
@@ -26,13 +30,45 @@ class ConfusionMatrix(Node):
     def __iter__(self):
         self.reset()
         
-        for idx, item in enumerate(self.inode):
+        item = None
+        for item in self.inode:
             targets = item['target']
-            outputs = item['output']
+            predictions = torch.argmax(item['output'], dim=1)
             
-            self._cm.update((output, targets))
+            self._pending.append(targets.long() * self._num_categories + predictions)
+            if len(self._pending) >= self._merge_every:
+                self._merge()
 
             yield item
         
-        item['metrics']['confusion_matrix'] = self._cm.compute()
+        if item is None:
+            return
+        
+        self._merge()
+        if self._keys is None:
+            return
+        
+        indices = torch.stack([self._keys // self._num_categories, self._keys % self._num_categories])
+        size = (self._num_categories, self._num_categories)
+        
+        metrics = item.setdefault('metrics', {})
+        metrics['confusion_matrix'] = torch.sparse_coo_tensor(indices, self._counts, size).coalesce()
+        
+        mistakes = (indices[0] != indices[1]).nonzero().squeeze(1)
+        counts, order = torch.topk(self._counts[mistakes], min(self._top_k, len(mistakes)))
+        mistakes = mistakes[order]
+        metrics['top_confusions'] = torch.stack([indices[0][mistakes], indices[1][mistakes], counts], dim=1)
     
+    def _merge(self):
+        if len(self._pending) == 0:
+            return
+        
+        keys = torch.cat(self._pending)
+        counts = torch.ones_like(keys)
+        if self._keys is not None:
+            keys = torch.cat([self._keys, keys])
+            counts = torch.cat([self._counts, counts])
+        
+        self._keys, inverse = torch.unique(keys, sorted=True, return_inverse=True)
+        self._counts = torch.zeros_like(self._keys).scatter_add_(0, inverse, counts)
+        self._pending = []
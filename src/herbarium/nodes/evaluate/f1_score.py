@@ -1,44 +1,98 @@
-from collections import defaultdict
-
 import torch
 
+from herbarium.utils.distributed import all_reduce
+
 from ..node import Node
 
 
+# Per category counts of true positives, false positives and false negatives, and the number of
+#  targets in the top k outputs, accumulated on the device. From them, at the end of the pass:
+#  the per category and macro F1 scores, precision and recall, the accuracy and top k accuracy.
 class F1Score(Node):
     
-    def __init__(self, inode, num_categories):
+    def __init__(self, inode, num_categories, *, top_k=5):
         super().__init__(inode)
         self._num_categories = num_categories
+        self._top_k = top_k
+        self._in_epoch = False
+        self._resume = False
         self.reset()
     
     def reset(self):
-        # TP, FN+FP
-        self._data = None
+        # TP, FP, FN
+        self._counts = None
+        self._top_k_hits = None
+        
+    def state_dict(self):
+        # the counts so far, for a snapshot taken part way through a pass
+        if self._in_epoch == False or self._counts is None:
+            return {}
+        return {'counts': self._counts, 'top_k_hits': self._top_k_hits}
+    
+    def load_state_dict(self, state):
+        self._resume = 'counts' in state
+        if self._resume:
+            self._counts = state['counts']
+            self._top_k_hits = state['top_k_hits']
         
     def __len__(self):
         return len(self.inode)
     
     def __iter__(self):
-        self.reset()
+        if self._resume == False:
+            self.reset()
+        self._resume = False
+        self._in_epoch = True
         
-        for idx, item in enumerate(self.inode):
+        item = None
+        for item in self.inode:
             targets = item['target']
-            outputs = torch.argmax(item['output'], dim=1)
-
-            correct = (targets == outputs).long()
+            outputs = item['output']
+            predictions = torch.argmax(outputs, dim=1)
             
-            if self._data is None:
-                self._data = torch.zeros(2, self._num_categories, device=targets.device)
+            if self._counts is None:
+                self._counts = torch.zeros(3, self._num_categories, dtype=torch.int64, device=targets.device)
+                self._top_k_hits = torch.zeros((), dtype=torch.int64, device=targets.device)
             
-            self._data[0, targets] += correct
-            self._data[1, targets] += 1.0 - correct
-            self._data[1, outputs] += 1.0 - correct
+            # scatter_add_ counts repeated categories and, unlike bincount, has a fixed output 
+            #  size, so it doesn't wait on the device
+            correct = (predictions == targets).long()
+            incorrect = 1 - correct
+            self._counts[0].scatter_add_(0, targets, correct)
+            self._counts[1].scatter_add_(0, predictions, incorrect)
+            self._counts[2].scatter_add_(0, targets, incorrect)
+            
+            if self._top_k:
+                top_k = torch.topk(outputs, min(self._top_k, outputs.shape[1]), dim=1).indices
+                self._top_k_hits += (top_k == targets.unsqueeze(1)).any(dim=1).sum()
 
             yield item
         
-        f1_scores = 2*self._data[0] / (2*self._data[0] + self._data[1] + 1e-9)
-        item['metrics']['f1_data'] = self._data
-        item['metrics']['f1_scores'] = f1_scores
-        item['metrics']['f1_score'] = f1_scores.mean().item()
+        self._in_epoch = False
+        
+        if item is None or self._counts is None:
+            return
+        
+        # the counts of all the ranks when training is distributed
+        self._counts = all_reduce(self._counts)
+        self._top_k_hits = all_reduce(self._top_k_hits)
+        
+        tp, fp, fn = self._counts.float()
+        
+        precision = tp / (tp + fp + 1e-9)
+        recall = tp / (tp + fn + 1e-9)
+        f1_scores = 2*tp / (2*tp + fp + fn + 1e-9)
+        
+        metrics = item.setdefault('metrics', {})
+        metrics['f1_data'] = torch.stack([tp, fp + fn])
+        metrics['f1_scores'] = f1_scores
+        metrics['f1_score'] = f1_scores.mean()
+        metrics['precision_scores'] = precision
+        metrics['recall_scores'] = recall
+        metrics['precision'] = precision.mean()
+        metrics['recall'] = recall.mean()
         
+        total = tp.sum() + fn.sum()
+        metrics['accuracy'] = tp.sum() / total
+        if self._top_k:
+            metrics[f'top{self._top_k}_accuracy'] = self._top_k_hits / total
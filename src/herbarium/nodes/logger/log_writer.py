@@ -1,6 +1,8 @@
 import time
 from torch.utils.tensorboard import SummaryWriter
 
+from herbarium.utils.distributed import is_main
+
 
 class LogWriter:
     def __init__(self, *, log_dir="logs"):
@@ -9,16 +11,28 @@ class LogWriter:
             log_dir = f"{log_dir}/{now}"
         self._log_dir = log_dir
         
+        # only rank 0 writes the logs when training is distributed
+        self._enabled = is_main()
+        
         self._writer = None
     
     def __getattr__(self, name):
+        if self._enabled == False:
+            return _discard
+        
         if self._writer is None:
             self._writer = SummaryWriter(log_dir=self._log_dir)
         
         return getattr(self._writer, name)
     
     def flush(self):
-        self._writer.flush()
+        if self._writer is not None:
+            self._writer.flush()
     
     def close(self):
-        self._writer.close()
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _discard(*args, **kwargs):
+    pass
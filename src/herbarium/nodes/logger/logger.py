@@ -2,6 +2,9 @@ import sys
 from collections import defaultdict
 import torch
 
+from herbarium.utils import resolve_values, resolve_metrics
+from herbarium.utils.distributed import is_distributed, all_reduce
+
 from .meters import AverageMeter
 
 from ..node import Node
@@ -9,22 +12,63 @@ from ..node import Node
 
 class Logger(Node):
     
-    def __init__(self, inode, writer, prefix, *, loss_clamp=sys.maxsize):
+    def __init__(self, inode, writer, prefix, *, loss_clamp=sys.maxsize, flush_every=100):
         super().__init__(inode)
         self.prefix = prefix
         self._writer = writer
         self._loss_clamp = loss_clamp
         self._epoch = -1
         self._global_step = -1
+        self._in_epoch = False
+        self._resume = False
+        
+        # the averages of the epoch so far
+        self._losses_avg = defaultdict(lambda: AverageMeter())
+        self._lr_avg = AverageMeter()
+        
+        # batch metrics can be tensors still being computed on the device; they're buffered and
+        #  resolved together every flush_every batches so the loop doesn't wait on each one
+        self._flush_every = flush_every
+        self._pending = []
     
     def __len__(self):
         return len(self.inode)
     
+    def state_dict(self):
+        # a snapshot part way through an epoch resumes at the start of its iteration, which 
+        #  counts the epoch again, and carries on with its averages
+        state = {
+            'epoch': self._epoch - 1 if self._in_epoch else self._epoch,
+            'global_step': self._global_step,
+        }
+        if self._in_epoch:
+            state['losses_avg'] = {k: v.state_dict() for k, v in self._losses_avg.items()}
+            state['lr_avg'] = self._lr_avg.state_dict()
+        return state
+    
+    def load_state_dict(self, state):
+        self._epoch = state['epoch']
+        self._global_step = state['global_step']
+        
+        self._resume = 'losses_avg' in state
+        if self._resume:
+            self._losses_avg = defaultdict(lambda: AverageMeter())
+            for k, v in state['losses_avg'].items():
+                self._losses_avg[k].load_state_dict(v)
+            self._lr_avg = AverageMeter()
+            self._lr_avg.load_state_dict(state['lr_avg'])
+    
     def __iter__(self):
         self._epoch += 1
+        self._in_epoch = True
+        
+        if self._resume == False:
+            self._losses_avg = defaultdict(lambda: AverageMeter())
+            self._lr_avg = AverageMeter()
+        self._resume = False
         
-        losses_avg = defaultdict(lambda: AverageMeter())
-        lr_avg = AverageMeter()
+        losses_avg = self._losses_avg
+        lr_avg = self._lr_avg
         
         # log per-batch metrics
         for item in self.inode:
@@ -35,7 +79,10 @@ class Logger(Node):
             for name, value in metrics.items():
                 if name.startswith('batch'):
                     label = ''.join([word.capitalize() for word in name.split('_')])
-                    self._writer.add_scalar(f'{self.prefix}/{label}', value, global_step=self._global_step)
+                    self._pending.append((f'{self.prefix}/{label}', value, self._global_step))
+            
+            if len(self._pending) >= self._flush_every:
+                self._flush_pending()
 
             # average the loss and lr across the batch
             for k, v in metrics.items():
@@ -52,8 +99,16 @@ class Logger(Node):
             
             yield item
         
+        self._flush_pending()
+        self._in_epoch = False
+        
+        # the average losses of all the ranks when training is distributed
+        if is_distributed():
+            for k in losses_avg.keys():
+                item['metrics'][k] = all_reduce(torch.as_tensor(item['metrics'][k]), op="mean")
+        
         # log the metrics once per epoch
-        metrics = item['metrics']
+        metrics = resolve_metrics(item['metrics'])
         for name, value in metrics.items():
             # don't log multidimensional tensors
             if isinstance(value, torch.Tensor) and value.numel() > 1:
@@ -75,4 +130,13 @@ class Logger(Node):
                 self._writer.add_scalar(f'{self.prefix}/{label}', value, global_step=self._epoch)
             
             self._writer.flush()
-
+    
+    def _flush_pending(self):
+        if len(self._pending) == 0:
+            return
+        
+        values = resolve_values([value for _, value, _ in self._pending])
+        for (tag, _, step), value in zip(self._pending, values):
+            self._writer.add_scalar(tag, value, global_step=step)
+        
+        self._pending = []
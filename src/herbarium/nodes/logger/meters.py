@@ -14,3 +14,11 @@ class AverageMeter:
     def value(self):
         return self._sum / self._count
 
+    
+    def state_dict(self):
+        # the sum can be a tensor on the device
+        return {'sum': float(self._sum), 'count': self._count}
+    
+    def load_state_dict(self, state):
+        self._sum = state['sum']
+        self._count = state['count']
@@ -30,3 +30,24 @@ def iter_fwd(node):
         yield from iter_fwd(inode)
     yield node
 
+
+# The number of optimizer steps in an epoch: the number of batches, unless a node before this
+#  one, such as a Trainer accumulating gradients, steps less often.
+def steps_per_epoch(node):
+    for n in iter_rev(node):
+        if hasattr(n, "steps_per_epoch"):
+            return n.steps_per_epoch()
+    return len(node)
+
+
+# The state of the nodes in a pipeline that have any, such as the dataset's sampler and the 
+#  schedulers, by their position in the pipeline, for resuming training.
+def pipeline_state(node):
+    return {idx: n.state_dict() for idx, n in enumerate(iter_fwd(node)) if hasattr(n, "state_dict")}
+
+
+def load_pipeline_state(node, state):
+    for idx, n in enumerate(iter_fwd(node)):
+        if idx in state:
+            n.load_state_dict(state[idx])
+
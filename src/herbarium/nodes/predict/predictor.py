@@ -2,16 +2,31 @@ import os.path
 import torch.nn as nn
 import torch
 
+import herbarium.transforms as T
+from herbarium.utils import StepTimer
+from herbarium.model.quantize import InferenceRunner
+
 from ..node import Node
+from ..utils import to_device, prepare_runner
 
 
 class Predictor(Node):
     
-    def __init__(self, inode, model):
+    def __init__(self, inode, model, *, normalize=None, precision="fp32", calibration_batches=8, input_key="image"):
         super().__init__(inode)
 
         self._model = model
         self._device = model.device
+        
+        # runs the model at the given precision; see herbarium.model.quantize
+        self._runner = InferenceRunner(model, precision, calibration_batches=calibration_batches)
+        
+        # normalize uint8 images on the device rather than in the dataloader workers
+        self._normalize = None if normalize is None else T.Normalize(**normalize)
+        self._memory_format = getattr(model, "memory_format", None)
+        self._input_key = input_key
+        
+        self._timer = StepTimer(self._device)
     
     @property
     def device(self):
@@ -26,19 +41,34 @@ class Predictor(Node):
         
     def __iter__(self):
         self._model.eval()
+        self._timer.start()
         
-        for item in self.inode:
-            item['image'] = inputs = item['image'].to(self._device, non_blocking=True)
+        item = None
+        items = prepare_runner(self._runner, self.inode, self._inputs)
+        for item in items:
+            item[self._input_key] = inputs = self._inputs(item)
             
             with torch.no_grad():
-                outputs = self._model(inputs)
+                outputs = self._runner(inputs)
                 preds = torch.argmax(outputs, dim=-1)
             
+            # an output per image; crops that weren't reduced in the model would be paired with
+            #  the wrong images
+            if (image_ids := item.get('image_id', None)) is not None and len(outputs) != len(image_ids):
+                raise ValueError(f"{len(outputs)} outputs for {len(image_ids)} images; check the model's num_crops")
+            
             # print(f"inputs: {inputs.shape}, outputs: {outputs.shape}, preds: {preds.shape}")
             # print(preds)
             
+            self._timer.step(len(inputs))
+            
             item['output'] = outputs
             item['prediction'] = preds
             
             yield item
-
+        
+        if item is not None:
+            item.setdefault('metrics', {}).update(self._timer.metrics())
+    
+    def _inputs(self, item):
+        return to_device(item[self._input_key], self._device, normalize=self._normalize, memory_format=self._memory_format)
@@ -71,6 +71,9 @@ class BatchLinearRamp(Node, _LRScheduler):
                 item['metrics']['batch_loss'] = item['metrics']['loss']
             yield item
             
+            # only for the batches the optimizer stepped on
+            if item.get('stepped', True) == False:
+                continue
             if self._cur_epoch >= self._start_epoch and self._cur_epoch < self._end_epoch:
                 self.step()
 
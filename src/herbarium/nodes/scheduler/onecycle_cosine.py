@@ -5,10 +5,11 @@ from collections import defaultdict
 import torch
 from torch.optim.lr_scheduler import _LRScheduler
 
-from ..node import Node
+from ..node import Node, steps_per_epoch
+from .resumable import Resumable
 
 
-class OneCycleCosine(Node, _LRScheduler):
+class OneCycleCosine(Resumable, Node, _LRScheduler):
     
     def __init__(self, inode, optimizer, *, last_epoch=-1, 
                                             peak_epoch=2, final_epoch=10,
@@ -29,9 +30,10 @@ class OneCycleCosine(Node, _LRScheduler):
         self._batch_mode = batch_mode
         if self._batch_mode:
             # if there is a dataloader before this node, then the length of 
-            #  the input is the batched length, not the raw length
-            self._peak_epoch = int(self._peak_epoch * len(self.inode))
-            self._final_epoch = int(self._final_epoch * len(self.inode))
+            #  the input is the batched length, not the raw length; with the gradients
+            #  accumulated over batches, it steps once per group of them
+            self._peak_epoch = int(self._peak_epoch * steps_per_epoch(self.inode))
+            self._final_epoch = int(self._final_epoch * steps_per_epoch(self.inode))
         
         _LRScheduler.__init__(self, optimizer, last_epoch)
     
@@ -80,11 +82,16 @@ class OneCycleCosine(Node, _LRScheduler):
                 item['metrics']['batch_lr'] = item['metrics']['lr']
                 item['metrics']['batch_loss'] = item['metrics']['loss']
             
+            # only for the batches the optimizer stepped on
+            stepped = self._batch_mode and item.get('stepped', True)
+            
+            self._step_pending = stepped
             yield item
             
             # if batch scheduling, take the step here
-            if self._batch_mode:
+            if stepped:
                 self.step()
+                self._step_pending = False
         
         # if epoch scheduling, take the step here
         if self._batch_mode == False:
@@ -6,9 +6,10 @@ import torch
 from torch.optim.lr_scheduler import _LRScheduler
 
 from ..node import Node
+from .resumable import Resumable
 
 
-class OneCycleExponential(Node, _LRScheduler):
+class OneCycleExponential(Resumable, Node, _LRScheduler):
     
     def __init__(self, inode, optimizer, *, last_epoch=-1, 
                                             stage0=0, stage1=5, stage2=15,
@@ -59,11 +60,16 @@ class OneCycleExponential(Node, _LRScheduler):
                 item['metrics']['batch_lr'] = item['metrics']['lr']
                 item['metrics']['batch_loss'] = item['metrics']['loss']
             
+            # only for the batches the optimizer stepped on
+            stepped = self._batch and item.get('stepped', True)
+            
+            self._step_pending = stepped
             yield item
             
             # if batch scheduling, take the step here
-            if self._batch:
+            if stepped:
                 self.step()
+                self._step_pending = False
         
         # if epoch scheduling, take the step here
         if self._batch == False:
@@ -0,0 +1,21 @@
+# The state of a scheduler node for resuming training. The pipeline isn't part of it, and in
+#  batch mode a snapshot taken while the scheduler is waiting to step for the batch the 
+#  training loop has is saved as if it had stepped, as that batch won't be seen again.
+class Resumable:
+    
+    _step_pending = False
+    
+    def state_dict(self):
+        state = {k: v for k, v in self.__dict__.items() if k not in ('optimizer', 'inode')}
+        state['_step_pending'] = self._step_pending
+        return state
+    
+    def load_state_dict(self, state):
+        state = dict(state)
+        step_pending = state.pop('_step_pending', False)
+        self.__dict__.update(state)
+        
+        # the optimizer has to have been loaded first, so the step sets its learning rates
+        self._step_pending = False
+        if step_pending:
+            self.step()
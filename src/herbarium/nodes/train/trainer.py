@@ -1,13 +1,21 @@
+import contextlib
+import math
+
 import torch.nn as nn
 import torch
 from torch.cuda import amp
 
+import herbarium.transforms as T
+from herbarium.utils import StepTimer
+
 from ..node import Node
+from ..utils import to_device
 
 
 class Trainer(Node):
     
-    def __init__(self, inode, model, criterion, optimizer, *, use_amp=True):
+    def __init__(self, inode, model, criterion, optimizer, *, use_amp=True, normalize=None, accumulation_steps=1,
+                    input_key="image"):
         super().__init__(inode)
 
         self._model = model
@@ -19,6 +27,30 @@ class Trainer(Node):
         self._criterion.to(self._device)
         self._optimizer = optimizer
         
+        # normalize uint8 images on the device rather than in the dataloader workers
+        self._normalize = None if normalize is None else T.Normalize(**normalize)
+        self._memory_format = getattr(model, "memory_format", None)
+        
+        # the item field the model runs on; 'features' for a head trained on extracted features
+        self._input_key = input_key
+        
+        self._timer = StepTimer(self._device)
+        
+        # the gradients are accumulated over this many consecutive batches, with one optimizer
+        #  step for the group
+        self._accumulation_steps = accumulation_steps
+        print(f"train: accumulation_steps: {self._accumulation_steps}")
+        
+        # the loader batches consumed in the epoch, for snapshots taken part way through it;
+        #  the items yielded can't be counted instead as the last batch of a step the scaler
+        #  skipped isn't yielded
+        self._batches = 0
+        self._in_epoch = False
+        self._resume = False
+        
+        if self._use_amp:
+            self._scaler = amp.GradScaler()
+        
     @property
     def device(self):
         return self._device
@@ -31,50 +63,138 @@ class Trainer(Node):
     def optimizer(self):
         return self._optimizer
     
+    @property
+    def batches(self):
+        return self._batches
+    
+    def state_dict(self):
+        # the optimizer is saved with the model
+        return {
+            'scaler': self._scaler.state_dict() if self._use_amp else None,
+            'batches': self._batches if self._in_epoch else 0,
+        }
+    
+    def load_state_dict(self, state):
+        if self._use_amp and state.get('scaler', None) is not None:
+            self._scaler.load_state_dict(state['scaler'])
+        
+        self._batches = state.get('batches', 0)
+        self._resume = self._batches > 0
+    
     def __len__(self):
         return len(self.inode)
     
+    def steps_per_epoch(self):
+        # the last group of the epoch can be short, and is stepped for all the same
+        return math.ceil(len(self.inode) / self._accumulation_steps)
+    
     def __iter__(self):
         self._model.train()
+        self._timer.start()
         
-        if self._use_amp:
-            scaler = amp.GradScaler()
+        if self._resume == False:
+            self._batches = 0
+        self._resume = False
+        self._in_epoch = True
+        
+        group_batches = 0
+        group_samples = 0
         
-        for items in self.inode:
-            items['image'] = inputs = items['image'].to(self._device, non_blocking=True)
+        last_items = None
+        for items, last_batch in _with_last(self.inode):
+            items[self._input_key] = inputs = to_device(items[self._input_key], self._device, 
+                                                normalize=self._normalize, memory_format=self._memory_format)
             items['target'] = targets = items['target'].to(self._device, non_blocking=True)
             
-            self._optimizer.zero_grad()
+            self._batches += 1
+            
+            if group_batches == 0:
+                self._optimizer.zero_grad()
+            
+            group_batches += 1
+            group_samples += len(targets)
             
+            step = last_batch or group_batches == self._accumulation_steps
+            
+            # a distributed model only needs to average the gradients across the ranks
+            #  after the last batch of the group
+            sync = contextlib.nullcontext()
+            if hasattr(self._model, "no_sync") and step == False:
+                sync = self._model.no_sync()
+            
+            # the criterion averages over the batch; the backward pass is of the sum, so the
+            #  gradients can be divided by the number of samples in the whole group, which
+            #  isn't known until its last batch
             # NOTE: seeing some strange things after introducing amp... being cautious for
             # now until I have time to test properly
-            if self._use_amp:
-                with amp.autocast():
+            with sync:
+                if self._use_amp:
+                    with amp.autocast():
+                        outputs = self._model(inputs)
+                        loss = self._criterion(outputs, targets)
+                    
+                    self._scaler.scale(loss * len(targets)).backward()
+                
+                else:
                     outputs = self._model(inputs)
                     loss = self._criterion(outputs, targets)
-
-                scaler.scale(loss).backward()
-                scaler.step(self._optimizer)
+                    (loss * len(targets)).backward()
+            
+            skipped = False
+            if step:
+                for group in self._optimizer.param_groups:
+                    for param in group['params']:
+                        if param.grad is not None:
+                            param.grad.div_(group_samples)
                 
-                scale = scaler.get_scale()
-                scaler.update()
-                if scale > scaler.get_scale():
+                if self._use_amp:
+                    self._scaler.step(self._optimizer)
+                    
+                    scale = self._scaler.get_scale()
+                    self._scaler.update()
+                    
                     # the only reason scale is decreased is if the gradients 
                     # were Inf or NaN... optimizer doesn't get called so 
                     # loop again
-                    continue
+                    skipped = scale > self._scaler.get_scale()
+                    
+                else:
+                    self._optimizer.step()
                 
-            else:
-                outputs = self._model(inputs)
-                loss = self._criterion(outputs, targets)
-                loss.backward()
-                self._optimizer.step()
+                group_batches = 0
+                group_samples = 0
+            
+            self._timer.step(len(targets))
+            if skipped:
+                continue
             
-            items['output'] = outputs
+            # the schedulers step with the optimizer
+            items['stepped'] = step
+            items['output'] = outputs.detach()
             items['metrics'] = {
-                'loss' : loss.item(),
+                'loss' : loss.detach(),
                 'lr': self._optimizer.param_groups[0]['lr']
             }
             
+            last_items = items
             yield items
+        
+        self._in_epoch = False
+        
+        if last_items is not None:
+            last_items['metrics'].update(self._timer.metrics())
 
+
+def _with_last(iterable):
+    # each item with whether it's the last, looking one ahead
+    it = iter(iterable)
+    try:
+        item = next(it)
+    except StopIteration:
+        return
+    
+    for next_item in it:
+        yield item, False
+        item = next_item
+    
+    yield item, True
@@ -0,0 +1,33 @@
+from itertools import islice, chain
+
+
+def to_device(images, device, *, normalize=None, memory_format=None):
+    images = images.to(device, non_blocking=True)
+    
+    # uint8 images are normalized here, on the device, rather than in the dataloader workers
+    if normalize is not None:
+        images = normalize(images)
+    
+    if memory_format is not None:
+        images = images.contiguous(memory_format=memory_format)
+    
+    return images
+
+
+def prepare_runner(runner, items, to_inputs, *, calibration=None):
+    # static quantization is calibrated on the first batches of 'calibration', a separate slice
+    #  of the data, or without one on the first batches of the items, which are then put back
+    #  to be processed as usual
+    items = iter(items)
+    
+    if runner.needs_calibration():
+        if calibration is not None:
+            calibration = [to_inputs(item) for item in islice(calibration, runner.calibration_batches)]
+        else:
+            head = list(islice(items, runner.calibration_batches))
+            calibration = [to_inputs(item) for item in head]
+            items = chain(head, items)
+    
+    runner.prepare(calibration)
+    
+    return items
@@ -2,21 +2,42 @@ import torch.nn as nn
 import torch
 from torch.cuda import amp
 
+import herbarium.transforms as T
+from herbarium.utils import StepTimer
+from herbarium.model.quantize import InferenceRunner
+from herbarium.model.distributed import unwrap
+
 from ..node import Node
+from ..utils import to_device, prepare_runner
 
 
 class Validator(Node):
     
-    def __init__(self, inode, model, criterion, *, use_amp=True):
+    def __init__(self, inode, model, criterion, *, use_amp=True, normalize=None, 
+                    precision="fp32", calibration_batches=8, calibration=None, input_key="image"):
         super().__init__(inode)
 
-        self._model = model
+        # a distributed model is run without its wrapper; it has nothing to synchronize when
+        #  it isn't training, and each rank validates its own share of the images
+        self._model = unwrap(model)
         self._device = model.device
-        self._use_amp = False if self._device.type == "cpu" else use_amp
+        self._use_amp = False if self._device.type == "cpu" or precision != "fp32" else use_amp
         print(f"vdate: use_amp: {self._use_amp}")
+        
+        # runs the model at the given precision; see herbarium.model.quantize
+        self._runner = InferenceRunner(self._model, precision, calibration_batches=calibration_batches)
+        print(f"vdate: precision: {precision}")
+        self._calibration = calibration
 
         self._criterion = criterion
         self._criterion.to(self._device)
+        
+        # normalize uint8 images on the device rather than in the dataloader workers
+        self._normalize = None if normalize is None else T.Normalize(**normalize)
+        self._memory_format = getattr(model, "memory_format", None)
+        self._input_key = input_key
+        
+        self._timer = StepTimer(self._device)
     
     @property
     def device(self):
@@ -31,9 +52,12 @@ class Validator(Node):
         
     def __iter__(self):
         self._model.eval()
+        self._timer.start()
         
-        for item in self.inode:
-            item['image'] = inputs = item['image'].to(self._device, non_blocking=True)
+        item = None
+        items = prepare_runner(self._runner, self.inode, self._inputs, calibration=self._calibration)
+        for item in items:
+            item[self._input_key] = inputs = self._inputs(item)
             item['target'] = targets = item['target'].to(self._device, non_blocking=True)
 
             # NOTE: seeing some strange things after introducing amp... being cautious for
@@ -41,15 +65,22 @@ class Validator(Node):
             if self._use_amp:
                 with amp.autocast():
                     with torch.no_grad():
-                        outputs = self._model(inputs)
+                        outputs = self._runner(inputs)
                         loss = self._criterion(outputs, targets)
             else:
                 with torch.no_grad():
-                    outputs = self._model(inputs)
+                    outputs = self._runner(inputs)
                     loss = self._criterion(outputs, targets)
             
+            self._timer.step(len(targets))
+            
             item['output'] = outputs
-            item['metrics'] = {"loss": loss.item()}
+            item['metrics'] = {"loss": loss.detach()}
             
             yield item
-
+        
+        if item is not None:
+            item['metrics'].update(self._timer.metrics())
+    
+    def _inputs(self, item):
+        return to_device(item[self._input_key], self._device, normalize=self._normalize, memory_format=self._memory_format)
@@ -0,0 +1,5 @@
+from .batch import Compose
+from .batch import Flip, HorizontalFlip, VerticalFlip
+from .batch import Resize, RandomCrop, CenterCrop
+from .batch import GaussNoise, CoarseDropout
+from .batch import Normalize
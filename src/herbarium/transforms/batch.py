@@ -0,0 +1,215 @@
+import torch
+import torch.nn.functional as F
+
+
+# Batched versions of the albumentations transforms used in the trials. Each takes a (B, C, H, W)
+#  tensor, uint8 or float with pixel values 0-255, and draws its random parameters per sample
+#  on the tensor's device. The arguments follow the albumentations ones.
+#
+# Transforms that change the image size have to be applied to every sample, so only p=1.0 is
+#  supported for them.
+
+
+class Compose:
+    def __init__(self, transforms):
+        self.transforms = transforms
+    
+    def __call__(self, images):
+        for t in self.transforms:
+            images = t(images)
+        return images
+
+
+class Flip:
+    def __init__(self, p=0.5):
+        self.p = p
+    
+    def __call__(self, images):
+        B = images.shape[0]
+        device = images.device
+        
+        # as albumentations: pick one of vertical, horizontal or both
+        applied = _applied(B, self.p, device)
+        mode = torch.randint(-1, 2, (B,), device=device)
+        
+        flip_v = applied & (mode <= 0)
+        flip_h = applied & (mode != 0)
+        
+        return _flip(images, flip_v, flip_h)
+
+
+class HorizontalFlip:
+    def __init__(self, p=0.5):
+        self.p = p
+    
+    def __call__(self, images):
+        applied = _applied(images.shape[0], self.p, images.device)
+        return _flip(images, torch.zeros_like(applied), applied)
+
+
+class VerticalFlip:
+    def __init__(self, p=0.5):
+        self.p = p
+    
+    def __call__(self, images):
+        applied = _applied(images.shape[0], self.p, images.device)
+        return _flip(images, applied, torch.zeros_like(applied))
+
+
+class Resize:
+    def __init__(self, height, width, p=1.0):
+        _check_always(self, p)
+        self.height = height
+        self.width = width
+    
+    def __call__(self, images):
+        if images.shape[-2:] == (self.height, self.width):
+            return images
+        
+        return F.interpolate(_as_float(images), size=(self.height, self.width), mode="bilinear", align_corners=False)
+
+
+class RandomCrop:
+    def __init__(self, height, width, p=1.0):
+        _check_always(self, p)
+        self.height = height
+        self.width = width
+    
+    def __call__(self, images):
+        B, _, H, W = images.shape
+        device = images.device
+        
+        top = torch.randint(0, H - self.height + 1, (B,), device=device)
+        left = torch.randint(0, W - self.width + 1, (B,), device=device)
+        
+        rows = top[:, None] + torch.arange(self.height, device=device)
+        cols = left[:, None] + torch.arange(self.width, device=device)
+        
+        return _gather(images, rows, cols)
+
+
+class CenterCrop:
+    def __init__(self, height, width, p=1.0):
+        _check_always(self, p)
+        self.height = height
+        self.width = width
+    
+    def __call__(self, images):
+        H, W = images.shape[-2:]
+        top = (H - self.height) // 2
+        left = (W - self.width) // 2
+        
+        return images[:, :, top:top+self.height, left:left+self.width]
+
+
+class GaussNoise:
+    def __init__(self, var_limit=(10.0, 50.0), mean=0, per_channel=True, p=0.5):
+        if not isinstance(var_limit, (list, tuple)):
+            var_limit = (0, var_limit)
+        
+        self.var_limit = var_limit
+        self.mean = mean
+        self.per_channel = per_channel
+        self.p = p
+    
+    def __call__(self, images):
+        B, C, H, W = images.shape
+        device = images.device
+        
+        images = _as_float(images)
+        
+        applied = _applied(B, self.p, device)
+        var = torch.empty(B, device=device).uniform_(*self.var_limit)
+        sigma = torch.where(applied, var.sqrt(), torch.zeros_like(var))
+        
+        noise = torch.randn(B, C if self.per_channel else 1, H, W, device=device)
+        noise = noise * sigma[:, None, None, None] + self.mean * applied[:, None, None, None]
+        
+        return (images + noise).clamp_(0.0, 255.0)
+
+
+class CoarseDropout:
+    def __init__(self, max_holes=8, max_height=8, max_width=8, min_holes=None, min_height=None, min_width=None,
+                    fill_value=0, p=0.5):
+        self.max_holes = max_holes
+        self.min_holes = max_holes if min_holes is None else min_holes
+        self.max_height = max_height
+        self.min_height = max_height if min_height is None else min_height
+        self.max_width = max_width
+        self.min_width = max_width if min_width is None else min_width
+        self.fill_value = fill_value
+        self.p = p
+    
+    def __call__(self, images):
+        B, _, H, W = images.shape
+        device = images.device
+        
+        applied = _applied(B, self.p, device)
+        num_holes = torch.randint(self.min_holes, self.max_holes+1, (B,), device=device)
+        
+        ys = torch.arange(H, device=device)
+        xs = torch.arange(W, device=device)
+        
+        # one pass per hole, each placing a hole in every sample that has that many
+        mask = torch.zeros(B, H, W, dtype=torch.bool, device=device)
+        for hole in range(self.max_holes):
+            active = applied & (hole < num_holes)
+            
+            height = torch.randint(self.min_height, self.max_height+1, (B,), device=device)
+            width = torch.randint(self.min_width, self.max_width+1, (B,), device=device)
+            top = (torch.rand(B, device=device) * (H - height + 1)).long()
+            left = (torch.rand(B, device=device) * (W - width + 1)).long()
+            
+            in_rows = (ys >= top[:, None]) & (ys < (top + height)[:, None]) & active[:, None]
+            in_cols = (xs >= left[:, None]) & (xs < (left + width)[:, None])
+            mask |= in_rows[:, :, None] & in_cols[:, None, :]
+        
+        fill = torch.tensor(self.fill_value, dtype=images.dtype, device=device)
+        return torch.where(mask[:, None], fill, images)
+
+
+class Normalize:
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), max_pixel_value=255.0, p=1.0):
+        _check_always(self, p)
+        self.mean = torch.tensor(mean, dtype=torch.float32) * max_pixel_value
+        self.std = torch.tensor(std, dtype=torch.float32) * max_pixel_value
+    
+    def __call__(self, images):
+        if self.mean.device != images.device:
+            self.mean = self.mean.to(images.device)
+            self.std = self.std.to(images.device)
+        
+        return (_as_float(images) - self.mean[:, None, None]) / self.std[:, None, None]
+
+
+def _check_always(transform, p):
+    if p != 1.0:
+        raise ValueError(f"{type(transform).__name__} changes the image size so must have p=1.0, not {p}")
+
+
+def _applied(batch_size, p, device):
+    return torch.rand(batch_size, device=device) < p
+
+
+def _as_float(images):
+    return images if images.is_floating_point() else images.float()
+
+
+def _flip(images, flip_v, flip_h):
+    _, _, H, W = images.shape
+    device = images.device
+    
+    rows = torch.arange(H, device=device).expand(len(flip_v), H)
+    rows = torch.where(flip_v[:, None], H - 1 - rows, rows)
+    cols = torch.arange(W, device=device).expand(len(flip_h), W)
+    cols = torch.where(flip_h[:, None], W - 1 - cols, cols)
+    
+    return _gather(images, rows, cols)
+
+
+def _gather(images, rows, cols):
+    # rows is (B, h) and cols (B, w): one indexing pass gives the (B, C, h, w) result
+    batch = torch.arange(images.shape[0], device=images.device)
+    
+    out = images[batch[:, None, None], :, rows[:, :, None], cols[:, None, :]]
+    return out.permute(0, 3, 1, 2)
@@ -1 +1,4 @@
 from .progress import progress
+from .array_store import ArrayStore
+from .metrics import resolve_values, resolve_metrics
+from .step_timer import StepTimer
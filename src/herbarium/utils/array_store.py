@@ -0,0 +1,140 @@
+import os, os.path
+import json
+
+import numpy as np
+
+
+# A directory holding a fixed-shape array per key: the keys are in 'ids.npy' (sorted so rows
+#  can be found with a binary search), the rows in a raw 'data.bin' file that is memory mapped,
+#  and the shape and dtype in 'meta.json'. The meta file is written last, so a store without
+#  one is incomplete. A store with only some of its rows written keeps a mask of them in
+#  'written.npy', named in the meta file; the other rows are zeros.
+class ArrayStore:
+    VERSION = 1
+    
+    def __init__(self, path, *, mode="r"):
+        self._path = os.path.expanduser(path)
+        self._mode = mode
+        
+        with open(os.path.join(self._path, "meta.json")) as fd:
+            meta = json.load(fd)
+        if meta['version'] != self.VERSION:
+            raise ValueError(f"array store version {meta['version']} not supported: {self._path}")
+        
+        self._shape = tuple(meta['shape'])
+        self._dtype = np.dtype(meta['dtype'])
+        self._ids = np.load(os.path.join(self._path, "ids.npy"))
+        self._written = meta.get('written', None)
+        self._data = None
+    
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(os.path.expanduser(path), "meta.json"))
+
+    @classmethod
+    def create(cls, path, ids, item_shape, dtype):
+        path = os.path.expanduser(path)
+        os.makedirs(path, mode=0o775, exist_ok=True)
+        
+        ids = np.unique(np.asarray(ids))
+        shape = (len(ids),) + tuple(item_shape)
+        
+        np.save(os.path.join(path, "ids.npy"), ids)
+        if os.path.exists(written_file := os.path.join(path, "written.npy")):
+            os.remove(written_file)
+        data = np.memmap(os.path.join(path, "data.bin"), dtype=dtype, mode="w+", shape=shape)
+        data.flush()
+        del data
+        
+        meta = {
+            'version': cls.VERSION,
+            'shape': shape,
+            'dtype': np.dtype(dtype).str,
+        }
+        with open(os.path.join(path, "meta.json.tmp"), "w") as fd:
+            json.dump(meta, fd)
+        
+        store = cls.__new__(cls)
+        store._path = path
+        store._mode = "r+"
+        store._shape = shape
+        store._dtype = np.dtype(dtype)
+        store._ids = ids
+        store._written = None
+        store._data = None
+        
+        return store
+    
+    def close(self, *, written=None):
+        if self._data is not None and self._mode != "r":
+            self._data.flush()
+        self._data = None
+        
+        tmp_meta = os.path.join(self._path, "meta.json.tmp")
+        
+        # only a new store records which of its rows were written
+        if written is not None and os.path.exists(tmp_meta) and np.all(written) == False:
+            np.save(os.path.join(self._path, "written.npy"), np.asarray(written, dtype=bool))
+            self._written = "written.npy"
+            with open(tmp_meta) as fd:
+                meta = json.load(fd)
+            meta['written'] = self._written
+            with open(tmp_meta, "w") as fd:
+                json.dump(meta, fd)
+        
+        # a store is complete once its meta file is in place
+        if os.path.exists(tmp_meta):
+            os.replace(tmp_meta, os.path.join(self._path, "meta.json"))
+    
+    @property
+    def shape(self):
+        return self._shape
+    
+    @property
+    def dtype(self):
+        return self._dtype
+    
+    def ids(self):
+        return self._ids
+    
+    def written(self):
+        # a mask of the rows written, all of them unless the store was closed with fewer
+        if self._written is None:
+            return np.ones(len(self._ids), dtype=bool)
+        return np.load(os.path.join(self._path, self._written))
+    
+    def __len__(self):
+        return self._shape[0]
+    
+    def __contains__(self, key):
+        return self.row(key) is not None
+    
+    def row(self, key):
+        row = np.searchsorted(self._ids, key)
+        if row >= len(self._ids) or self._ids[row] != key:
+            return None
+        return int(row)
+    
+    def data(self):
+        # mapped on first use in each process, so forked workers share the page cache
+        #  instead of copying the array
+        if self._data is None:
+            self._data = np.memmap(os.path.join(self._path, "data.bin"), dtype=self._dtype, mode=self._mode, shape=self._shape)
+        return self._data
+    
+    def __getitem__(self, key):
+        row = self.row(key)
+        if row is None:
+            raise KeyError(key)
+        return self.data()[row]
+    
+    def __setitem__(self, key, value):
+        row = self.row(key)
+        if row is None:
+            raise KeyError(key)
+        self.data()[row] = value
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
@@ -0,0 +1,102 @@
+import sys, os
+import datetime
+
+import torch
+import torch.distributed as dist
+
+
+# Distributed data parallel training with one process per device, started by 'train-ddp' or
+#  'torchrun', which pass the rank and world size in the environment. Without them, or with a
+#  world size of one, everything here is a no-op and the training runs as a single process.
+#
+# The datasets shard their batches between the ranks, the Trainer's model is wrapped in
+#  DistributedDataParallel, and the per epoch metrics are reduced across the ranks. Only rank 0
+#  writes logs, snapshots and to stdout.
+
+def init_distributed(*, backend=None, timeout=30):
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size == 1 or dist.is_initialized():
+        return
+
+    if not dist.is_available():
+        raise RuntimeError("torch.distributed isn't available in this build of torch")
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+
+    # gloo runs anywhere, so the distributed training can be tested on cpu only machines
+    if backend is None:
+        backend = "nccl" if torch.cuda.is_available() else "gloo"
+
+    dist.init_process_group(backend, timeout=datetime.timedelta(minutes=timeout))
+
+    # the other ranks print the same things, so only rank 0 is heard; errors still go to stderr
+    if is_main() == False:
+        sys.stdout = open(os.devnull, "w")
+
+
+def shutdown_distributed():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main():
+    return get_rank() == 0
+
+
+def local_rank():
+    return int(os.environ.get("LOCAL_RANK", 0)) if is_distributed() else 0
+
+
+def all_reduce(tensor, op="sum"):
+    # returns the reduced values rather than reducing in place, so a tensor can be reduced
+    #  without changing it on this rank
+    if is_distributed() == False:
+        return tensor
+
+    ops = {
+        "sum": dist.ReduceOp.SUM,
+        "mean": dist.ReduceOp.SUM,
+        "max": dist.ReduceOp.MAX,
+        "min": dist.ReduceOp.MIN,
+    }
+
+    tensor = torch.as_tensor(tensor)
+    dtype = tensor.dtype
+
+    # nccl only reduces tensors on the device, and gloo only on the cpu
+    device = torch.device("cuda", torch.cuda.current_device()) if dist.get_backend() == "nccl" else torch.device("cpu")
+    reduced = tensor.detach().to(device, torch.float64 if dtype.is_floating_point else dtype).clone()
+
+    dist.all_reduce(reduced, ops[op])
+    if op == "mean":
+        reduced = reduced / get_world_size()
+
+    return reduced.to(tensor.device, dtype)
+
+
+def broadcast_object(obj, src=0):
+    if is_distributed() == False:
+        return obj
+
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=src)
+    return objs[0]
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
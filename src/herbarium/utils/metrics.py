@@ -0,0 +1,27 @@
+from collections import defaultdict
+
+import torch
+
+
+# The nodes leave scalar metrics as tensors on the device so the training loop doesn't wait on
+#  the device every batch; these turn them into python floats, waiting once for all of them.
+def resolve_values(values):
+    by_device = defaultdict(list)
+    for idx, value in enumerate(values):
+        if isinstance(value, torch.Tensor) and value.numel() == 1:
+            by_device[value.device].append(idx)
+    
+    values = list(values)
+    for idxs in by_device.values():
+        resolved = torch.stack([values[idx].detach().reshape(()).float() for idx in idxs]).tolist()
+        for idx, value in zip(idxs, resolved):
+            values[idx] = value
+    
+    return values
+
+
+def resolve_metrics(metrics):
+    keys = list(metrics.keys())
+    for key, value in zip(keys, resolve_values([metrics[k] for k in keys])):
+        metrics[key] = value
+    return metrics
@@ -0,0 +1,60 @@
+import time
+
+import torch
+
+from .distributed import is_distributed, all_reduce
+
+
+# Times the batches through a node. The first warmup batches of the first epoch include any
+#  compilation and autotuning, and of every epoch the dataloader startup, so they are timed
+#  separately from the steady state throughput. The device is only synchronized at the
+#  boundaries, not every batch.
+class StepTimer:
+    def __init__(self, device, *, warmup=1):
+        self._device = device
+        self._warmup = warmup
+        self._epoch = -1
+    
+    def start(self):
+        self._epoch += 1
+        self._steps = 0
+        self._images = 0
+        self._warmup_time = None
+        
+        self._synchronize()
+        self._start = self._mark = time.perf_counter()
+    
+    def step(self, batch_size):
+        self._steps += 1
+        if self._steps <= self._warmup:
+            if self._steps == self._warmup:
+                self._synchronize()
+                self._mark = time.perf_counter()
+                self._warmup_time = self._mark - self._start
+            return
+        
+        self._images += batch_size
+    
+    def metrics(self):
+        self._synchronize()
+        elapsed = time.perf_counter() - self._mark
+        
+        # with distributed training, the throughput is of all the ranks together, and the
+        #  times are of the slowest
+        if is_distributed():
+            self._images = int(all_reduce(torch.tensor(self._images)).item())
+            elapsed = all_reduce(torch.tensor(elapsed), op="max").item()
+            if self._warmup_time is not None:
+                self._warmup_time = all_reduce(torch.tensor(self._warmup_time), op="max").item()
+        
+        metrics = {}
+        if self._epoch == 0 and self._warmup_time is not None:
+            metrics['warmup_time'] = self._warmup_time
+        if self._images > 0:
+            metrics['images_per_sec'] = self._images / elapsed
+        
+        return metrics
+    
+    def _synchronize(self):
+        if self._device.type == "cuda":
+            torch.cuda.synchronize(self._device)
@@ -0,0 +1 @@
+from .build_cache import run
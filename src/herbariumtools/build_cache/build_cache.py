@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import sys, os
+import re
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dsroot", help="root of the dataset; contains train_metadata.json", type=str)
+    parser.add_argument("image_dir", help="directory of images to cache, relative to dsroot", type=str)
+    parser.add_argument("cache_dir", help="directory to write the cache to, relative to dsroot", type=str)
+    parser.add_argument("size_spec", help="{width}x{height} - size to resize the images to", type=str)
+    
+    args = parser.parse_args()
+    
+    dsroot = os.path.expanduser(args.dsroot)
+    image_dir = os.path.join(dsroot, args.image_dir)
+    if not os.path.isdir(image_dir):
+        print("Error: image directory does not exist")
+        sys.exit(1)
+    
+    cache_dir = os.path.join(dsroot, args.cache_dir)
+    if os.path.exists(cache_dir):
+        print("Error: cache directory already exists; won't overwrite")
+        sys.exit(1)
+    
+    m = re.match(r"^(\d+)x(\d+)$", args.size_spec)
+    if m is None:
+        print(f"Error: can't process the size specification: {args.size_spec}")
+        sys.exit(1)
+    
+    width, height = int(m.group(1)), int(m.group(2))
+    
+    return dsroot, image_dir, cache_dir, width, height
+
+
+def run():
+    from herbarium.utils import ArrayStore
+    from herbarium.nodes.data.metadata_index import load_index
+    from herbarium.nodes.data.herbarium_dataset import load_excludes
+    
+    dsroot, image_dir, cache_dir, width, height = parse_args()
+    
+    # cache every image in the metadata so the one cache serves all splits and folds, other
+    #  than the excluded images and any that aren't in the image directory
+    index = load_index(dsroot, verbose=True)
+    excluded = load_excludes(dsroot)
+    
+    images = {}
+    missing = 0
+    for image_id, name in zip(index.image_id.tolist(), index.names()):
+        if name in excluded:
+            continue
+        if not os.path.exists(os.path.join(image_dir, name)):
+            missing += 1
+            continue
+        images[image_id] = name
+    
+    if missing > 0:
+        print(f"{missing} images missing from {image_dir}; not cached", file=sys.stderr)
+    if len(images) == 0:
+        print("Error: no images to cache")
+        sys.exit(1)
+    
+    store = ArrayStore.create(cache_dir, list(images.keys()), (height, width, 3), np.uint8)
+    data = store.data()
+    
+    # images that can't be read are left out of the cache and loaded as usual
+    written = np.zeros(len(store), dtype=bool)
+    
+    start = time.time()
+    for row, image_id in enumerate(store.ids().tolist()):
+        try:
+            with Image.open(os.path.join(image_dir, images[image_id])) as im:
+                im = im.convert("RGB")
+                if im.size != (width, height):
+                    im = im.resize((width, height), Image.Resampling.BILINEAR)
+                data[row] = np.asarray(im)
+            written[row] = True
+        except OSError as e:
+            print(f"failed to cache {images[image_id]}: {e}", file=sys.stderr)
+        
+        if (row+1) % 1000 == 0:
+            elapsed = time.time() - start
+            print(f"cached {row+1}/{len(store)} images: {(row+1)/elapsed:0.1f} images/sec")
+    
+    store.close(written=written)
+    
+    elapsed = (time.time() - start)/60
+    print(f"cached {written.sum()} images in {elapsed:0.2f}m")
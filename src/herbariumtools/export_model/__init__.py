@@ -0,0 +1 @@
+from .export_model import run
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+def parse_cmdline():
+    import os, argparse
+    from datetime import datetime
+    from herbarium.config import load_config
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--format', help='format to export to', type=str, choices=['torchscript', 'onnx'], default='torchscript')
+    parser.add_argument('-s', '--size', help='size of the example input, WIDTHxHEIGHT', type=str, default="336x336")
+    parser.add_argument('-o', '--output', help='file to write to (default: next to the weights file)', type=str, default=None)
+    parser.add_argument('config_file', help='configuration file to load the model from (- for stdin)', type=str, default=None)
+    parser.add_argument('weights_file', help='weights file to load', type=str, default=None)
+    parser.add_argument('variables', help='key=value variables for template expansion', type=str, nargs='*', default=None)
+    
+    args = parser.parse_args()
+    
+    now = datetime.now()
+    
+    # the model is exported on the cpu; the loaders move it to the device
+    options = {
+        'timestamp': now.isoformat(),
+        'run_id': os.path.basename(args.weights_file),
+        'run_dir': os.path.dirname(args.weights_file),
+        'num_workers': 0,
+        'batch_size': 1,
+        'batch_limit': 0,
+        'weights_file': args.weights_file,
+        'use_gpu': False
+    }
+    if args.variables is not None:
+        for kv in args.variables:
+            k, v = kv.split('=', maxsplit=1)
+            options[k] = v
+    
+    cfg = load_config(args.config_file, **options)
+    
+    width, height = [int(v) for v in args.size.split('x')]
+    
+    output = args.output
+    if output is None:
+        extension = ".ts" if args.format == 'torchscript' else ".onnx"
+        output = os.path.splitext(args.weights_file)[0] + extension
+    
+    return cfg, args.format, width, height, output
+
+
+def run():
+    import time
+    import torch
+    from herbarium.config import instantiate
+    from herbarium.exported import make_metadata
+    from herbarium.exported import save_torchscript, torchscript
+    from herbarium.exported import save_onnx, onnxruntime
+    
+    cfg, fmt, width, height, output = parse_cmdline()
+    
+    if cfg.get('model', None) is None:
+        raise ValueError("missing model in configuration")
+    
+    model = instantiate(cfg['model'], {})
+    model.eval()
+    print(f"model: {model.fullname}")
+    
+    example = torch.rand(2, 3, height, width)
+    metadata = make_metadata(model, height, width)
+    
+    print(f"exporting to {output}")
+    if fmt == 'torchscript':
+        save_torchscript(model, output, example, metadata)
+        load = torchscript
+    else:
+        save_onnx(model, output, example, metadata)
+        load = onnxruntime
+    
+    # check the exported model against the original, at a different batch size to the example
+    start = time.monotonic()
+    exported = load(output)
+    duration = time.monotonic() - start
+    print(f"loaded {exported.fullname} in {duration:0.2f} seconds")
+    
+    inputs = torch.rand(3, 3, height, width)
+    with torch.no_grad():
+        expected = model(inputs)
+        outputs = exported(inputs)
+    
+    error = (outputs - expected).abs().max().item()
+    print(f"max difference: {error:0.3g}")
@@ -0,0 +1 @@
+from .extract_features import run
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+def parse_cmdline():
+    import os, argparse
+    from datetime import datetime
+    import torch
+    from herbarium.config import load_config, save_config
+    
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--use-cpu', help='use the CPU even if there is a GPU', action='store_true')
+    parser.add_argument('-b', '--batch-size', help='batch size', type=int, default=12)
+    parser.add_argument('-l', '--batch-limit', help='max batches to extract (0 = no limit)', type=int, default=0)
+    parser.add_argument('-w', '--num-workers', help='number of workers to use', type=int, default=-1)
+    parser.add_argument('config_file', help='configuration file to load (- for stdin)', type=str, default=None)
+    parser.add_argument('weights_file', help='weights file to load', type=str, default=None)
+    parser.add_argument('feature_dir', help='directory to write the features to', type=str, default=None)
+    parser.add_argument('variables', help='key=value variables for template expansion', type=str, nargs='*', default=None)
+    
+    args = parser.parse_args()
+    
+    use_gpu = not args.use_cpu
+    if args.num_workers == -1:
+        args.num_workers = 4 if use_gpu and torch.cuda.is_available() else 0
+    
+    feature_dir = os.path.expanduser(args.feature_dir)
+    if os.path.exists(feature_dir):
+        raise ValueError(f"feature directory already exists; won't overwrite: {feature_dir}")
+    
+    now = datetime.now()
+    
+    options = {
+        'timestamp': now.isoformat(),
+        'run_id': now.strftime("%Y%m%d-%H%M%S"),
+        'run_dir': feature_dir,
+        'num_workers': args.num_workers,
+        'batch_size': args.batch_size,
+        'batch_limit': args.batch_limit,
+        'weights_file': args.weights_file,
+        'use_gpu': use_gpu
+    }
+    if args.variables is not None:
+        for kv in args.variables:
+            k, v = kv.split('=', maxsplit=1)
+            options[k] = v
+    
+    cfg = load_config(args.config_file, **options)
+    
+    os.makedirs(feature_dir, mode=0o775)
+    save_config(cfg, feature_dir, "extract")
+    
+    return cfg, feature_dir, now
+
+
+def run():
+    import sys, time
+    from datetime import datetime
+    import numpy as np
+    import torch
+    from herbarium.config import instantiate, build_pipeline
+    from herbarium.model import save_state
+    from herbarium.model.trunks import split_head
+    from herbarium.model.head import Head
+    from herbarium.nodes import iter_fwd, get_root
+    from herbarium.utils import progress, ArrayStore
+    
+    cfg, feature_dir, start = parse_cmdline()
+    print(f"start at: {start.isoformat(sep=' ', timespec='seconds')}")
+    
+    instances = {}
+    for k, v in cfg.items():
+        if k.endswith("_pipeline"):
+            continue
+        instances[k] = instantiate(cfg[k], instances)
+    
+    if instances.get('model', None) is None:
+        raise ValueError("missing model in configuration")
+    
+    model = instances.get('model')               # required at top level of config
+    print(f"model: {model.fullname}")
+    
+    # the model's final linear layer is split off, so the pipeline's outputs are the features
+    #  the layer runs on; it's saved with the features as the starting point for a new head
+    fc = split_head(model)
+    num_features = fc.in_features
+    print(f"features: {num_features}")
+    
+    epipe = build_pipeline(cfg['extract_pipeline'], instances)
+    
+    print("extract pipeline:")
+    for n in iter_fwd(epipe):
+        print(f"- {n.fullname}")
+    
+    print(f"running on {model.device}")
+    
+    # a row for every image the pipeline could produce; a limited run marks the rows it wrote,
+    #  and FeatureDataset leaves out the rest
+    image_ids = get_root(epipe).image_ids()
+    store = ArrayStore.create(feature_dir, image_ids, (num_features,), np.float16)
+    store_ids = store.ids()
+    data = store.data()
+    written = np.zeros(len(store_ids), dtype=bool)
+    
+    count = 0
+    estart = time.time()
+    with torch.no_grad():
+        for idx, item in progress(epipe, header="Extract"):
+            features = item['output'].flatten(1)
+            if features.shape[1] != num_features:
+                raise ValueError(f"expected {num_features} features, not {features.shape[1]}")
+            
+            rows = np.searchsorted(store_ids, np.asarray(item['image_id']))
+            data[rows] = features.to('cpu', torch.float16).numpy()
+            written[rows] = True
+            count += len(rows)
+    
+    elapsed = time.time() - estart
+    print(f"extracted {count}/{len(store)} images: {count/max(elapsed, 1e-6):0.1f} images/sec")
+    if written.all() == False:
+        print(f"features: {len(store) - written.sum()} images not extracted", file=sys.stderr)
+    
+    store.close(written=written)
+    
+    head = Head(num_features, fc.out_features)
+    head.fc.load_state_dict(fc.state_dict())
+    save_state(0, head, None, "head", state_dir=feature_dir)
+    
+    end = datetime.now()
+    print(f"finish at: {end.isoformat(sep=' ', timespec='seconds')}")
+    
+    duration = end - start
+    print(f"run time: {duration}")
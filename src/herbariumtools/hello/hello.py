@@ -5,7 +5,7 @@ import torch
 import albumentations as A
 import albumentations.pytorch
 
-from herbarium.utils import progress
+from herbarium.utils import progress, resolve_metrics
 
 from herbarium.nodes import get_root, iter_fwd
 from herbarium.nodes import data
@@ -142,7 +142,7 @@ def train_vdate():
 
         for idx, item in progress(tpipe, header="Train", end=""):
             pass
-        metrics = item['metrics']
+        metrics = resolve_metrics(item['metrics'])
         del metrics['lr']
         for k, v in islice(metrics.items(), 3):
             print(f', {k}={v:0.4f}', end='')
@@ -151,7 +151,7 @@ def train_vdate():
         with torch.no_grad():
             for idx, item in progress(vpipe, header="Vdate", end=""):
                 pass
-            metrics = item['metrics']
+            metrics = resolve_metrics(item['metrics'])
             for k, v in islice(metrics.items(), 3):
                 print(f', {k}={v:0.4f}', end='')
             print(flush=True)
@@ -94,6 +94,13 @@ def run():
             predictions = item['prediction']
             for image_id, prediction in zip(image_ids, predictions):
                 results[int(image_id)] = int(prediction)
+
+    if hasattr(model, "member_latencies"):
+        print("member latency:")
+        for idx, (name, latency) in enumerate(model.member_latencies()):
+            print(f"- {idx} {name}: {latency:0.1f} ms/batch")
+        if (stats := model.cache_stats()) is not None:
+            print(f"feature cache: {stats[0]} hits, {stats[1]} misses")
     
     pred_file = os.path.splitext(os.path.basename(cfg['runtime']['weights_file']))[0] + "-pred.csv"
     pred_file = os.path.join(run_dir, pred_file)
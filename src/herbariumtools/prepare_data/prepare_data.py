@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 import sys, os
 import re
+import io
+import random
 import argparse
+import csv
+import time
+from multiprocessing import Pool
 from PIL import Image
 
 
+MANIFEST_NAME = "manifest.csv"
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("src_dir", help="location of original images")
     parser.add_argument("out_dir", help="location of resized images")
     parser.add_argument("size_spec", help="{width}x{height} - size to resize (omit one to preserve aspect ratio)", type=str)
     parser.add_argument("crop_spec", help="{width}x{height} - size to centre crop (omit one to preserve aspect ration)", type=str, nargs='?', default=None)
+    parser.add_argument("-a", "--add-output", help="another output from the same decode: out_dir size_spec [crop_spec]", 
+                            metavar="SPEC", nargs='+', action='append', default=[])
+    parser.add_argument("-s", "--shards", help="write the images into packed shard files", action='store_true')
+    parser.add_argument("--shard-size", help="target size of each shard in MB", type=int, default=1024)
+    parser.add_argument("--seed", help="random seed for the order of images in the shards", type=int, default=331)
+    parser.add_argument("-w", "--workers", help="number of worker processes", type=int, default=os.cpu_count())
+    parser.add_argument("-r", "--resume", help="continue an interrupted run, skipping images already written", action='store_true')
     
     args = parser.parse_args()
     
@@ -18,18 +33,47 @@ def parse_args():
     if not os.path.exists(srcdir) or not os.path.isdir(srcdir):
         print("Error: source directory does not exist")
         sys.exit(1)
-        
-    outdir = os.path.expanduser(args.out_dir)
-    if os.path.exists(outdir):
-        print("Error: output directory already exists; won't overwrite")
+    
+    if args.resume and args.shards:
+        print("Error: can't resume writing shards")
+        sys.exit(1)
+    
+    specs = [[args.out_dir, args.size_spec, args.crop_spec]]
+    for spec in args.add_output:
+        if len(spec) not in [2, 3]:
+            print(f"Error: an output needs an out_dir, size_spec and optional crop_spec: {' '.join(spec)}")
+            sys.exit(1)
+        specs.append(spec + [None] * (3 - len(spec)))
+    
+    outputs = [parse_output(*spec, resume=args.resume) for spec in specs]
+    
+    outdirs = [output.outdir for output in outputs]
+    if len(set(outdirs)) != len(outdirs):
+        print("Error: each output needs its own directory")
+        sys.exit(1)
+    
+    # create the resizer
+    for outdir in outdirs:
+        os.makedirs(outdir, mode=0o775, exist_ok=args.resume)
+    
+    shard_size = args.shard_size * 1024 * 1024 if args.shards else None
+    
+    r = Resizer(srcdir, outputs, shard_size=shard_size, seed=args.seed, workers=max(1, args.workers))
+    return r
+
+
+def parse_output(out_dir, size_spec, crop_spec, *, resume=False):
+    outdir = os.path.expanduser(out_dir)
+    if os.path.exists(outdir) and not resume:
+        print(f"Error: output directory {outdir} already exists; won't overwrite (use --resume to continue a run)")
         sys.exit(1)
     
     size_re = re.compile(r"^(\d*)x(\d*)$")
     
     # process the size spec
-    m = size_re.match(args.size_spec)
+    m = size_re.match(size_spec)
     if m is None:
-        print(f"Error: can't process the size specification: {args.size_spec}")
+        print(f"Error: can't process the size specification: {size_spec}")
         sys.exit(1)
     
     r_width = None if len(m.group(1)) == 0 else int(m.group(1))
@@ -42,10 +86,10 @@ def parse_args():
     # process the crop spec
     c_width = c_height = None
     
-    if args.crop_spec is not None:
-        m = size_re.match(args.crop_spec)
+    if crop_spec is not None:
+        m = size_re.match(crop_spec)
         if m is None:
-            print(f"Error: can't process the crop specification: {args.crop_spec}")
+            print(f"Error: can't process the crop specification: {crop_spec}")
             sys.exit(1)
     
         c_width = None if len(m.group(1)) == 0 else int(m.group(1))
@@ -54,27 +98,135 @@ def parse_args():
         if c_width is None and c_height is None:
             print("Error: must specify at least one dimension for crop")
             sys.exit(1)
-            
-    # create the resizer
-    os.makedirs(outdir, mode=0o775, exist_ok=False)
     
-    r = Resizer(srcdir, outdir, r_width, r_height, c_width, c_height)
-    return r
+    return Output(outdir, r_width, r_height, c_width, c_height)
 
 
-class Resizer:
-    def __init__(self, srcdir, outdir, r_width, r_height, c_width, c_height):
-        self.srcdir = srcdir
+class Output:
+    def __init__(self, outdir, r_width, r_height, c_width, c_height):
         self.outdir = outdir
         self.r_width = r_width
         self.r_height = r_height
         self.c_width = c_width
         self.c_height = c_height
+    
+    def resize_size(self, swidth, sheight):
+        rwidth = self.r_width
+        if rwidth is None:
+            rwidth = int(swidth*self.r_height/sheight)
+        
+        rheight = self.r_height
+        if rheight is None:
+            rheight = int(sheight*self.r_width/swidth)
+        
+        return rwidth, rheight
+    
+    def crop(self, im):
+        if self.c_width is None and self.c_height is None:
+            return im
+        
+        rwidth, rheight = im.size
+        
+        cwidth = self.c_width
+        if cwidth is None:
+            cwidth = int(rwidth*self.c_height/rheight)
+    
+        cheight = self.c_height
+        if cheight is None:
+            cheight = int(rheight*self.c_width/rwidth)
+        
+        left = (rwidth - cwidth)/2
+        right = left + cwidth
+        upper = (rheight - cheight)/2
+        lower = upper + cheight
+        
+        return im.crop((left, upper, right, lower))
+
+
+class Resizer:
+    def __init__(self, srcdir, outputs, *, shard_size=None, seed=331, workers=1):
+        self.srcdir = srcdir
+        self.outputs = outputs
+        self.shard_size = shard_size
+        self.seed = seed
+        self.workers = workers
         
     def run(self):
-        self.scan(self.srcdir, self.outdir)
+        if self.shard_size is not None:
+            self.pack()
+        else:
+            self.convert()
+    
+    def imap(self, func, items, *, ordered=True):
+        # chunked to keep the per image IPC down; shards need the results in order, files don't
+        if self.workers == 1:
+            yield from map(func, items)
+            return
+        
+        with Pool(self.workers) as pool:
+            if ordered:
+                yield from pool.imap(func, items, chunksize=16)
+            else:
+                yield from pool.imap_unordered(func, items, chunksize=16)
+    
+    def convert(self):
+        names = []
+        self.scan(self.srcdir, [output.outdir for output in self.outputs], names)
+        
+        print(f"converting {len(names)} images to {len(self.outputs)} outputs with {self.workers} workers")
+        
+        manifests = [{} for _ in self.outputs]
+        progress = Throughput("converted", len(names))
+        for name, entries, created in self.imap(self.process, names, ordered=False):
+            for manifest, entry in zip(manifests, entries):
+                manifest[name] = entry
+            progress.update(created)
+        progress.done()
+        
+        for output, manifest in zip(self.outputs, manifests):
+            write_manifest(output.outdir, manifest)
+    
+    def pack(self):
+        # collect all the images and write them in a random order so that reading a shard
+        #  sequentially gives a mix of categories
+        names = []
+        for root, dirs, files in os.walk(self.srcdir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for entry in files:
+                if entry.startswith(".") or not self.is_jpeg(entry):
+                    continue
+                names.append(os.path.relpath(os.path.join(root, entry), self.srcdir))
+        
+        names.sort()
+        random.Random(self.seed).shuffle(names)
+        
+        print(f"packing {len(names)} images to {len(self.outputs)} outputs with {self.workers} workers")
+        
+        # the workers encode, this process writes the shards in order
+        manifests = [{} for _ in self.outputs]
+        progress = Throughput("packed", len(names))
+        writers = [ShardWriter(output.outdir, self.shard_size) for output in self.outputs]
+        for name, encoded in self.imap(self.encode, names):
+            for writer, manifest, (data, size) in zip(writers, manifests, encoded):
+                writer.write(name, data)
+                manifest[name] = (*size, len(data))
+            progress.update(True)
+        
+        for writer in writers:
+            writer.close()
+        progress.done()
+        
+        for output, writer, manifest in zip(self.outputs, writers, manifests):
+            print(f"packed {len(names)} images into {writer.num_shards} shards in {output.outdir}")
+            write_manifest(output.outdir, manifest)
+        
+    def scan(self, sroot, oroots, names):
+        # clean up after an interrupted run
+        for oroot in oroots:
+            for entry in os.listdir(oroot):
+                if entry.startswith(".") and entry.endswith(".tmp"):
+                    os.remove(os.path.join(oroot, entry))
         
-    def scan(self, sroot, oroot):
         # sort entries so can judge progress...
         entries = list(os.listdir(sroot))
         entries.sort()
@@ -84,20 +236,15 @@ class Resizer:
                 continue
             
             spath = os.path.join(sroot, entry)
-            opath = os.path.join(oroot, entry)
+            opaths = [os.path.join(oroot, entry) for oroot in oroots]
     
             if os.path.isfile(spath):
-                if os.path.exists(opath):
-                    continue
-                if self.process(spath, opath) == False:
-                    return False
+                names.append(os.path.relpath(spath, self.srcdir))
     
             elif os.path.isdir(spath):
-                os.makedirs(opath, mode=0o775, exist_ok=True)
-                if self.scan(spath, opath) == False:
-                    return False
-    
-        return True
+                for opath in opaths:
+                    os.makedirs(opath, mode=0o775, exist_ok=True)
+                self.scan(spath, opaths, names)
 
     def is_jpeg(self, name):
         lname = name.lower()
@@ -105,50 +252,155 @@ class Resizer:
             return True
         return False
 
-    def process(self, spath, opath):
-        print(f"processing {spath}")
-
-        with Image.open(spath) as im:
-            swidth, sheight = im.size
-            
-            # the resize
-            rwidth = self.r_width
-            if rwidth is None:
-                rwidth = int(swidth*self.r_height/sheight)
+    def process(self, name):
+        spath = os.path.join(self.srcdir, name)
+        opaths = [os.path.join(output.outdir, name) for output in self.outputs]
+        
+        # only the outputs not done by an earlier run are made; the source is decoded once for all of them
+        todo = [output for output, opath in zip(self.outputs, opaths) if not os.path.exists(opath)]
+        if len(todo) > 0:
+            with Image.open(spath) as im:
+                for output, out in self.resize(im, todo):
+                    self.save(out, os.path.join(output.outdir, name))
         
-            rheight = self.r_height
-            if rheight is None:
-                rheight = int(rheight*self.r_width/swidth)
+        # the sizes of all the outputs; only the header is read
+        entries = []
+        for opath in opaths:
+            with Image.open(opath) as im:
+                entries.append((im.width, im.height, os.path.getsize(opath)))
+        
+        return name, entries, len(todo) > 0
+    
+    def save(self, out, opath):
+        # write to a hidden temporary and rename so the output is either complete or missing
+        odir, oname = os.path.split(opath)
+        tpath = os.path.join(odir, f".{oname}.{os.getpid()}.tmp")
+        
+        oformat = Image.registered_extensions()[os.path.splitext(oname)[1].lower()]
+        if self.is_jpeg(opath):
+            out.save(tpath, format=oformat, quality=95)
+        else:
+            out.save(tpath, format=oformat)
+        os.replace(tpath, opath)
     
-            print(f"  resize {swidth}x{sheight} -> {rwidth}x{rheight}")
-            out = im.resize((rwidth, rheight), Image.Resampling.BILINEAR)
+    def encode(self, name):
+        encoded = [None] * len(self.outputs)
+        
+        with Image.open(os.path.join(self.srcdir, name)) as im:
+            for output, out in self.resize(im, self.outputs):
+                data = io.BytesIO()
+                out.save(data, format="JPEG", quality=95)
+                encoded[self.outputs.index(output)] = (data.getvalue(), out.size)
+        
+        return name, encoded
+
+    def resize(self, im, outputs):
+        im.load()
+        swidth, sheight = im.size
+        
+        # largest first, so each resize can start from the previous, smaller, image instead of the source
+        sizes = [(output.resize_size(swidth, sheight), output) for output in outputs]
+        sizes.sort(key=lambda s: s[0][0]*s[0][1], reverse=True)
+        
+        src = im
+        for (rwidth, rheight), output in sizes:
+            if src.width < rwidth or src.height < rheight:
+                src = im
             
-            # the crop
-            if self.c_width is not None or self.c_height is not None:
-                cwidth = self.c_width
-                if cwidth is None:
-                    cwidth = int(rwidth*self.c_height/rheight)
-        
-                cheight = self.c_height
-                if cheight is None:
-                    cheight = int(rheight*self.c_width/rwidth)
-    
-                print(f"    crop {rwidth}x{rheight} -> {cwidth}x{cheight}")
-                
-                left = (rwidth - cwidth)/2
-                right = left + cwidth
-                upper = (rheight - cheight)/2
-                lower = upper + cheight
-                
-                out = out.crop((left, upper, right, lower))
+            src = src.resize((rwidth, rheight), Image.Resampling.BILINEAR)
             
-            # the saving
-            if self.is_jpeg(opath):
-                out.save(opath, quality=95)
-            else:
-                out.save(opath)
+            yield output, output.crop(src)
+
+
+class ShardWriter:
+    def __init__(self, outdir, shard_size):
+        self.outdir = outdir
+        self.shard_size = shard_size
+        self.num_shards = 0
+        
+        self._fd = None
+        self._index = []
+        self._offset = 0
+    
+    def write(self, name, data):
+        if self._fd is None:
+            path = os.path.join(self.outdir, f"shard-{self.num_shards:05d}.bin")
+            self._fd = open(path, "wb")
+            self.num_shards += 1
+        
+        self._fd.write(data)
+        self._index.append((name, self._offset, len(data)))
+        self._offset += len(data)
+        
+        if self._offset >= self.shard_size:
+            self.close()
+    
+    def close(self):
+        if self._fd is None:
+            return
+        
+        path = os.path.splitext(self._fd.name)[0] + ".idx"
+        self._fd.close()
+        
+        # write the index last; readers ignore shards without one
+        with open(path, "w") as fd:
+            for name, offset, length in self._index:
+                print(f"{name} {offset} {length}", file=fd)
+        
+        self._fd = None
+        self._index = []
+        self._offset = 0
+
+
+class Throughput:
+    def __init__(self, label, total, *, interval=30):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        
+        self.count = 0
+        self.created = 0
+        self.start = self.last = time.time()
+    
+    def update(self, created):
+        self.count += 1
+        if created:
+            self.created += 1
+        
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report(now)
+    
+    def done(self):
+        self.report(time.time())
+    
+    def report(self, now):
+        elapsed = now - self.start
+        rate = self.created/elapsed if elapsed > 0 else 0
+        
+        eta = ""
+        if rate > 0 and self.count < self.total:
+            eta = f", eta {(self.total - self.count)/rate/60:0.1f}m"
+        
+        skipped = self.count - self.created
+        print(f"{self.label} {self.created} images ({skipped} already done), {self.count}/{self.total}: "
+                f"{rate:0.1f} images/sec, {elapsed/60:0.1f}m{eta}", flush=True)
+
+
+def write_manifest(outdir, manifest):
+    # the name and size of every output image, so the dataset nodes don't need to look at the files
+    path = os.path.join(outdir, MANIFEST_NAME)
+    tpath = f"{path}.tmp"
+    
+    with open(tpath, "w", newline="") as fd:
+        writer = csv.writer(fd)
+        writer.writerow(["name", "width", "height", "bytes"])
+        for name in sorted(manifest.keys()):
+            writer.writerow([name, *manifest[name]])
+    os.replace(tpath, path)
     
-        return True
+    print(f"wrote {path}")
 
 
 def run():
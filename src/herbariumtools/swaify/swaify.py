@@ -39,7 +39,7 @@ def run():
     import torch
     from torch.optim import swa_utils
     from herbarium.config import build_pipeline
-    from herbarium.model import load_model, load_state_file, save_state
+    from herbarium.model import load_model, average_state_files, save_state
     from herbarium.utils import progress
     
     cfg = parse_cmdline()
@@ -53,12 +53,13 @@ def run():
     device = model.device
     print(f"running on {device}")
     
+    # the averaged model is a copy, so the original isn't needed; the average is streamed in a
+    #  parameter at a time, so however many files there are, it takes one model's memory
     swa_model = swa_utils.AveragedModel(model)
+    del model
     
-    for weights_file in weights_files:
-        print(f"loading {weights_file}")
-        _, model, _ = load_state_file(model, None, weights_file, device=device, verbose=False)
-        swa_model.update_parameters(model)
+    average_state_files(swa_model.module, weights_files, device=device)
+    swa_model.n_averaged.fill_(len(weights_files))
 
     print("building swa bn pipeline")
     swapipe = build_pipeline(cfg['swa_pipeline'])
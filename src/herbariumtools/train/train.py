@@ -6,6 +6,7 @@ def parse_cmdline():
     from datetime import datetime
     import torch
     from herbarium.config import load_config, save_config
+    from herbarium.utils.distributed import is_main, broadcast_object, barrier
     
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--use-cpu', help='use the CPU even if there is a GPU', action='store_true')
@@ -15,6 +16,7 @@ def parse_cmdline():
     parser.add_argument('-l', '--batch-limit', help='max batches per epoch (0 = no limit)', type=int, default=0)
     parser.add_argument('-w', '--num-workers', help='number of workers to use', type=int, default=-1)
     parser.add_argument('-r', '--run-id', help='the id of the run', type=str, default=None)
+    parser.add_argument('--resume', help='snapshot to resume the run from', type=str, default=None)
     parser.add_argument('config_file', help='configuration file to load (- for stdin)', type=str, default=None)
     parser.add_argument('variables', help='key=value variables for template expansion', type=str, nargs='*', default=None)
     
@@ -30,10 +32,16 @@ def parse_cmdline():
     
     now = datetime.now()
     
+    # all the ranks of a distributed run use rank 0's run id
     run_id = args.run_id
     if run_id is None:
-        run_id = now.strftime("%Y%m%d-%H%M%S")
+        run_id = broadcast_object(now.strftime("%Y%m%d-%H%M%S"))
     run_dir = os.path.join("snapshots", f"{run_id}-train")
+    
+    # a resumed run carries on in the directory of its snapshot
+    if args.resume is not None:
+        run_dir = os.path.dirname(args.resume)
+        run_id = os.path.basename(run_dir).removesuffix("-train")
 
     options = {
         'timestamp': now.isoformat(sep=' ', timespec='seconds'),
@@ -55,10 +63,12 @@ def parse_cmdline():
     cfg = load_config(args.config_file, **options)
     
     run_dir = cfg['runtime']['run_dir']
-    os.makedirs(run_dir, mode=0o777, exist_ok=False)
-    save_config(cfg, run_dir, "train")
+    if is_main():
+        os.makedirs(run_dir, mode=0o777, exist_ok=args.resume is not None)
+        save_config(cfg, run_dir, "train" if args.resume is None else "resume")
+    barrier()
     
-    return cfg, now
+    return cfg, args.resume, now
 
 
 def check_data(tpipe, vpipe):
@@ -68,34 +78,55 @@ def check_data(tpipe, vpipe):
     
     troot = get_root(tpipe)
     timages = set(troot.image_ids())
-    if len(timages) != len(troot):
+    if len(timages) != len(troot.image_ids()):
         print("Error: duplicates in train images")
         ok = False
     
     vroot = get_root(vpipe)
     vimages = set(vroot.image_ids())
-    if len(vimages) != len(vroot):
+    if len(vimages) != len(vroot.image_ids()):
         print("Error: duplicates in validate images")
         ok = False
 
     if len(timages.intersection(vimages)) != 0:
         overlap = timages.intersection(vimages)
-        print(f"Error: train and validate datasets overlap: {len(tnames.intersection(vnames))} {overlap.pop()}")
+        print(f"Error: train and validate datasets overlap: {len(overlap)} {overlap.pop()}")
         ok = False
 
     if ok == False:
         raise ValueError("unable to proceed: resolve dataset issues")
 
 
-def snapshot_state(snapshot_dir, epoch, model, optimizer, metrics):
+def snapshot_state(snapshot_dir, manager, epoch, model, optimizer, metrics, *, batch=None, training=None):
     import os.path
-    from herbarium.model import save_state
+    from herbarium.model import make_state, unwrap
+    from herbarium.utils.distributed import is_main
+    
+    # only rank 0 writes snapshots when training is distributed
+    if is_main() == False:
+        return
     
     snapshot_base = os.path.basename(snapshot_dir)
     name = f'{snapshot_base}-{epoch:02d}'
+    if batch is not None:
+        name += f'-{batch:05d}'
+    
+    extra = None
+    if training is not None:
+        extra = {'training': training}
+    
+    m = unwrap(model)
+    m = m.wrapped if hasattr(m, "wrapped") else m
+    state = make_state(epoch, m, optimizer, extra=extra)
     
-    m = model.wrapped if hasattr(model, "wrapped") else model
-    save_state(epoch, m, optimizer, name, state_dir=snapshot_dir, verbose=True, overwrite=True)
+    # the batch snapshots are only there to resume from, so they always keep the optimizer and
+    #  only the latest is kept; the epoch snapshots are ranked for keeping by their validation loss
+    if batch is not None:
+        manager.save(state, name, resume_only=True, verbose=False)
+        return
+    
+    loss = metrics.get('loss', None) if metrics is not None else None
+    manager.save(state, name, metric=float(loss) if loss is not None else None)
     
     if metrics is None:
         return
@@ -105,12 +136,79 @@ def snapshot_state(snapshot_dir, epoch, model, optimizer, metrics):
     if f1_scores is None or f1_data is None:
         return
     
-    f1_data = f1_data.T
+    f1_data = f1_data.T.tolist()
+    f1_scores = f1_scores.tolist()
+    
+    precision = metrics.get("precision_scores", None)
+    recall = metrics.get("recall_scores", None)
+    
     path = os.path.join(snapshot_dir, f"{name}-f1.csv")
     with open(path, "w") as f:
-        print("category,f1,tp,fp+fn", file=f)
-        for idx, row in enumerate(zip(f1_scores,f1_data)):
-            print(f"{idx},{row[0]},{row[1][0]},{row[1][1]}", file=f)
+        if precision is None or recall is None:
+            print("category,f1,tp,fp+fn", file=f)
+            for idx, row in enumerate(zip(f1_scores,f1_data)):
+                print(f"{idx},{row[0]},{row[1][0]},{row[1][1]}", file=f)
+        else:
+            print("category,f1,tp,fp+fn,precision,recall", file=f)
+            for idx, row in enumerate(zip(f1_scores,f1_data,precision.tolist(),recall.tolist())):
+                print(f"{idx},{row[0]},{row[1][0]},{row[1][1]},{row[2]},{row[3]}", file=f)
+
+
+def training_state(batch, tpipe, vpipe, loop):
+    from herbarium.nodes import pipeline_state
+    
+    # everything needed to carry on from the snapshot, other than the model and optimizer: 
+    #  the batches of the epoch done (None once it's finished), the state of the nodes, such
+    #  as the sampler, schedulers, scaler and logger, and of the training loop
+    return {
+        'batch': batch,
+        'train_pipeline': pipeline_state(tpipe),
+        'validate_pipeline': pipeline_state(vpipe),
+        'loop': dict(loop),
+    }
+
+
+def find_trainer(tpipe):
+    from herbarium.nodes import iter_rev
+    from herbarium.nodes.train import Trainer
+    
+    for n in iter_rev(tpipe):
+        if isinstance(n, Trainer):
+            return n
+    
+    raise ValueError("the train pipeline has no Trainer")
+
+
+def resume_state(resume_file, model, optimizer, tpipe, vpipe, manager):
+    from herbarium.model import read_state_file, restore_state, unwrap
+    from herbarium.nodes import get_root, load_pipeline_state
+    
+    print(f"Resuming from {resume_file}")
+    
+    state = read_state_file(resume_file, model.device)
+    training = state.get('training', None)
+    if training is None:
+        raise ValueError(f"{resume_file} doesn't have the training state; it can't be resumed")
+    
+    m = unwrap(model)
+    m = m.wrapped if hasattr(m, "wrapped") else m
+    
+    # the optimizer is restored before the pipelines so the schedulers set its learning rates
+    epoch, _, _ = restore_state(state, m, optimizer)
+    load_pipeline_state(tpipe, training['train_pipeline'])
+    load_pipeline_state(vpipe, training['validate_pipeline'])
+    if (checkpoints := training.get('checkpoints', None)) is not None:
+        manager.load_state_dict(checkpoints)
+    
+    batch = training['batch']
+    if batch is None:
+        return epoch + 1, 0, training['loop']
+    
+    # part way through an epoch, so carry on from the next batch
+    sampler = get_root(tpipe).sampler()
+    sampler.set_epoch(sampler.epoch, batch)
+    
+    return epoch, batch, training['loop']
 
 
 def run():
@@ -120,9 +218,14 @@ def run():
     import torch
     from herbarium.config import instantiate, build_pipeline
     from herbarium.nodes import iter_fwd, get_root
-    from herbarium.utils import progress
+    from herbarium.model import distributed, CheckpointManager
+    from herbarium.utils import progress, resolve_metrics
+    from herbarium.utils.distributed import init_distributed, shutdown_distributed, get_world_size, broadcast_object
     
-    cfg, start = parse_cmdline()
+    # a no-op unless started by train-ddp or torchrun
+    init_distributed()
+    
+    cfg, resume_file, start = parse_cmdline()
     print(f"start at: {start.isoformat(sep=' ', timespec='seconds')}")
     
     instances = {}
@@ -134,7 +237,8 @@ def run():
     if instances.get('model', None) is None:
         raise ValueError("missing model in configuration")
     
-    model = instances.get('model')               # required at top level of config
+    # the pipelines get the distributed model; the optimizer already has its parameters
+    model = instances['model'] = distributed(instances.get('model'))  # required at top level of config
     optimizer = instances.get('optimizer', None) # optional at top level of config
     
     num_epochs = cfg['runtime']['num_epochs']
@@ -144,6 +248,7 @@ def run():
     
     tpipe = build_pipeline(cfg['train_pipeline'], instances)
     troot = get_root(tpipe)
+    trainer = find_trainer(tpipe)
     vpipe = build_pipeline(cfg['validate_pipeline'], instances)
     
     check_data(tpipe, vpipe)
@@ -151,11 +256,29 @@ def run():
     snapshot_enabled = cfg['runtime']['snapshots']['enabled']
     snapshot_start = cfg['runtime']['snapshots']['start']
     snapshot_rate = cfg['runtime']['snapshots']['rate']
-    last_snapshot = -1
+    snapshot_batch_rate = cfg['runtime']['snapshots'].get('batch_rate', 0)
+    snapshot_keep_last = cfg['runtime']['snapshots'].get('keep_last', 0)
+    snapshot_keep_best = cfg['runtime']['snapshots'].get('keep_best', 0)
+    snapshot_strip = cfg['runtime']['snapshots'].get('strip_optimizer', False)
     
     save_best = cfg['runtime']['save_best']['enabled']
     save_best_start = cfg['runtime']['save_best']['start']
-    save_best_value = sys.maxsize
+    
+    # the state of the loop, saved in the snapshots
+    loop = {
+        'last_snapshot': -1,
+        'save_best_value': sys.maxsize,
+        'elapsed': 0.0,
+    }
+    
+    # snapshots are written in the background and pruned; see herbarium.model.checkpoint
+    manager = CheckpointManager(run_dir, keep_last=snapshot_keep_last, keep_best=snapshot_keep_best,
+                                    strip_optimizer=snapshot_strip)
+    
+    start_epoch, start_batch = 0, 0
+    if resume_file is not None:
+        start_epoch, start_batch, loop = resume_state(resume_file, model, optimizer, tpipe, vpipe, manager)
+        print(f"resuming at epoch {start_epoch}, batch {start_batch}")
     
     print(f"model: {model.fullname}")
     
@@ -168,6 +291,12 @@ def run():
         print(f"- {n.fullname}")
 
     print(f"snapshots: {'enabled' if snapshot_enabled else 'disabled'}")
+    if snapshot_batch_rate > 0:
+        print(f"snapshots: every {snapshot_batch_rate} batches")
+    if snapshot_keep_last > 0 or snapshot_keep_best > 0:
+        print(f"snapshots: keep last {snapshot_keep_last}, keep best {snapshot_keep_best}")
+    if snapshot_strip:
+        print("snapshots: without the optimizer")
     print(f"save best: {'enabled' if save_best else 'disabled'}")
     
     if num_epochs > 0:
@@ -178,24 +307,48 @@ def run():
     use_amp = cfg['runtime'].get('use_amp', False)
     print(f"amp: {'enabled' if use_amp else 'disabled'}")
     print(f"running on {model.device}")
-
-    startstamp = time.time()
-    for epoch in count():
+    
+    world_size = get_world_size()
+    if world_size > 1:
+        print(f"ranks: {world_size}")
+    
+    throughput = []
+    
+    epoch = start_epoch
+    startstamp = time.time() - loop['elapsed']*60
+    for epoch in count(start_epoch):
         if num_epochs > 0 and epoch >= num_epochs:
             print("epoch limit reached")
             break
         if max_runtime > 0:
-            elapsed = (time.time() - startstamp)/60
+            # the ranks must stop together, so they go by rank 0's clock
+            elapsed = broadcast_object((time.time() - startstamp)/60)
             if elapsed > max_runtime:
                 print("runtime limit reached")
                 break
-
-        troot.shuffle()
+        
+        # a resumed epoch carries on from where its snapshot was taken
+        if epoch != start_epoch or start_batch == 0:
+            troot.shuffle()
         
         print(f"Epoch: {epoch:03d}")
+        snapshot_batch = start_batch if epoch == start_epoch else 0
         for idx, item in progress(tpipe, header="Train", end=""):
-            pass
+            # the position is the loader batches the Trainer has consumed, which can be more
+            #  than the items it's yielded. The snapshots are taken once the optimizer has 
+            #  stepped, so no accumulated gradients are lost, and none for the last batch; the
+            #  epoch's snapshots follow it
+            batch = trainer.batches
+            due = snapshot_batch_rate > 0 and batch - snapshot_batch >= snapshot_batch_rate
+            if snapshot_enabled and due and item.get('stepped', True) and batch < len(tpipe):
+                snapshot_batch = batch
+                loop['elapsed'] = (time.time() - startstamp)/60
+                snapshot_state(run_dir, manager, epoch, model, optimizer, None, batch=batch,
+                                training=training_state(batch, tpipe, vpipe, loop))
         if metrics := item.get('metrics', None):
+            metrics = resolve_metrics(metrics)
+            if images_per_sec := metrics.get('images_per_sec', None):
+                throughput.append(images_per_sec)
             if lr := metrics.get('lr', None):
                 print(f" lr={lr:0.2e}", end="")
             for k, v in metrics.items():
@@ -213,6 +366,7 @@ def run():
             for idx, item in progress(vpipe, header="Vdate", end=""):
                 pass
         if metrics := item.get('metrics', None):
+            metrics = resolve_metrics(metrics)
             for k, v in metrics.items():
                 if isinstance(v, torch.Tensor) and v.numel() > 1:
                     continue
@@ -222,26 +376,43 @@ def run():
                     print(f" {k}={v}", end="")
         print("")
         
+        loop['elapsed'] = (time.time() - startstamp)/60
+        
         if save_best and epoch >= save_best_start:
             if metrics := item.get('metrics', None):
                 loss = metrics['loss']
-                if loss <= save_best_value:
-                    snapshot_state(run_dir, epoch, model, None, metrics)
-                    save_best_value = loss
-                    last_snapshot = epoch
+                if loss <= loop['save_best_value']:
+                    loop['save_best_value'] = loss
+                    loop['last_snapshot'] = epoch
+                    snapshot_state(run_dir, manager, epoch, model, optimizer, metrics,
+                                    training=training_state(None, tpipe, vpipe, loop))
         
-        if snapshot_enabled and epoch >= snapshot_start and last_snapshot != epoch:
+        if snapshot_enabled and epoch >= snapshot_start and loop['last_snapshot'] != epoch:
             if (epoch-snapshot_start) % snapshot_rate == 0:
                 metrics = item.get('metrics', None)
-                last_snapshot = epoch
-                snapshot_state(run_dir, epoch, model, None, metrics)
+                loop['last_snapshot'] = epoch
+                snapshot_state(run_dir, manager, epoch, model, optimizer, metrics,
+                                training=training_state(None, tpipe, vpipe, loop))
         
-    if last_snapshot != epoch - 1:
+    if loop['last_snapshot'] != epoch - 1 and epoch > start_epoch:
         metrics = item.get('metrics', None)
-        snapshot_state(run_dir, epoch-1, model, None, metrics)
+        loop['last_snapshot'] = epoch - 1
+        snapshot_state(run_dir, manager, epoch-1, model, optimizer, metrics,
+                        training=training_state(None, tpipe, vpipe, loop))
+    
+    manager.close()
+    if stats := manager.stats():
+        print(f"snapshots: {stats['count']} written, {stats['size']/2**20:0.1f} MB, {stats['copy_time']:0.2f}s to copy, {stats['write_time']:0.2f}s to write")
 
+    # 'train-ddp --scaling' reads this line
+    if len(throughput) > 0:
+        images_per_sec = sum(throughput) / len(throughput)
+        print(f"throughput: {images_per_sec:0.1f} images/sec, {world_size} ranks, {images_per_sec/world_size:0.1f} images/sec/rank")
+    
     end = datetime.now()
     print(f"finish at: {end.isoformat(sep=' ', timespec='seconds')}")
     
     duration = end - start
     print(f"run time: {duration}")
+    
+    shutdown_distributed()
@@ -0,0 +1 @@
+from .train_ddp import run
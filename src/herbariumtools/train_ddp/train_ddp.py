@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+def parse_cmdline():
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        description="runs 'train' in a process per rank; the arguments after the options are passed to 'train'")
+    parser.add_argument('-n', '--nproc-per-node', help='number of processes on this node', type=int, default=2)
+    parser.add_argument('--nnodes', help='number of nodes', type=int, default=1)
+    parser.add_argument('--node-rank', help='rank of this node', type=int, default=0)
+    parser.add_argument('--master-addr', help='address of the node with rank 0', type=str, default="127.0.0.1")
+    parser.add_argument('--master-port', help='port on the node with rank 0', type=int, default=29500)
+    parser.add_argument('--scaling', help='comma separated process counts to compare the throughput of', type=str, default=None)
+    parser.add_argument('train_args', help="arguments for 'train'", nargs=argparse.REMAINDER)
+    
+    args = parser.parse_args()
+    
+    if len(args.train_args) > 0 and args.train_args[0] == "--":
+        args.train_args = args.train_args[1:]
+    
+    if args.scaling is not None:
+        if args.nnodes != 1:
+            raise ValueError("scaling runs are on a single node")
+        args.scaling = [int(n) for n in args.scaling.split(',')]
+    
+    return args
+
+
+def launch(nproc, nnodes, node_rank, master_addr, master_port, train_args):
+    import sys, os, time
+    import subprocess
+    import threading
+    
+    world_size = nproc * nnodes
+    
+    # torchrun runs with one thread per process by default; share out the cores instead
+    num_threads = os.environ.get("OMP_NUM_THREADS", str(max(1, os.cpu_count() // nproc)))
+    
+    procs = []
+    for local_rank in range(nproc):
+        env = os.environ.copy()
+        env.update({
+            'MASTER_ADDR': master_addr,
+            'MASTER_PORT': str(master_port),
+            'WORLD_SIZE': str(world_size),
+            'RANK': str(node_rank * nproc + local_rank),
+            'LOCAL_RANK': str(local_rank),
+            'LOCAL_WORLD_SIZE': str(nproc),
+            'OMP_NUM_THREADS': num_threads,
+        })
+        
+        # rank 0's output is read here, so the throughput can be picked out of it
+        stdout = subprocess.PIPE if local_rank == 0 else None
+        cmd = [sys.executable, "-c", "from herbariumtools.train import run; run()"] + train_args
+        procs.append(subprocess.Popen(cmd, env=env, stdout=stdout, text=True))
+    
+    # rank 0's output is read on a thread, so the processes can be watched here
+    throughput = []
+    def read_output():
+        for line in procs[0].stdout:
+            print(line, end="", flush=True)
+            if line.startswith("throughput:"):
+                throughput.append(float(line.split()[1]))
+    
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+    
+    # if any rank fails, the others would wait for it forever, so they're stopped as soon as
+    #  one exits with an error
+    failed = False
+    while failed == False and any(proc.poll() is None for proc in procs):
+        failed = any(proc.poll() not in (None, 0) for proc in procs)
+        if failed == False:
+            time.sleep(0.5)
+    
+    failed = failed or any(proc.returncode != 0 for proc in procs)
+    if failed:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs:
+            proc.wait()
+    
+    reader.join()
+    
+    if failed:
+        raise RuntimeError("a rank failed; see the output above")
+    
+    return throughput[-1] if len(throughput) > 0 else None
+
+
+def run():
+    args = parse_cmdline()
+    
+    if args.scaling is None:
+        launch(args.nproc_per_node, args.nnodes, args.node_rank, args.master_addr, args.master_port, args.train_args)
+        return
+    
+    # each count is a separate training run, so they need separate run ids
+    if "-r" in args.train_args or "--run-id" in args.train_args:
+        raise ValueError("can't set the run id when comparing scaling")
+    
+    results = []
+    for nproc in args.scaling:
+        print(f"=== {nproc} ranks")
+        throughput = launch(nproc, 1, 0, args.master_addr, args.master_port, args.train_args)
+        if throughput is None:
+            raise RuntimeError("no throughput reported; is the batch limit too small?")
+        results.append((nproc, throughput))
+    
+    # the efficiency is the throughput per rank relative to the first count
+    base_nproc, base_throughput = results[0]
+    base_per_rank = base_throughput / base_nproc
+    
+    print("scaling:")
+    print(f"{'ranks':>6} {'images/sec':>11} {'per rank':>9} {'speedup':>8} {'efficiency':>11}")
+    for nproc, throughput in results:
+        print(f"{nproc:>6} {throughput:>11.1f} {throughput/nproc:>9.1f} {throughput/base_throughput:>8.2f}"
+                f" {throughput/nproc/base_per_rank:>11.2%}")
@@ -12,6 +12,7 @@ def parse_cmdline():
     parser.add_argument('-b', '--batch-size', help='batch size', type=int, default=12)
     parser.add_argument('-l', '--batch-limit', help='max batches per epoch (0 = no limit)', type=int, default=0)
     parser.add_argument('-w', '--num-workers', help='number of workers to use', type=int, default=-1)
+    parser.add_argument('-p', '--compare-precision', help='validate at each precision and compare', action='store_true')
     parser.add_argument('config_file', help='configuration file to load (- for stdin)', type=str, default=None)
     parser.add_argument('weights_file', help='weights file to load', type=str, default=None)    
     parser.add_argument('variables', help='key=value variables for template expansion', type=str, nargs='*', default=None)
@@ -46,7 +47,7 @@ def parse_cmdline():
     
     cfg = load_config(args.config_file, **options)
     
-    return cfg, now
+    return cfg, now, args.compare_precision
 
 
 def run():
@@ -57,9 +58,9 @@ def run():
     import herbarium
     from herbarium.config import instantiate, build_pipeline
     from herbarium.nodes import iter_fwd, get_root
-    from herbarium.utils import progress
+    from herbarium.utils import progress, resolve_metrics
     
-    cfg, start = parse_cmdline()
+    cfg, start, compare = parse_cmdline()
     print(f"start at: {start.isoformat(sep=' ', timespec='seconds')}")
     
     instances = {}
@@ -74,7 +75,7 @@ def run():
     
     print(f"model: {model.fullname}")
 
-    vpipe = build_pipeline(cfg['validate_pipeline'], instances)
+    vpipe = build_pipeline(use_calibration(cfg['validate_pipeline'], instances), instances)
     
     print("validate pipeline:")
     for n in iter_fwd(vpipe):
@@ -84,11 +85,16 @@ def run():
         print(f"- {n.fullname}")
     
     print(f"running on {model.device}")
+    
+    if compare:
+        compare_precision(cfg, instances, model)
+        return
 
     with torch.no_grad():
         for idx, item in progress(vpipe, header="Vdate", end=""):
             pass
     if metrics := item.get('metrics', None):
+        metrics = resolve_metrics(metrics)
         for k, v in metrics.items():
             if isinstance(v, torch.Tensor) and v.numel() > 1:
                 continue
@@ -97,4 +103,88 @@ def run():
             else:
                 print(f" {k}={v}", end="")
     print("")
+
+    if hasattr(model, "member_latencies"):
+        print("member latency:")
+        for idx, (name, latency) in enumerate(model.member_latencies()):
+            print(f"- {idx} {name}: {latency:0.1f} ms/batch")
+        if (stats := model.cache_stats()) is not None:
+            print(f"feature cache: {stats[0]} hits, {stats[1]} misses")
+        
+
+
+def compare_precision(cfg, instances, model):
+    import copy
+    import torch
+    import herbarium
+    from herbarium.config import build_pipeline
+    from herbarium.nodes import iter_fwd
+    from herbarium.utils import progress, resolve_metrics
+    from herbarium.model.quantize import precisions
+    
+    results = []
+    for precision in precisions:
+        if precision.endswith("int8") and model.device.type != "cpu":
+            print(f"skipping {precision}: cpu only")
+            continue
+        
+        config = copy.deepcopy(cfg['validate_pipeline'])
+        for node in config:
+            if node['__target__'].endswith(".Validator"):
+                node['precision'] = precision
+        
+        vpipe = build_pipeline(use_calibration(config, instances), instances)
+        for n in iter_fwd(vpipe):
+            if isinstance(n, herbarium.nodes.logger.Logger):
+                vpipe = n
+                break
+        
+        with torch.no_grad():
+            for idx, item in progress(vpipe, header=f"{precision:>12}"):
+                pass
         
+        results.append((precision, resolve_metrics(item['metrics'])))
+    
+    # against the first, fp32, run
+    _, base = results[0]
+    
+    print(f"{'precision':>12} {'accuracy':>9} {'delta':>8} {'f1_score':>9} {'delta':>8} {'images/sec':>11} {'speedup':>8}")
+    for precision, metrics in results:
+        print(f"{precision:>12}"
+                f" {metrics['accuracy']:>9.4f} {metrics['accuracy'] - base['accuracy']:>+8.4f}"
+                f" {metrics['f1_score']:>9.4f} {metrics['f1_score'] - base['f1_score']:>+8.4f}"
+                f" {images_per_sec(metrics, base)}")
+
+
+def images_per_sec(metrics, base):
+    # there's no throughput when every batch was part of the warm up
+    ips, base_ips = metrics.get('images_per_sec', None), base.get('images_per_sec', None)
+    if ips is None:
+        return f"{'n/a':>11} {'n/a':>8}"
+    if base_ips is None:
+        return f"{ips:>11.1f} {'n/a':>8}"
+    return f"{ips:>11.1f} {ips / base_ips:>8.2f}"
+
+
+def use_calibration(config, instances):
+    import sys, copy
+    from herbarium.config import build_pipeline
+    
+    # static-int8 is calibrated on batches from the training split rather than the ones being
+    #  validated, read through the same nodes that come before the Validator
+    config = copy.deepcopy(config)
+    for idx, node in enumerate(config):
+        if node['__target__'].endswith(".Validator") == False or node.get('precision', None) != "static-int8":
+            continue
+        
+        nodes = config[:idx]
+        if len(nodes) == 0 or 'split' not in nodes[0]:
+            print("warning: no split to calibrate on; calibrating on the batches validated", file=sys.stderr)
+            continue
+        
+        nodes = copy.deepcopy(nodes)
+        nodes[0]['split'] = "train"
+        instances['calibration_pipeline'] = build_pipeline(nodes, instances)
+        node['calibration'] = {'__instance__': 'calibration_pipeline'}
+    
+    return config
@@ -14,6 +14,13 @@ predict -b 96 -w 4 "${TRIAL_DIR}/predict.yaml" snapshots/${stamp}-train/${stamp}
 swaify -b 96 -w 6 "${TRIAL_DIR}/swaify.yaml" herbarium.model.mobilenet_v3_large snapshots/${stamp}-train/${stamp}-train-1?.pt
 predict -b 96 -w 4 "${TRIAL_DIR}/predict.yaml" snapshots/${stamp}-train/${stamp}-train-14-swa.pt
 
+export-model -s 336x336 "${TRIAL_DIR}/predict.yaml" snapshots/${stamp}-train/${stamp}-train-14-swa.pt
+predict -b 96 -w 4 "${TRIAL_DIR}/predict-exported.yaml" snapshots/${stamp}-train/${stamp}-train-14-swa.ts
+
+extract-features -b 96 -w 6 "${TRIAL_DIR}/extract.yaml" snapshots/${stamp}-train/${stamp}-train-14.pt \
+                    ~/Projects/datasets/fgvc9-herbarium-2022/train_features_${stamp}
+train -e 15 -b 1024 -r ${stamp}-head "${TRIAL_DIR}/config-head.yaml" feature_dir=train_features_${stamp} label_smoothing=0.1
+
 
 # ---------------------------------------------------------------------------------------------
 # label smoothing
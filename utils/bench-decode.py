@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Measures JPEG decode speed on a single core, decoding fully and with draft mode at each of
+#  the given sizes, which is what the dataset nodes do with and without 'decode_size'.
+import argparse
+import os.path
+import glob
+import time
+
+import numpy as np
+
+from herbarium.nodes.data.decode import open_image
+
+
+def bench(paths, decode_size, repeats):
+    # one pass first so the files are in the page cache and we time the decode, not the disk
+    for path in paths:
+        with open(path, "rb") as f:
+            f.read()
+
+    best = 0
+    shape = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for path in paths:
+            image = np.asarray(open_image(path, decode_size).convert("RGB"))
+            shape = image.shape
+        duration = time.perf_counter() - start
+        best = max(best, len(paths)/duration)
+
+    return best, shape
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--num-images', help='number of images to decode', type=int, default=200)
+    parser.add_argument('-r', '--repeats', help='number of times to repeat, keeping the best', type=int, default=3)
+    parser.add_argument('-s', '--sizes', help='decode sizes to test', type=int, nargs='+', default=[500, 336, 224])
+    parser.add_argument('image_dir', help='directory of jpeg images, searched recursively', type=str)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmdline()
+
+    image_dir = os.path.expanduser(args.image_dir)
+    paths = sorted(glob.glob(os.path.join(image_dir, "**", "*.jpg"), recursive=True))[:args.num_images]
+    if len(paths) == 0:
+        print(f"no images found in {image_dir}")
+        return
+
+    print(f"decoding {len(paths)} images on one core")
+    print(f"{'decode_size':>12} {'shape':>16} {'images/sec':>12} {'speedup':>8}")
+
+    full = None
+    for decode_size in [None] + args.sizes:
+        rate, shape = bench(paths, decode_size, args.repeats)
+        if full is None:
+            full = rate
+
+        label = "full" if decode_size is None else str(decode_size)
+        print(f"{label:>12} {str(shape):>16} {rate:>12.1f} {rate/full:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
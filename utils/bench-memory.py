@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Compares the memory used by each DataLoader worker when the dataset keeps a python dict per image
+#  (the old layout) against the array backed annotations. Each worker iterates its share of the
+#  dataset and then reports its RSS and private dirty memory (the copy-on-write pages it has
+#  touched). Linux only; reads /proc/self.
+import argparse
+
+import numpy as np
+from torch.utils.data import IterableDataset
+
+from herbarium.nodes.node import Node
+from herbarium.nodes.data import HerbariumDataset, DataLoader
+
+
+class DictDataset(HerbariumDataset):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._annotations = {}
+        for row in self._images.tolist():
+            item = self._make_item(row)
+            self._annotations[item['image_id']] = item
+        self._images = [self._index.image_id[row].item() for row in self._images.tolist()]
+
+    def __iter__(self):
+        for idx in self._sampler.indices().tolist():
+            yield self._annotations[self._images[idx]].copy()
+
+
+class MemoryProbe(IterableDataset, Node):
+    def __init__(self, inode):
+        IterableDataset.__init__(self)
+        Node.__init__(self, inode)
+
+    def __iter__(self):
+        count = 0
+        for item in self.inode:
+            count += 1
+
+        usage = memory_usage()
+        usage['count'] = count
+        yield usage
+
+
+def memory_usage():
+    usage = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                usage['rss'] = int(line.split()[1])
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Private_Dirty:"):
+                usage['private_dirty'] = int(line.split()[1])
+            elif line.startswith("Pss:"):
+                usage['pss'] = int(line.split()[1])
+    return usage
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--num-workers', help='worker counts to test', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('dsroot', help='root of the dataset', type=str, nargs='?', default="~/Projects/datasets/fgvc9-herbarium-2022")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmdline()
+
+    print(f"{'layout':>8} {'workers':>8} {'rss MB':>10} {'pss MB':>10} {'dirty MB':>10}")
+    for klass, name in ((DictDataset, "dicts"), (HerbariumDataset, "arrays")):
+        ds = klass(args.dsroot, "train", 32, load_images=False)
+
+        for num_workers in args.num_workers:
+            loader = DataLoader(MemoryProbe(ds), num_workers=num_workers, batch_size=None)
+            results = list(loader)
+
+            assert sum(r['count'] for r in results) == len(ds)
+
+            rss = np.mean([r['rss'] for r in results]) / 1024
+            pss = np.mean([r['pss'] for r in results]) / 1024
+            dirty = np.mean([r['private_dirty'] for r in results]) / 1024
+            print(f"{name:>8} {num_workers:>8} {rss:>10.1f} {pss:>10.1f} {dirty:>10.1f}")
+
+        del ds
+
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,11 @@ def parse_cmdline():
 
 
 def check_state(state_file):
-    import torch
+    from herbarium.model import read_state_file
     
     print(f"checking {state_file}")
     
-    state = torch.load(state_file, map_location="cpu")
+    state = read_state_file(state_file, "cpu")
     model = state['model']
     
     for k, v in model.items():
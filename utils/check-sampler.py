@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Checks that every image is visited exactly once per epoch, and in the same order, for any
+#  number of workers, and that an epoch resumed part way through visits exactly the rest. With
+#  the images grouped into shards, also checks that the shards are read in sequence.
+import argparse
+
+import numpy as np
+
+from herbarium.nodes.data import HerbariumDataset, ShardDataset, DataLoader
+from herbarium.nodes.data.sampler import ShardedSampler
+
+
+def check_sampler():
+    print("checking sampler...")
+
+    checked = 0
+    for length in [0, 1, 7, 100, 101, 1000]:
+        for batch_size in [1, 4, 16, 33]:
+            for num_workers in range(1, 10):
+                sampler = ShardedSampler(length, batch_size, seed=17)
+                for epoch in range(3):
+                    check_epoch(sampler, epoch, length, batch_size, num_workers)
+                    checked += 1
+
+    print(f"- checked {checked} combinations")
+
+
+def check_epoch(sampler, epoch, length, batch_size, num_workers):
+    sampler.set_epoch(epoch)
+    order = sampler.order()
+
+    # exactly once across the workers
+    indices = np.concatenate([sampler.indices(w, num_workers) for w in range(num_workers)])
+    assert len(indices) == length
+    assert np.array_equal(np.sort(indices), np.arange(length))
+
+    # the DataLoader takes a batch from each worker in turn
+    assert np.array_equal(interleave(sampler, batch_size, num_workers), order)
+
+    # resuming from each position visits exactly the rest of the epoch
+    for position in range(sampler.num_batches()+1):
+        sampler.set_epoch(epoch, position)
+        assert np.array_equal(interleave(sampler, batch_size, num_workers), order[position*batch_size:])
+
+    sampler.set_epoch(epoch)
+
+
+def check_shards():
+    print("checking shard reads...")
+
+    rng = np.random.default_rng(5)
+
+    checked = 0
+    for length in [0, 1, 100, 1000]:
+        for num_shards in [1, 3, 17]:
+            shards = rng.integers(num_shards, size=length)
+            offsets = rng.permutation(length)
+
+            for window in [0, 8, 64]:
+                for num_workers in [1, 3]:
+                    sampler = ShardedSampler(length, 16, seed=17)
+                    sampler.set_groups(shards, offsets, window=window)
+
+                    # the same epochs without the mixing, to compare with
+                    unmixed = ShardedSampler(length, 16, seed=17)
+                    unmixed.set_groups(shards, offsets)
+
+                    for epoch in range(3):
+                        check_epoch(sampler, epoch, length, 16, num_workers)
+
+                        unmixed.set_epoch(epoch)
+                        check_sequential(sampler, unmixed.order(), shards, offsets, window, num_workers)
+                        checked += 1
+
+    print(f"- checked {checked} combinations")
+
+
+def check_sequential(sampler, unmixed, shards, offsets, window, num_workers):
+    # each shard is visited in one run, in offset order, before the mixing
+    runs = shards[unmixed]
+    starts = np.concatenate([[True], runs[1:] != runs[:-1]]) if len(runs) > 0 else runs
+    assert len(set(runs[starts].tolist())) == starts.sum(), "a shard is visited more than once"
+    same = runs[1:] == runs[:-1]
+    assert (offsets[unmixed][1:][same] > offsets[unmixed][:-1][same]).all(), "a shard is read out of order"
+
+    # the position of each image in the sequence
+    sequence = np.empty(len(unmixed), dtype=np.int64)
+    sequence[unmixed] = np.arange(len(unmixed))
+
+    # the mixing only moves an image within its window
+    order = sampler.order()
+    assert (np.abs(sequence[order] - np.arange(len(order))) < max(window, 1)).all(), "an image moved out of its window"
+
+    # each worker reads the images of a batch in offset order, so the reads only go back
+    #  within a window
+    batch_size = 16
+    for w in range(num_workers):
+        indices = sampler.indices(w, num_workers)
+        reads = np.concatenate([np.sort(sequence[indices[start:start+batch_size]])
+                                    for start in range(0, len(indices), batch_size)] + [np.arange(0)])
+        assert (np.diff(reads) > -max(window, 1)).all(), f"worker {w} reads go back more than the window"
+
+
+def interleave(sampler, batch_size, num_workers):
+    streams = [list(sampler.indices(w, num_workers)) for w in range(num_workers)]
+
+    merged = []
+    while any(len(s) > 0 for s in streams):
+        for s in streams:
+            merged.extend(s[:batch_size])
+            del s[:batch_size]
+
+    return np.array(merged, dtype=np.int64)
+
+
+def check_loader(dsroot, max_workers, shard_dir):
+    print("checking dataloader...")
+
+    if shard_dir is None:
+        ds = HerbariumDataset(dsroot, "train", 8, load_images=False)
+    else:
+        ds = ShardDataset(dsroot, "train", 8, shard_dir=shard_dir, load_images=False)
+    image_ids = ds.image_ids()
+
+    for epoch in range(2):
+        ds.shuffle()
+
+        expected = None
+        for num_workers in range(max_workers+1):
+            loader = DataLoader(ds, num_workers=num_workers, batch_size=8, collate_fn=collate_ids)
+            visited = [image_id for batch in loader for image_id in batch]
+
+            assert len(visited) == len(image_ids), f"{num_workers} workers: {len(visited)} != {len(image_ids)}"
+            assert set(visited) == set(image_ids), f"{num_workers} workers: images missed"
+
+            if expected is None:
+                expected = visited
+            assert visited == expected, f"{num_workers} workers: order differs"
+
+        print(f"- epoch {epoch}: {len(image_ids)} images, 0 to {max_workers} workers")
+
+
+def collate_ids(items):
+    return [item['image_id'] for item in items]
+
+
+def parse_cmdline():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--max-workers', help='max number of workers to check', type=int, default=6)
+    parser.add_argument('-s', '--shard-dir', help='check a ShardDataset reading this directory', type=str, default=None)
+    parser.add_argument('dsroot', help='check the DataLoader with this dataset', type=str, nargs='?', default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_cmdline()
+
+    check_sampler()
+    check_shards()
+    if args.dsroot is not None:
+        check_loader(args.dsroot, args.max_workers, args.shard_dir)
+
+
+if __name__ == "__main__":
+    main()
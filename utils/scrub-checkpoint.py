@@ -11,14 +11,15 @@ def parse_cmdline():
 
 
 def scrub_state(state_file):
-    import torch
+    from herbarium.model import read_state_file
+    from herbarium.model.checkpoint import atomic_save
     
     print(f"scrubbing {state_file}")
     
-    state = torch.load(state_file, map_location="cpu")
+    state = read_state_file(state_file, "cpu")
     if 'optimizer' in state:
         del state['optimizer']
-    torch.save(state, state_file)
+    atomic_save(state, state_file)
 
 
 def run():